@@ -0,0 +1,68 @@
+"""
+Bytes sent on the wire by RethinkDBModel.update, full document vs
+changed fields only.
+
+Runs offline: queries are serialized with the driver's own wire encoder.
+
+Run from the repository root with ``python -m benchmarks.changes``.
+"""
+
+import rethinkdb as r
+
+from rethinkdb import ql2_pb2
+from rethinkdb.net import Query
+
+from tornado_api import RethinkDBModel, Field
+
+
+class Address(RethinkDBModel):
+    street = Field()
+    city = Field()
+    zip = Field()
+
+
+def document_model(count=50):
+    attrs = { 'field_{0}'.format(i): Field() for i in range(count) }
+    attrs['address'] = Field(type=Address)
+    attrs['views'] = Field(type=int)
+    attrs['summary'] = Field(computed='get_summary')
+    attrs['get_summary'] = lambda self: self.field_0[:10]
+    return type('Document', (RethinkDBModel, ), attrs)
+
+
+def document(count=50):
+    values = { 'field_{0}'.format(i): 'value {0} '.format(i) * 10 for i in range(count) }
+    values.update(id='document', views=0, address={ 'street': 'street', 'city': 'city', 'zip': '00000' })
+    return values
+
+
+def wire_size(table, key, changes):
+    term = table.get(key).update(changes)
+    return len(Query(ql2_pb2.Query.QueryType.START, 1, term, { }).serialize())
+
+
+def bench_update_bytes(count=50):
+    Document = document_model(count)
+    table = r.db('test').table(Document._table)
+
+    model = Document.from_many([document(count)])[0]
+    model.views += 1
+
+    full = wire_size(table, 'document', model.serialize())
+    partial = wire_size(table, 'document', model._changes())
+
+    model._clean()
+    model.address.city = 'other'
+    nested = wire_size(table, 'document', model._changes())
+
+    return full, partial, nested
+
+
+def main():
+    for count in (10, 50):
+        full, partial, nested = bench_update_bytes(count)
+        print('{0:>3} fields  full {1:6d} B  counter {2:6d} B  nested {3:6d} B'.format(count, full, partial, nested))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Memory benchmark comparing dict-backed and slotted models.
+
+Run from the repository root with ``python -m benchmarks.memory``.
+"""
+
+import gc
+import tracemalloc
+
+from tornado_api import Model, Field
+
+
+def document_model(mode=False):
+
+    class Document(Model):
+        slotted = mode
+        title = Field()
+        author = Field()
+        body = Field()
+        views = Field(type=int)
+        score = Field(type=float)
+
+    return Document
+
+
+def bench_memory(count=100000, slotted=False):
+    Document = document_model(slotted)
+    documents = [
+        { 'id': str(i), 'title': 'title', 'author': 'author', 'body': 'body', 'views': i, 'score': 1.0 }
+        for i in range(count)
+    ]
+
+    gc.collect()
+    tracemalloc.start()
+    instances = list(map(Document, documents))
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    del instances
+    return size
+
+
+def main():
+    count = 100000
+    for slotted in (False, True):
+        size = bench_memory(count, slotted)
+        print('{0:>8} {1} instances  {2:8.2f} MiB  {3:6.1f} bytes/instance'.format(
+            'slotted' if slotted else 'dict', count, size / 2 ** 20, size / count
+        ))
+
+
+if __name__ == '__main__':
+    main()
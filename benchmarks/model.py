@@ -0,0 +1,88 @@
+"""
+Micro-benchmarks for building and serializing models.
+
+Run from the repository root with ``python -m benchmarks.model``.
+"""
+
+import timeit
+
+from tornado_api import Model, Field
+
+
+def wide_model(count=50, compiled=False):
+    attrs = { 'field_{0}'.format(i): Field() for i in range(count) }
+    attrs['compiled'] = compiled
+    return type('Wide', (Model,), attrs)
+
+
+def wide_document(count=50):
+    return { 'field_{0}'.format(i): 'value {0}'.format(i) for i in range(count) }
+
+
+def response_model(mode=False):
+
+    class Address(Model):
+        compiled = mode
+        street = Field()
+        city = Field()
+        zip = Field()
+
+    class User(Model):
+        compiled = mode
+        name = Field()
+        email = Field()
+        age = Field(type=int)
+        address = Field(type=Address)
+        display = Field(computed='get_display')
+        tags = Field(type=list)
+
+        def get_display(self):
+            return self.name
+
+    return User
+
+
+def response_document():
+    return {
+        'id': 'user',
+        'name': 'name',
+        'email': 'name@example.com',
+        'age': 42,
+        'address': { 'street': 'street', 'city': 'city', 'zip': '00000' },
+        'tags': ['a', 'b']
+    }
+
+
+def bench_construct_wide(number=2000, count=50, compiled=False):
+    Wide = wide_model(count, compiled)
+    document = wide_document(count)
+    return timeit.timeit(lambda: Wide(dict(document)), number=number) / number
+
+
+def bench_serialize_wide(number=2000, count=50, compiled=False):
+    Wide = wide_model(count, compiled)
+    instance = Wide(wide_document(count))
+    return timeit.timeit(instance.serialize, number=number) / number
+
+
+def bench_serialize_response(number=20000, compiled=False):
+    User = response_model(compiled)
+    instance = User(response_document())
+    return timeit.timeit(instance.serialize, number=number) / number
+
+
+def main():
+    for compiled in (False, True):
+        mode = 'compiled' if compiled else 'generic'
+        for count in (10, 50):
+            construct = bench_construct_wide(count=count, compiled=compiled)
+            serialize = bench_serialize_wide(count=count, compiled=compiled)
+            print('{0:>8} {1:>3} fields  construct {2:8.2f} us  serialize {3:8.2f} us'.format(
+                mode, count, construct * 1e6, serialize * 1e6
+            ))
+        response = bench_serialize_response(compiled=compiled)
+        print('{0:>8} response    serialize {1:8.2f} us'.format(mode, response * 1e6))
+
+
+if __name__ == '__main__':
+    main()
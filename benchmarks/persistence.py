@@ -0,0 +1,76 @@
+"""
+Throughput benchmark for RethinkDBModel writes.
+
+Needs a RethinkDB server; connection options are read from the
+``RETHINKDB_HOST`` and ``RETHINKDB_PORT`` environment variables.
+
+Run from the repository root with ``python -m benchmarks.persistence``.
+"""
+
+import asyncio
+import os
+import time
+
+from tornado_api import RethinkDBModel, Field
+
+
+class BenchmarkDocument(RethinkDBModel):
+    db_options = {
+        'host': os.environ.get('RETHINKDB_HOST', 'localhost'),
+        'port': int(os.environ.get('RETHINKDB_PORT', 28015)),
+        'db': 'benchmarks'
+    }
+
+    title = Field()
+    body = Field()
+    views = Field(type=int)
+
+
+def documents(count):
+    return [ BenchmarkDocument(title='title', body='body', views=i) for i in range(count) ]
+
+
+async def bench_create(count=2000):
+    models = documents(count)
+    start = time.perf_counter()
+    for model in models:
+        await model.create()
+    return count / (time.perf_counter() - start)
+
+
+async def bench_create_many(count=2000, batch_size=200):
+    models = documents(count)
+    start = time.perf_counter()
+    await BenchmarkDocument.create_many(models, batch_size=batch_size)
+    return count / (time.perf_counter() - start)
+
+
+async def bench_delete_many(count=2000, batch_size=200):
+    models = documents(count)
+    await BenchmarkDocument.create_many(models, batch_size=batch_size)
+    start = time.perf_counter()
+    await BenchmarkDocument.delete_many(models, batch_size=batch_size)
+    return count / (time.perf_counter() - start)
+
+
+async def run():
+    await BenchmarkDocument.connect()
+
+    print('create       {0:10.0f} docs/sec'.format(await bench_create()))
+    for batch_size in (50, 200, 1000):
+        rate = await bench_create_many(batch_size=batch_size)
+        print('create_many  {0:10.0f} docs/sec  batch {1}'.format(rate, batch_size))
+    print('delete_many  {0:10.0f} docs/sec'.format(await bench_delete_many()))
+
+    await BenchmarkDocument.drop()
+    await BenchmarkDocument.close()
+
+
+def main():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(run())
+
+
+if __name__ == '__main__':
+    main()
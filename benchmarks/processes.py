@@ -0,0 +1,172 @@
+"""
+Multi-process harness: forks N workers the way a pre-forked Tornado
+deployment does and measures how throughput scales with N.
+
+The parent seeds the table and runs schema checks once through
+``tornado_api.process.prepare``, then forks.  Each worker builds its own
+event loop, warms up its own pools and reads and encodes documents for
+``--duration`` seconds.  Workers report the local ports of the sockets
+they used, and the run fails when two processes share one.
+
+Run from the repository root with ``python -m benchmarks.processes``::
+
+    python -m benchmarks.processes --workers 1 2 4
+    python -m benchmarks.processes --backend rethinkdb --output processes.json
+
+The default backend is in memory, which measures the model layer alone
+and opens no sockets, so the shared socket check is skipped and says so.
+``--backend rethinkdb`` needs a server reachable with the default options
+and is the only way to check fork safety.
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import time
+
+from tornado_api import database
+from tornado_api.backend import RethinkDBBackend
+from tornado_api.memory import MemoryBackend
+from tornado_api.process import prepare, warm_up
+
+from benchmarks.suite import document_model
+
+
+def _ports():
+    ports = set()
+    for pool in database.pools.values():
+        connections = list(map(lambda item: item[0], pool._idle)) + list(pool._used)
+        for connection in connections:
+            if connection.is_open():
+                ports.add(connection.client_port())
+    return ports
+
+
+async def _seed(Document, count):
+    await Document.drop()
+    await Document.create_many([ Document(id=str(i), title='title', body='body', views=i) for i in range(count) ])
+    await prepare([Document])
+
+
+async def _work(Document, count, duration):
+    await warm_up([Document])
+
+    ids = list(map(str, range(count)))
+    operations = 0
+    deadline = time.perf_counter() + duration
+
+    while time.perf_counter() < deadline:
+        models = await Document.read_many(ids)
+        Document.encode_many(models)
+        operations += len(models)
+
+    return { 'pid': os.getpid(), 'operations': operations, 'ports': sorted(_ports()) }
+
+
+def worker(Document, count, duration, queue):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        queue.put(loop.run_until_complete(_work(Document, count, duration)))
+    finally:
+        loop.close()
+
+
+def run(Document, workers, count, duration):
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+
+    processes = [ context.Process(target=worker, args=(Document, count, duration, queue)) for i in range(workers) ]
+    for process in processes:
+        process.start()
+
+    results = list(map(lambda process: queue.get(), processes))
+
+    for process in processes:
+        process.join()
+
+    return results
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='Measure throughput across forked worker processes.')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='worker counts to run')
+    parser.add_argument('--duration', type=float, default=2, help='seconds each run lasts')
+    parser.add_argument('--documents', type=int, default=100, help='documents read per batch')
+    parser.add_argument('--backend', choices=['memory', 'rethinkdb'], default='memory')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    options = parser.parse_args(arguments)
+
+    backend = MemoryBackend() if options.backend == 'memory' else RethinkDBBackend()
+    Document = document_model(backend)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(_seed(Document, options.documents))
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+
+    runs = { }
+    shared = [ ]
+    single = None
+    sockets = options.backend != 'memory'
+    unseen = [ ]
+
+    for workers in options.workers:
+        results = run(Document, workers, options.documents, options.duration)
+        throughput = sum(map(lambda result: result['operations'], results)) / options.duration
+
+        owners = { }
+        for result in results:
+            for port in result['ports']:
+                if port in owners:
+                    shared.append((port, owners[port], result['pid']))
+                owners[port] = result['pid']
+
+        if sockets and not owners:
+            unseen.append(workers)
+
+        single = single or throughput / workers
+        runs[workers] = {
+            'throughput': throughput,
+            'scaling': throughput / single,
+            'sockets': len(owners) if sockets else None,
+        }
+
+        print('{0:>3} workers {1:12.0f} documents/s  x{2:.2f}  sockets:{3}'.format(
+            workers,
+            throughput,
+            throughput / single,
+            len(owners) if sockets else '-'
+        ))
+
+    if not sockets:
+        print('shared socket check skipped: the memory backend opens no sockets, use --backend rethinkdb')
+
+    for port, first, second in shared:
+        print('shared socket: port {0} used by {1} and {2}'.format(port, first, second))
+
+    for workers in unseen:
+        print('no sockets seen with {0} workers, the shared socket check proved nothing'.format(workers))
+
+    if options.output:
+        with open(options.output, 'w') as handle:
+            json.dump({
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+                'backend': options.backend,
+                'runs': runs,
+            }, handle, indent=2, sort_keys=True)
+
+    return 1 if shared or unseen else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
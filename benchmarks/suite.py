@@ -0,0 +1,477 @@
+"""
+Benchmark suite for the model and persistence layers, with JSON output
+and a baseline comparison.
+
+Persistence cases run against the in-memory backend, so the suite needs
+no server and measures the model layer rather than the network.
+
+Run from the repository root with ``python -m benchmarks.suite``::
+
+    python -m benchmarks.suite --output results.json
+    python -m benchmarks.suite --baseline benchmarks/baseline.json --threshold 0.25
+    python -m benchmarks.suite --filter construct --save-baseline benchmarks/baseline.json
+
+Each case reports the best of ``--repeat`` runs in microseconds per
+operation.  With ``--baseline`` the process exits with status 1 when any
+case is slower than its baseline by more than ``--threshold``.
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import sys
+import time
+import timeit
+
+from tornado_api import Model, Field, RethinkDBModel
+from tornado_api.codec import Codec
+from tornado_api.memory import MemoryBackend
+
+
+cases = { }
+
+
+def case(name, number):
+    def decorator(function):
+        cases[name] = (function, number)
+        return function
+    return decorator
+
+
+def narrow_model(compiled=False):
+    return type('Narrow', (Model, ), {
+        'compiled': compiled,
+        'name': Field(),
+        'count': Field(type=int),
+        'active': Field(type=bool),
+    })
+
+
+def wide_model(count=50, compiled=False):
+    attrs = { 'field_{0}'.format(i): Field() for i in range(count) }
+    attrs['compiled'] = compiled
+    return type('Wide', (Model, ), attrs)
+
+
+def wide_document(count=50):
+    return { 'field_{0}'.format(i): 'value {0}'.format(i) for i in range(count) }
+
+
+def nested_model(depth=5, compiled=False, lazy=False):
+    model = type('Leaf', (Model, ), { 'compiled': compiled, 'value': Field(type=int) })
+    for level in range(depth):
+        model = type('Level{0}'.format(level), (Model, ), {
+            'compiled': compiled,
+            'lazy': lazy,
+            'name': Field(),
+            'child': Field(type=model),
+        })
+    return model
+
+
+def nested_document(depth=5):
+    document = { 'value': 1 }
+    for level in range(depth):
+        document = { 'name': 'level {0}'.format(level), 'child': document }
+    return document
+
+
+def computed_model(compiled=False, cached=False):
+
+    class Computed(Model):
+        first = Field()
+        last = Field()
+        price = Field(type=int)
+        quantity = Field(type=int)
+        name = Field(computed='get_name', cached=cached, depends=('first', 'last'))
+        total = Field(computed='get_total', computed_type=True, cached=cached, depends=('price', 'quantity'))
+
+        def get_name(self):
+            return '{0} {1}'.format(self.first, self.last)
+
+        def get_total(self):
+            return self.price * self.quantity
+
+    if compiled:
+        return type('Computed', (Computed, ), { 'compiled': True })
+    return Computed
+
+
+def computed_document():
+    return { 'first': 'first', 'last': 'last', 'price': 3, 'quantity': 7 }
+
+
+def order_model(compiled=False):
+
+    class Address(Model):
+        compiled = True
+        street = Field()
+        city = Field()
+        zip = Field(type=int)
+
+    class Customer(Model):
+        compiled = True
+        name = Field()
+        email = Field()
+        address = Field(type=Address)
+
+    class Order(Model):
+        number = Field(type=int)
+        status = Field()
+        paid = Field(type=bool)
+        items = Field(type=list)
+        customer = Field(type=Customer)
+        total = Field(computed='get_total', computed_type=True)
+
+        def get_total(self):
+            return sum(map(lambda item: item['price'] * item['quantity'], self.items))
+
+    if compiled:
+        return type('Order', (Order, ), { 'compiled': True })
+    return Order
+
+
+def order_document(number=1):
+    return {
+        'number': number,
+        'status': 'shipped',
+        'paid': True,
+        'items': [ { 'sku': 'sku-{0}'.format(i), 'price': 100 + i, 'quantity': i % 3 + 1 } for i in range(5) ],
+        'customer': {
+            'name': 'customer',
+            'email': 'customer@example.com',
+            'address': { 'street': 'street', 'city': 'city', 'zip': 12345 },
+        },
+    }
+
+
+def document_model(backend):
+    return type('Document', (RethinkDBModel, ), {
+        'backend': backend,
+        'title': Field(),
+        'body': Field(),
+        'views': Field(type=int, indexed=True),
+    })
+
+
+for compiled in (False, True):
+    mode = 'compiled' if compiled else 'generic'
+
+    def construct_narrow(number, compiled=compiled):
+        Narrow = narrow_model(compiled)
+        document = { 'name': 'name', 'count': 1, 'active': True }
+        return timeit.timeit(lambda: Narrow(dict(document)), number=number)
+
+    def construct_wide(number, compiled=compiled):
+        Wide = wide_model(50, compiled)
+        document = wide_document(50)
+        return timeit.timeit(lambda: Wide(dict(document)), number=number)
+
+    def construct_nested(number, compiled=compiled):
+        Nested = nested_model(5, compiled)
+        document = nested_document(5)
+        return timeit.timeit(lambda: Nested(dict(document)), number=number)
+
+    def serialize_computed(number, compiled=compiled):
+        instance = computed_model(compiled)(computed_document())
+        return timeit.timeit(instance.serialize, number=number)
+
+    def serialize_cached(number, compiled=compiled):
+        instance = computed_model(compiled, cached=True)(computed_document())
+        return timeit.timeit(instance.serialize, number=number)
+
+    def serialize_fields(number, compiled=compiled):
+        instance = computed_model(compiled)(computed_document())
+        return timeit.timeit(lambda: instance.serialize(fields=['first', 'price']), number=number)
+
+    def serialize_nested(number, compiled=compiled):
+        instance = nested_model(5, compiled)(nested_document(5))
+        return timeit.timeit(instance.serialize, number=number)
+
+    def validate_undefined(number, compiled=compiled):
+        Wide = wide_model(50, compiled)
+        document = dict(wide_document(50), undefined='value')
+
+        def attempt():
+            try:
+                Wide(dict(document))
+            except AttributeError:
+                pass
+
+        return timeit.timeit(attempt, number=number)
+
+    def validate_missing(number, compiled=compiled):
+        Required = type('Required', (Model, ), {
+            'compiled': compiled,
+            'name': Field(required=True),
+            'email': Field(required=True),
+        })
+        instance = Required(name='name')
+
+        def attempt():
+            try:
+                instance.serialize(verify=True)
+            except AttributeError:
+                pass
+
+        return timeit.timeit(attempt, number=number)
+
+    case('construct.narrow.' + mode, 20000)(construct_narrow)
+    case('construct.wide.' + mode, 2000)(construct_wide)
+    case('construct.nested.' + mode, 5000)(construct_nested)
+    case('serialize.computed.' + mode, 20000)(serialize_computed)
+    case('serialize.cached.' + mode, 20000)(serialize_cached)
+    case('serialize.fields.' + mode, 20000)(serialize_fields)
+    case('serialize.nested.' + mode, 5000)(serialize_nested)
+    case('validate.undefined.' + mode, 5000)(validate_undefined)
+    case('validate.missing.' + mode, 20000)(validate_missing)
+
+
+@case('validate.schema.valid', 20000)
+def validate_schema_valid(number):
+    User = nested_model(5)
+    document = nested_document(5)
+    return timeit.timeit(lambda: User.validate(document), number=number)
+
+
+@case('validate.schema.invalid', 20000)
+def validate_schema_invalid(number):
+    Wide = type('Wide', (Model, ), { 'count': Field(type=int), 'name': Field(required=True) })
+    document = { 'count': 'many', 'undefined': 'value' }
+
+    def attempt():
+        try:
+            Wide.validate(document)
+        except AttributeError:
+            pass
+
+    return timeit.timeit(attempt, number=number)
+
+
+for lazy in (False, True):
+    mode = 'lazy' if lazy else 'eager'
+
+    def read_nested(number, lazy=lazy):
+        Nested = nested_model(5, compiled=True, lazy=lazy)
+        documents = [ nested_document(5) for i in range(100) ]
+
+        def read():
+            for model in Nested.from_many(documents):
+                model.name
+                model.serialize()
+
+        return timeit.timeit(read, number=number // 100)
+
+    case('read.nested.' + mode, 5000)(read_nested)
+
+
+@case('encode.orders.serialize', 10000)
+def encode_serialize(number):
+    orders = order_model(compiled=True).from_many(map(order_document, range(100)))
+    return timeit.timeit(lambda: json.dumps(list(map(lambda order: order.serialize(), orders))), number=number // 100)
+
+
+# json is an alias for the fastest installed JSON codec
+for name in sorted(filter(lambda name: name != 'json', Codec.codecs)):
+
+    def encode_codec(number, name=name):
+        orders = order_model(compiled=True).from_many(map(order_document, range(100)))
+        codec = Codec.get(name)
+        return timeit.timeit(lambda: codec.encode_many(orders), number=number // 100)
+
+    def encode_stream(number, name=name):
+        orders = order_model(compiled=True).from_many(map(order_document, range(100)))
+        codec = Codec.get(name)
+        return timeit.timeit(lambda: b''.join(codec.iterencode(orders, 25)), number=number // 100)
+
+    def decode_codec(number, name=name):
+        Order = order_model(compiled=True)
+        encoded = Codec.get(name).encode_many(Order.from_many(map(order_document, range(100))))
+        return timeit.timeit(lambda: Order.decode_many(encoded, name), number=number // 100)
+
+    case('encode.orders.' + name, 10000)(encode_codec)
+    case('encode.stream.' + name, 10000)(encode_stream)
+    case('decode.orders.' + name, 10000)(decode_codec)
+
+
+@case('meta.class.wide', 200)
+def meta_class(number):
+    return timeit.timeit(lambda: wide_model(50), number=number)
+
+
+@case('meta.class.compiled', 200)
+def meta_class_compiled(number):
+    return timeit.timeit(lambda: wide_model(50, compiled=True), number=number)
+
+
+def _persistence(number, prepare, operation):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        Document = document_model(MemoryBackend())
+        state = loop.run_until_complete(prepare(Document, number))
+
+        async def run():
+            start = time.perf_counter()
+            await operation(Document, state)
+            return time.perf_counter() - start
+
+        return loop.run_until_complete(run())
+    finally:
+        loop.close()
+
+
+async def _models(Document, number):
+    return [ Document(id=str(i), title='title', body='body', views=i) for i in range(number) ]
+
+
+async def _stored(Document, number):
+    models = await _models(Document, number)
+    await Document.create_many(models)
+    return models
+
+
+@case('persistence.create', 2000)
+def persistence_create(number):
+
+    async def operation(Document, models):
+        for model in models:
+            await model.create()
+
+    return _persistence(number, _models, operation)
+
+
+@case('persistence.create_many', 2000)
+def persistence_create_many(number):
+
+    async def operation(Document, models):
+        await Document.create_many(models)
+
+    return _persistence(number, _models, operation)
+
+
+@case('persistence.read', 2000)
+def persistence_read(number):
+
+    async def operation(Document, models):
+        for model in models:
+            await Document.read(model.id)
+
+    return _persistence(number, _stored, operation)
+
+
+@case('persistence.read.only', 2000)
+def persistence_read_only(number):
+
+    async def operation(Document, models):
+        for model in models:
+            await Document.read(model.id, only=['views'])
+
+    return _persistence(number, _stored, operation)
+
+
+@case('persistence.update', 2000)
+def persistence_update(number):
+
+    async def operation(Document, models):
+        for model in models:
+            model.views += 1
+            await model.update()
+
+    return _persistence(number, _stored, operation)
+
+
+@case('persistence.query', 2000)
+def persistence_query(number):
+
+    async def operation(Document, models):
+        await Document.query().filter(title='title').order_by('views').all()
+
+    return _persistence(number, _stored, operation)
+
+
+@case('persistence.aggregate.hydrate', 2000)
+def persistence_aggregate_hydrate(number):
+
+    async def operation(Document, models):
+        views = { }
+        for model in await Document.query().all():
+            views[model.title] = views.get(model.title, 0) + model.views
+
+    return _persistence(number, _stored, operation)
+
+
+@case('persistence.aggregate.group', 2000)
+def persistence_aggregate_group(number):
+
+    async def operation(Document, models):
+        await Document.group_by('title', 'sum', 'views')
+
+    return _persistence(number, _stored, operation)
+
+
+def run(names, repeat):
+    results = { }
+    for name in names:
+        function, number = cases[name]
+        best = min(map(lambda i: function(number), range(repeat)))
+        results[name] = best / number * 1e6
+    return results
+
+
+def compare(results, baseline, threshold):
+    regressions = [ ]
+    for name, value in sorted(results.items()):
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        change = value / previous - 1
+        if change > threshold:
+            regressions.append((name, previous, value, change))
+    return regressions
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='Benchmark the model and persistence layers.')
+    parser.add_argument('--filter', default='', help='only run cases whose name contains this string')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per case, the best one is kept')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--baseline', help='compare against results stored in this JSON file')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed slowdown over the baseline')
+    parser.add_argument('--save-baseline', help='write results as a new baseline to this file')
+    options = parser.parse_args(arguments)
+
+    names = sorted(filter(lambda name: options.filter in name, cases))
+    results = run(names, options.repeat)
+
+    baseline = { }
+    if options.baseline:
+        with open(options.baseline) as handle:
+            baseline = json.load(handle)['results']
+
+    for name in names:
+        line = '{0:<32} {1:10.2f} us'.format(name, results[name])
+        if name in baseline:
+            line += '  {0:+7.1%}'.format(results[name] / baseline[name] - 1)
+        print(line)
+
+    output = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+
+    for path in filter(None, (options.output, options.save_baseline)):
+        with open(path, 'w') as handle:
+            json.dump(output, handle, indent=2, sort_keys=True)
+
+    regressions = compare(results, baseline, options.threshold)
+    for name, previous, value, change in regressions:
+        print('regression: {0} {1:.2f} us -> {2:.2f} us ({3:+.1%})'.format(name, previous, value, change))
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
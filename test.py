@@ -1,8 +1,26 @@
-from unittest import skip
+from unittest import skipUnless
+
+import os
+import json
+import asyncio
 
 import rethinkdb as r
 
-from tornado_api import AsyncTestCase, Model, Field, RethinkDBModel, database
+from concurrent.futures import ThreadPoolExecutor
+
+from tornado.testing import AsyncHTTPTestCase
+from tornado.web import Application
+
+from tornado_api import AsyncTestCase, Model, Field, ValidationError, RethinkDBModel, database, routes
+from tornado_api.rethinkdb import BatchSummary
+from tornado_api.cache import Cache
+from tornado_api.loader import Loader
+from tornado_api.feed import Feed
+from tornado_api.memory import MemoryBackend
+from tornado_api import metrics, codec
+from tornado_api.database import PoolTimeout
+from tornado_api.schema import Schema
+from tornado_api.process import prepare, warm_up
 
 
 class DatabaseTest(AsyncTestCase):
@@ -16,6 +34,55 @@ class DatabaseTest(AsyncTestCase):
         })
         self.assertEqual(expected, result)
 
+    async def test_check_fork(self):
+        calls = [ ]
+        hook = database.after_fork(lambda: calls.append(True))
+
+        try:
+            pool = database.pool({ 'db': 'fork' })
+            database.pid = -1
+
+            self.assertTrue(database.check_fork())
+            self.assertEqual(database.pid, os.getpid())
+            self.assertTrue(pool.closed)
+            self.assertEqual(database.pools, { })
+            self.assertEqual(calls, [True])
+
+            self.assertFalse(database.check_fork())
+            self.assertIsNot(database.pool({ 'db': 'fork' }), pool)
+        finally:
+            database.hooks.remove(hook)
+            database.pools.clear()
+
+    async def test_pool_loop(self):
+        pool = database.pool({ 'db': 'loop' })
+        self.assertIsNone(pool.loop)
+        self.assertIs(database.pool({ 'db': 'loop' }), pool)
+
+        other = asyncio.new_event_loop()
+        other.close()
+        pool.loop = other
+
+        try:
+            self.assertIsNot(database.pool({ 'db': 'loop' }), pool)
+            self.assertTrue(pool.closed)
+        finally:
+            database.pools.clear()
+
+    async def test_fork(self):
+        pool = database.pool({ 'db': 'fork' })
+
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0 if database.pid == os.getpid() and not database.pools and pool.closed else 1)
+
+        pid, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+        self.assertFalse(pool.closed)
+        self.assertIs(database.pool({ 'db': 'fork' }), pool)
+
+        database.pools.clear()
+
     async def test_connect(self):
         c = await database.connect(db='test', ssl={'cacerts': ''})
         self.assertTrue(c.is_open())
@@ -36,6 +103,59 @@ class DatabaseTest(AsyncTestCase):
         self.assertFalse(a.is_open())
         self.assertFalse(b.is_open())
 
+    async def test_connect_single_flight(self):
+        a, b = await asyncio.gather(database.connect(db='flight'), database.connect(db='flight'))
+        self.assertIs(a, b)
+        await database.close()
+
+    async def test_pool(self):
+        pool = database.pool({ 'db': 'test' }, min_size=2, max_size=4)
+        self.assertIs(pool, database.pool({ 'db': 'test' }))
+
+        async with pool.connection() as a:
+            self.assertTrue(a.is_open())
+            self.assertEqual(pool.size, 2)
+
+        async with pool.connection() as b:
+            self.assertIs(a, b)
+
+        await pool.close()
+        self.assertFalse(a.is_open())
+
+    async def test_pool_max_size(self):
+        pool = database.pool({ 'db': 'limited' }, min_size=1, max_size=1, timeout=0.1)
+
+        async with pool.connection():
+            with self.assertRaises(PoolTimeout):
+                await pool.acquire()
+
+        await pool.close()
+
+    async def test_pool_health_check(self):
+        pool = database.pool({ 'db': 'health' }, min_size=1, max_size=2)
+
+        async with pool.connection() as a:
+            pass
+
+        await a.close()
+
+        async with pool.connection() as b:
+            self.assertIsNot(a, b)
+            self.assertTrue(b.is_open())
+
+        await pool.close()
+
+    async def test_pool_idle_eviction(self):
+        pool = database.pool({ 'db': 'idle' }, min_size=1, max_size=4, idle=0)
+
+        connections = await asyncio.gather(pool.acquire(), pool.acquire(), pool.acquire())
+        for connection in connections:
+            await pool.release(connection)
+
+        self.assertEqual(pool.size, 1)
+
+        await pool.close()
+
 
 class ModelMetaTest(AsyncTestCase):
 
@@ -111,6 +231,24 @@ class ModelMetaTest(AsyncTestCase):
 
         self.assertIn(field, Test._indexed)
 
+    def test_field_lookup_tables(self):
+
+        class Beta(Model):
+            pass
+
+        class Alpha(Model):
+            beta = Field(type=Beta)
+            field = Field(type=int)
+
+        self.assertIs(Alpha._fields_by_name['field'], Alpha.field)
+        self.assertEqual(Alpha._field_names, frozenset(['id', 'beta', 'field']))
+        self.assertIs(Alpha._converters['field'], int)
+        self.assertIsInstance(Alpha._converters['beta']({ }), Beta)
+        self.assertEqual(Alpha._serialized, (Alpha.beta, ))
+
+        with self.assertRaises(TypeError):
+            Alpha._fields_by_name['other'] = Field()
+
 
 class ModelTest(AsyncTestCase):
 
@@ -125,7 +263,8 @@ class ModelTest(AsyncTestCase):
         test = Test()
         field = test._check_field('computed')
 
-        self.assertTrue(callable(field.computed))
+        self.assertEqual(field.computed, 'method')
+        self.assertTrue(callable(Test._computers['computed']))
 
     def test_check_computed_missing(self):
 
@@ -249,9 +388,47 @@ class ModelTest(AsyncTestCase):
 
         self.assertIs(alpha.beta.gamma.field, 'value')
 
-    @skip(reason='implement later')
     def test_set_related(self):
-        pass
+
+        class Beta(Model):
+            field = Field()
+
+        class Alpha(Model):
+            beta = Field(type=Beta, related=True)
+
+        alpha = Alpha(beta='key')
+        self.assertIs(alpha.beta, 'key')
+        self.assertEqual(alpha.serialize(), { 'beta': 'key' })
+
+        alpha.beta = { 'id': 'other', 'field': 'value' }
+        self.assertIs(alpha.beta.field, 'value')
+        self.assertEqual(alpha.serialize(), { 'beta': 'other' })
+
+    def test_set_related_many(self):
+
+        class Beta(Model):
+            pass
+
+        class Alpha(Model):
+            betas = Field(type=list, related=Beta)
+
+        self.assertIn(Alpha.betas, Alpha._related)
+
+        alpha = Alpha(betas=['a', Beta(id='b')])
+        self.assertEqual(alpha.serialize(), { 'betas': ['a', 'b'] })
+
+    def test_serialize_related_compiled(self):
+
+        class Beta(Model):
+            compiled = True
+
+        class Alpha(Model):
+            compiled = True
+            beta = Field(type=Beta, related=True)
+            betas = Field(type=list, related=Beta)
+
+        alpha = Alpha(beta=Beta(id='a'), betas=[Beta(id='b'), 'c'])
+        self.assertEqual(alpha.serialize(), { 'beta': 'a', 'betas': ['b', 'c'] })
 
     def test_set_keyword(self):
 
@@ -285,6 +462,145 @@ class ModelTest(AsyncTestCase):
         self.assertIs(test.alpha, 'a')
         self.assertIs(test.beta, 'value')
 
+    def test_from_many(self):
+
+        class Beta(Model):
+            field = Field()
+
+        class Alpha(Model):
+            beta = Field(type=Beta)
+            count = Field(type=int)
+
+        alphas = Alpha.from_many([
+            { 'count': '1', 'beta': { 'field': 'a' } },
+            { 'count': '2', 'beta': { 'field': 'b' } }
+        ])
+
+        self.assertEqual(len(alphas), 2)
+        self.assertEqual(alphas[0].count, 1)
+        self.assertIs(alphas[1].beta.field, 'b')
+
+    def test_from_many_undefined(self):
+
+        class Test(Model):
+            field = Field()
+
+        with self.assertRaises(AttributeError):
+            Test.from_many([{ 'field': 'value' }, { 'undefined': 'value' }])
+
+    def test_from_many_compiled_computed(self):
+
+        class Test(Model):
+            compiled = True
+            field = Field()
+            computed = Field(computed='get_field')
+
+            def get_field(self):
+                return self.field
+
+        tests = Test.from_many(({ 'field': 'a' }, { 'field': 'b' }))
+
+        self.assertEqual(list(map(lambda test: test.serialize()['computed'], tests)), ['a', 'b'])
+
+    def test_changes_new_instance(self):
+
+        class Test(Model):
+            alpha = Field()
+            beta = Field()
+
+        test = Test(alpha='a')
+        self.assertEqual(test._changes(), { 'alpha': 'a' })
+
+        test._clean()
+        self.assertEqual(test._changes(), { })
+
+        test.beta = 'b'
+        self.assertEqual(test._changes(), { 'beta': 'b' })
+
+    def test_changes_from_many_clean(self):
+
+        class Beta(Model):
+            value = Field()
+
+        class Alpha(Model):
+            beta = Field(type=Beta)
+            count = Field(type=int)
+
+        alpha = Alpha.from_many([{ 'count': 1, 'beta': { 'value': 'a' } }])[0]
+        self.assertEqual(alpha._changes(), { })
+
+        alpha.count = 2
+        self.assertEqual(alpha._changes(), { 'count': 2 })
+
+    def test_changes_nested(self):
+
+        class Gamma(Model):
+            value = Field()
+            other = Field()
+
+        class Beta(Model):
+            gamma = Field(type=Gamma)
+
+        class Alpha(Model):
+            beta = Field(type=Beta)
+            field = Field()
+
+        alpha = Alpha.from_many([{ 'field': 'a', 'beta': { 'gamma': { 'value': 'a', 'other': 'b' } } }])[0]
+        alpha.beta.gamma.value = 'changed'
+        self.assertEqual(alpha._changes(), { 'beta': { 'gamma': { 'value': 'changed' } } })
+
+        alpha._clean()
+        self.assertEqual(alpha.beta.gamma._changes(), { })
+
+        alpha.beta = { 'gamma': { 'value': 'new' } }
+        self.assertEqual(alpha._changes(), { 'beta': { 'gamma': { 'value': 'new' } } })
+
+    def test_changes_computed(self):
+
+        class Test(Model):
+            field = Field()
+            computed = Field(computed='get_field')
+
+            def get_field(self):
+                return self.field
+
+        test = Test.from_many([{ 'field': 'a' }])[0]
+        self.assertEqual(test._changes(), { })
+
+        test.field = 'b'
+        self.assertEqual(test._changes(), { 'field': 'b', 'computed': 'b' })
+
+    def test_changes_touch(self):
+
+        class Test(Model):
+            tags = Field(type=list)
+
+        test = Test.from_many([{ 'tags': ['a'] }])[0]
+        test.tags.append('b')
+        self.assertEqual(test._changes(), { })
+
+        test.touch('tags')
+        self.assertEqual(test._changes(), { 'tags': ['a', 'b'] })
+
+        with self.assertRaises(AttributeError):
+            test.touch('undefined')
+
+    def test_changes_compiled(self):
+
+        class Test(Model):
+            compiled = True
+            alpha = Field()
+            beta = Field()
+
+        test = Test(alpha='a')
+        self.assertEqual(test._changes(), { 'alpha': 'a' })
+
+        test = Test.from_many([{ 'alpha': 'a' }])[0]
+        self.assertEqual(test._changes(), { })
+
+        test.set(beta='b')
+        self.assertEqual(test._changes(), { 'beta': 'b' })
+
     def test_serialize(self):
 
         expected = {'value': 'string', 'object': {'alpha': 'a', 'beta': 'b'}}
@@ -361,75 +677,2170 @@ class ModelTest(AsyncTestCase):
 
         self.assertIs(test.serialize()['computed'], 'hello')
 
-        
-class RethinkDBModelTest(AsyncTestCase):
+    def test_serialize_computed_per_instance(self):
 
-    async def test_connect_and_close(self):
+        for compiled in (False, True):
+            with self.subTest(compiled=compiled):
 
-        class Test(RethinkDBModel):
-            db_options = { 'db': 'testdb' }
+                class Test(Model):
+                    field = Field()
+                    computed = Field(computed='get_field')
 
-        await Test.connect()
-        a = Test.connection
+                    def get_field(self):
+                        return self.field
 
-        await Test.connect()
-        b = Test.connection
+                Test = type('Test', (Test, ), { 'compiled': compiled })
 
-        self.assertTrue(Test.connection)
-        self.assertTrue(Test.connection.is_open())
-        self.assertIs(a, b)
+                alpha = Test(field='alpha')
+                beta = Test(field='beta')
 
-        await Test.drop()
-        await Test.close()
+                self.assertEqual(alpha.serialize()['computed'], 'alpha')
+                self.assertEqual(beta.serialize()['computed'], 'beta')
+                self.assertEqual(Test.computed.computed, 'get_field')
 
-        self.assertFalse(Test.connection.is_open())
+    def test_serialize_computed_cached(self):
 
-    async def test_ensure_database(self):
+        for compiled in (False, True):
+            with self.subTest(compiled=compiled):
+                calls = [ ]
 
-        class Test(RethinkDBModel):
-            db_options = { 'db': 'testdb' }
+                class Test(Model):
+                    price = Field(type=int)
+                    quantity = Field(type=int)
+                    note = Field()
+                    total = Field(type=int, computed='get_total', cached=True, depends=('price', 'quantity'))
 
-        await Test.connect()
+                    def get_total(self):
+                        calls.append(self)
+                        return self.price * self.quantity
 
-        databases = await r.db_list().run(Test.connection)
+                Test = type('Test', (Test, ), { 'compiled': compiled })
 
-        self.assertIn('testdb', databases)
+                alpha = Test(price=2, quantity=3)
+                beta = Test(price=5, quantity=1)
 
-        await Test.drop()
-        await r.db_drop('testdb').run(Test.connection)
-        await Test.close()
+                self.assertEqual(alpha.serialize()['total'], 6)
+                self.assertEqual(alpha.serialize()['total'], 6)
+                self.assertEqual(beta.serialize()['total'], 5)
+                self.assertEqual(len(calls), 2)
 
-    async def test_ensure_table(self):
+                alpha.note = 'note'
+                self.assertEqual(alpha.serialize()['total'], 6)
+                self.assertEqual(len(calls), 2)
 
-        class Test(RethinkDBModel):
-            pass
+                alpha.quantity = 4
+                self.assertEqual(alpha.serialize()['total'], 8)
+                self.assertEqual(beta.serialize()['total'], 5)
+                self.assertEqual(len(calls), 3)
 
-        await Test.connect()
+                alpha.set(price=3)
+                self.assertEqual(alpha._changes()['total'], 12)
+                self.assertEqual(len(calls), 4)
 
-        tables = await Test._db.table_list().run(Test.connection)
+    def test_computed_depends_undefined(self):
 
-        self.assertIn(Test._table, tables)
+        with self.assertRaises(AttributeError):
 
-        await Test.drop()
-        await Test.close()
+            class Test(Model):
+                total = Field(computed='get_total', cached=True, depends=('missing', ))
 
-    async def test_ensure_indexes(self):
+                def get_total(self):
+                    pass
 
-        class Beta(RethinkDBModel):
-            field = Field(indexed=True)
+    def test_serialize_fields(self):
+        calls = [ ]
 
-        class Alpha(RethinkDBModel):
+        class Address(Model):
+            street = Field()
+            zip = Field(type=int)
+
+        class Test(Model):
+            name = Field()
+            age = Field(type=int)
+            address = Field(type=Address)
+            display = Field(computed='get_display')
+
+            def get_display(self):
+                calls.append(self)
+                return self.name
+
+        for compiled in (False, True):
+            for lazy in (False, True):
+                with self.subTest(compiled=compiled, lazy=lazy):
+                    Mode = type('Test', (Test, ), { 'compiled': compiled, 'lazy': lazy })
+                    test = Mode.from_many([{ 'id': 'a', 'name': 'n', 'age': 1, 'address': { 'street': 's', 'zip': 2 } }])[0]
+                    del calls[:]
+
+                    self.assertEqual(test.serialize(fields=['name', 'address.zip']), { 'name': 'n', 'address': { 'zip': 2 } })
+                    self.assertEqual(test.serialize(fields=['address']), { 'address': { 'street': 's', 'zip': 2 } })
+                    self.assertEqual(
+                        test.serialize(exclude=['display', 'address.street']),
+                        { 'id': 'a', 'name': 'n', 'age': 1, 'address': { 'zip': 2 } }
+                    )
+                    self.assertEqual(calls, [ ])
+
+                    self.assertEqual(test.serialize(fields=['display']), { 'display': 'n' })
+                    self.assertEqual(len(calls), 1)
+
+                    with self.assertRaises(AttributeError):
+                        test.serialize(fields=['missing'])
+
+                    with self.assertRaises(AttributeError):
+                        test.serialize(exclude=['name.first'])
+
+
+class ValidationTest(AsyncTestCase):
+
+    def setUp(self):
+
+        class Address(Model):
+            street = Field()
+            zip = Field(type=int, required=True)
+
+        class User(Model):
+            name = Field(required=True)
+            age = Field(type=int)
+            tags = Field(type=list)
+            address = Field(type=Address)
+            display = Field(computed='get_display')
+
+            def get_display(self):
+                return self.name
+
+        self.Address = Address
+        self.User = User
+
+    def errors(self, document, partial=False):
+        with self.assertRaises(ValidationError) as context:
+            self.User.validate(document, partial)
+        return sorted(map(lambda error: (error['field'], error['code']), context.exception.errors))
+
+    def test_validate_valid(self):
+        self.assertIsNone(self.User.validate({
+            'name': 'name',
+            'age': '42',
+            'tags': ('a', ),
+            'address': { 'zip': 12345 },
+            'display': 'name'
+        }))
+
+    def test_validate_aggregated(self):
+        errors = self.errors({ 'age': 'old', 'tags': 1, 'address': { 'zip': 'none', 'city': 'city' }, 'other': 1 })
+
+        self.assertEqual(errors, [
+            ('address.city', 'undefined'),
+            ('address.zip', 'type'),
+            ('age', 'type'),
+            ('name', 'missing'),
+            ('other', 'undefined'),
+            ('tags', 'type')
+        ])
+
+    def test_validate_nested_missing(self):
+        self.assertEqual(self.errors({ 'name': 'name', 'address': { } }), [('address.zip', 'missing')])
+        self.assertEqual(self.errors({ 'name': 'name', 'address': 'street' }), [('address', 'type')])
+        self.assertEqual(self.errors({ 'name': 'name' }), [('address', 'missing')])
+
+    def test_validate_nested_model(self):
+        self.User.validate({ 'name': 'name', 'address': self.Address(zip=1) })
+
+    def test_validate_partial(self):
+        self.User.validate({ 'age': 1 }, partial=True)
+        self.assertEqual(self.errors({ 'age': 'old' }, partial=True), [('age', 'type')])
+
+    def test_validate_not_object(self):
+        self.assertEqual(self.errors([ ]), [('', 'type')])
+
+    def test_validate_compiled_once(self):
+        self.assertIs(self.User._validator(), self.User._validator())
+
+    def test_validate_errors_are_attribute_errors(self):
+        with self.assertRaises(AttributeError) as context:
+            self.User(other=1)
+
+        self.assertIsInstance(context.exception, ValidationError)
+        self.assertEqual(context.exception.errors, [{ 'field': 'other', 'code': 'undefined', 'message': 'is not defined' }])
+
+
+class CompiledModelTest(AsyncTestCase):
+
+    def test_compiled_functions(self):
+
+        class Test(Model):
+            compiled = True
+            field = Field()
+
+        self.assertIsNot(Test.__init__, Model.__init__)
+        self.assertIsNot(Test.serialize, Model.serialize)
+        self.assertIsNot(Test._hydrate, Model._hydrate)
+
+    def test_compiled_respects_overrides(self):
+
+        class Test(Model):
+            compiled = True
+            field = Field()
+
+            def serialize(self, verify=False):
+                return 'custom'
+
+        self.assertEqual(Test(field='value').serialize(), 'custom')
+
+    def test_compiled_respects_inherited_overrides(self):
+
+        class Base(Model):
+            compiled = True
+            field = Field()
+
+            def serialize(self, verify=False, fields=None, exclude=None):
+                return 'custom'
+
+        for options in ({ }, { 'slotted': True }):
+            Test = type('Test', (Base, ), dict(options, other=Field()))
+
+            self.assertEqual(Test(field='value').serialize(), 'custom')
+            self.assertIsNot(Test._hydrate, Base._hydrate)
+
+    def test_compiled_respects_store_override(self):
+
+        class Base(Model):
+            compiled = True
+            field = Field()
+
+            def _store(self, key, value):
+                Model._store(self, key, value.upper())
+
+        class Compiled(Model):
+            compiled = True
+            field = Field()
+
+        Override = type('Override', (Compiled, ), { '_store': Base._store, 'other': Field() })
+
+        for Test in (Base, type('Test', (Base, ), { 'other': Field() }), type('Test', (Base, ), { 'slotted': True }), Override):
+            test = Test(field='value')
+            self.assertEqual(test.field, 'VALUE')
+
+            test.set({ 'field': 'set' })
+            self.assertEqual(test.field, 'SET')
+
+            test.field = 'assigned'
+            self.assertEqual(test.field, 'ASSIGNED')
+
+            self.assertEqual(Test.from_many([{ 'field': 'read' }])[0].field, 'READ')
+
+    def test_compiled_init(self):
+
+        class Test(Model):
+            compiled = True
+            alpha = Field()
+            beta = Field(type=int)
+
+        test = Test({ 'alpha': 'a' }, beta='1')
+
+        self.assertIs(test.alpha, 'a')
+        self.assertEqual(test.beta, 1)
+
+    def test_compiled_undefined(self):
+
+        class Test(Model):
+            compiled = True
+            field = Field()
+
+        with self.assertRaises(AttributeError):
+            Test(undefined='value')
+
+    def test_compiled_set_nested(self):
+
+        class Beta(Model):
+            compiled = True
+            field = Field()
+
+        class Alpha(Model):
+            compiled = True
             beta = Field(type=Beta)
-            field = Field(indexed=True)
 
-    async def test_create(self):
-        pass
+        alpha = Alpha()
+        alpha.set(beta={ 'field': 'value' })
+        self.assertIs(alpha.beta.field, 'value')
 
-    async def test_read(self):
-        pass
+        alpha.set(beta=Beta(field='other'))
+        self.assertIs(alpha.beta.field, 'other')
 
-    async def test_update(self):
-        pass
+    def test_compiled_serialize(self):
 
-    async def test_delete(self):
+        class Beta(Model):
+            compiled = True
+            value = Field()
+
+        class Alpha(Model):
+            compiled = True
+            beta = Field(type=Beta)
+            count = Field(type=int)
+            function = Field(type=str, computed=lambda: 1)
+            method = Field(type=str, computed='get_hello')
+            typed = Field(type=dict, computed='get_hello', computed_type=True)
+            empty = Field(type=str, computed='get_hello', computed_empty=True)
+
+            def get_hello(self):
+                return self.beta.value
+
+        expected = {
+            'beta': { 'value': 'hello' },
+            'count': 1,
+            'function': '1',
+            'method': 'hello',
+            'typed': 'hello',
+            'empty': 'value'
+        }
+
+        alpha = Alpha(beta={ 'value': 'hello' }, count='1', empty='value')
+        self.assertEqual(alpha.serialize(), expected)
+
+    def test_compiled_serialize_verify(self):
+
+        class Test(Model):
+            compiled = True
+            field = Field(required=True)
+
+        with self.assertRaises(AttributeError):
+            Test().serialize(verify=True)
+
+    def test_compiled_computed_missing(self):
+
+        with self.assertRaises(AttributeError):
+
+            class Test(Model):
+                compiled = True
+                computed = Field(computed='missing_method')
+
+    def test_compiled_computed_invalid(self):
+
+        with self.assertRaises(AttributeError):
+
+            class Test(Model):
+                compiled = True
+                computed = Field(computed='value')
+
+                value = 'test'
+
+
+class SlottedModelTest(AsyncTestCase):
+
+    def test_slotted_no_dict(self):
+
+        class Test(Model):
+            slotted = True
+            field = Field()
+
+        test = Test(field='value')
+
+        self.assertFalse(hasattr(test, '__dict__'))
+        self.assertIs(test.field, 'value')
+        self.assertIs(Test.field.primary, False)
+
+    def test_slotted_unset_field(self):
+
+        class Test(Model):
+            slotted = True
+            field = Field()
+
+        self.assertIs(Test().field, Test.field)
+
+    def test_slotted_set(self):
+
+        class Test(Model):
+            slotted = True
+            alpha = Field()
+            beta = Field(type=int)
+
+        test = Test()
+        test.set({ 'alpha': 'a' }, beta='1')
+        test.alpha = 'b'
+
+        self.assertIs(test.alpha, 'b')
+        self.assertEqual(test.beta, 1)
+
+        with self.assertRaises(AttributeError):
+            test.set(undefined='value')
+
+    def test_slotted_inherited(self):
+
+        class Alpha(Model):
+            slotted = True
+            alpha = Field()
+
+        class Beta(Alpha):
+            beta = Field()
+
+        beta = Beta(alpha='a', beta='b')
+
+        self.assertFalse(hasattr(beta, '__dict__'))
+        self.assertEqual(beta.serialize(), { 'alpha': 'a', 'beta': 'b' })
+
+    def test_slotted_serialize(self):
+
+        class Beta(Model):
+            slotted = True
+            value = Field()
+
+        class Alpha(Model):
+            slotted = True
+            beta = Field(type=Beta)
+            computed = Field(computed='get_hello')
+
+            def get_hello(self):
+                return 'hello'
+
+        alpha = Alpha(beta={ 'value': 'test' })
+
+        self.assertEqual(alpha.serialize(), { 'beta': { 'value': 'test' }, 'computed': 'hello' })
+
+    def test_slotted_check_missing(self):
+
+        class Test(Model):
+            slotted = True
+            field = Field(required=True)
+
+        with self.assertRaises(AttributeError):
+            Test().serialize(verify=True)
+
+        self.assertEqual(Test(field='value').serialize(verify=True), { 'field': 'value' })
+
+    def test_slotted_compiled(self):
+
+        class Beta(Model):
+            slotted = True
+            compiled = True
+            value = Field()
+
+        class Alpha(Model):
+            slotted = True
+            compiled = True
+            beta = Field(type=Beta)
+            count = Field(type=int)
+            field = Field(required=True)
+
+        alpha = Alpha({ 'beta': { 'value': 'test' } }, count='1')
+
+        self.assertFalse(hasattr(alpha, '__dict__'))
+        self.assertEqual(alpha.serialize(), { 'beta': { 'value': 'test' }, 'count': 1 })
+
+        with self.assertRaises(AttributeError):
+            alpha.serialize(verify=True)
+
+        
+class LazyModelTest(AsyncTestCase):
+
+    def model(self, **options):
+
+        class Address(Model):
+            street = Field()
+            zip = Field(type=int)
+
+        attrs = dict(options, lazy=True, name=Field(), address=Field(type=Address))
+        return type('Order', (Model, ), attrs), Address
+
+    def modes(self):
+        options = ({ }, { 'compiled': True }, { 'slotted': True }, { 'compiled': True, 'slotted': True })
+        return list(map(lambda option: self.model(**option), options))
+
+    def document(self):
+        return { 'id': 'a', 'name': 'order', 'address': { 'street': 'street', 'zip': '1' } }
+
+    def test_lazy_deferred(self):
+        for Order, Address in self.modes():
+            order = Order.from_many([self.document()])[0]
+
+            self.assertEqual(order._raw, { 'address': { 'street': 'street', 'zip': '1' } })
+            self.assertNotIn('address', order._state())
+
+            self.assertIsInstance(order.address, Address)
+            self.assertEqual(order.address.zip, 1)
+            self.assertEqual(order._raw, { })
+            self.assertIs(order.address, order.address)
+
+    def test_lazy_serialize_passthrough(self):
+        for Order, Address in self.modes():
+            document = self.document()
+            order = Order.from_many([document])[0]
+
+            self.assertIs(order.serialize()['address'], document['address'])
+            self.assertEqual(order._raw, { 'address': document['address'] })
+
+    def test_lazy_serialize_built(self):
+        for Order, Address in self.modes():
+            order = Order.from_many([self.document()])[0]
+            order.address.street = 'other'
+
+            self.assertEqual(order.serialize()['address'], { 'street': 'other', 'zip': 1 })
+
+    def test_lazy_serialize_verify(self):
+        for Order, Address in self.modes():
+            order = Order.from_many([self.document()])[0]
+
+            self.assertEqual(order.serialize(verify=True)['address'], { 'street': 'street', 'zip': 1 })
+            self.assertIsInstance(order.address, Address)
+
+    def test_lazy_changes(self):
+        for Order, Address in self.modes():
+            order = Order.from_many([self.document()])[0]
+            self.assertEqual(order._changes(), { })
+
+            order.set({ 'address': { 'street': 'new' } })
+            self.assertEqual(order._changes(), { 'address': { 'street': 'new' } })
+
+            order._clean()
+            order.address.zip = 2
+            self.assertEqual(order._changes(), { 'address': { 'zip': 2 } })
+
+    def test_lazy_assign_replaces_raw(self):
+        for Order, Address in self.modes():
+            order = Order.from_many([self.document()])[0]
+            order.address = Address(street='assigned')
+
+            self.assertEqual(order._raw, { })
+            self.assertEqual(order.serialize()['address'], { 'street': 'assigned' })
+
+    def test_lazy_set_replaces_built(self):
+        for Order, Address in self.modes():
+            order = Order.from_many([self.document()])[0]
+            order.address
+            order.set({ 'address': { 'street': 'raw' } })
+
+            self.assertEqual(order.address.street, 'raw')
+
+    def test_lazy_set_unaccessed(self):
+        for Order, Address in self.modes():
+            order = Order.from_many([self.document()])[0]
+            order.set({ 'address': { 'street': 'new' } })
+
+            self.assertNotIn('address', order._raw)
+            self.assertEqual(order.serialize()['address'], { 'street': 'new' })
+            self.assertEqual(order._changes()['address'], { 'street': 'new' })
+
+    def test_lazy_failed_build(self):
+        for Order, Address in self.modes():
+            document = dict(self.document(), address={ 'bogus': 1 })
+            order = Order.from_many([document])[0]
+
+            with self.assertRaises(AttributeError):
+                order.address
+
+            self.assertEqual(order._raw, { 'address': { 'bogus': 1 } })
+            self.assertEqual(order.serialize(), document)
+
+    def test_lazy_client_input(self):
+        for Order, Address in self.modes():
+            order = Order(self.document())
+            self.assertNotIn('address', getattr(order, '_raw', { }))
+            self.assertIsInstance(order._state()['address'], Address)
+
+            order.set({ 'address': { 'street': 'set' } })
+            self.assertIsInstance(order._state()['address'], Address)
+            self.assertEqual(order._changes()['address'], { 'street': 'set' })
+
+            with self.assertRaises(AttributeError):
+                order.set({ 'address': { 'bogus': 1 } })
+
+            with self.assertRaises(ValueError):
+                Order(dict(self.document(), address={ 'zip': 'notanint' }))
+
+    def test_lazy_undefined(self):
+        for Order, Address in self.modes():
+            with self.assertRaises(AttributeError):
+                Order(dict(self.document(), undefined=1))
+
+
+class RethinkDBModelTest(AsyncTestCase):
+
+    async def test_connect_and_close(self):
+
+        class Test(RethinkDBModel):
+            db_options = { 'db': 'testdb' }
+
+        await Test.connect()
+        async with Test.acquire() as a:
+            self.assertTrue(a.is_open())
+
+        await Test.connect()
+        async with Test.acquire() as b:
+            self.assertTrue(b.is_open())
+
+        self.assertIs(a, b)
+
+        await Test.drop()
+        await Test.close()
+
+        self.assertFalse(a.is_open())
+
+    async def test_ensure_database(self):
+
+        class Test(RethinkDBModel):
+            db_options = { 'db': 'testdb' }
+
+        await Test.connect()
+
+        databases = await Test._run(r.db_list())
+
+        self.assertIn('testdb', databases)
+
+        await Test.drop()
+        await Test._run(r.db_drop('testdb'))
+        await Test.close()
+
+        Schema.clear()
+
+    async def test_ensure_table(self):
+
+        class Test(RethinkDBModel):
+            pass
+
+        await Test.connect()
+
+        tables = await Test._run(Test._db.table_list())
+
+        self.assertIn(Test._table, tables)
+
+        await Test.drop()
+        await Test.close()
+
+    async def test_ensure_table_options(self):
+
+        class Test(RethinkDBModel):
+            table_options = { 'durability': 'soft' }
+            key = Field(primary=True)
+
+        await Test.connect()
+
+        self.assertEqual(Test.table_options, { 'durability': 'soft' })
+        self.assertEqual(RethinkDBModel.table_options, { })
+
+        await Test.drop()
+        await Test.close()
+
+    async def test_ensure_cached(self):
+
+        class Alpha(RethinkDBModel):
+            pass
+
+        class Beta(RethinkDBModel):
+            pass
+
+        await Alpha.connect()
+        await Beta.connect()
+
+        self.assertIn('test', Schema.databases[Schema._server({ })])
+        self.assertIn(Alpha._table, Schema.tables[(Schema._server({ }), 'test')])
+        self.assertIn(Beta._table, Schema.tables[(Schema._server({ }), 'test')])
+
+        await Alpha.drop()
+        self.assertNotIn(Alpha._table, Schema.tables[(Schema._server({ }), 'test')])
+
+        await Beta.drop()
+        await Beta.close()
+
+    async def test_ensure_all(self):
+
+        models = [ type('EnsureAll{0}'.format(i), (RethinkDBModel, ), { }) for i in range(5) ]
+
+        await RethinkDBModel.ensure_all(models)
+
+        tables = await models[0]._run(models[0]._db.table_list())
+        for model in models:
+            self.assertFalse(model._ensure)
+            self.assertIn(model._table, tables)
+
+        for model in models:
+            await model.drop()
+        await models[0].close()
+
+    async def test_ensure_indexes(self):
+
+        class Beta(RethinkDBModel):
+            field = Field(indexed=True)
+
+        class Alpha(RethinkDBModel):
+            beta = Field(type=Beta)
+            field = Field(indexed=True)
+            first = Field()
+            last = Field()
+
+            compound_indexes = { 'name': ('last', 'first') }
+
+        await Alpha.connect()
+        await Beta.connect()
+
+        self.assertEqual(sorted(await Alpha._run(Alpha.r.index_list())), ['field', 'name'])
+        self.assertEqual(await Beta._run(Beta.r.index_list()), ['field'])
+
+        await Alpha.drop()
+        await Beta.drop()
+        await Alpha.close()
+
+    async def test_ensure_indexes_stale(self):
+
+        class Test(RethinkDBModel):
+            field = Field(indexed=True)
+
+        await Test.connect()
+        await Test._run(Test.r.index_create('stale'))
+
+        Test._ensure = True
+        with self.assertWarns(UserWarning):
+            await Test.connect()
+
+        Test._ensure = True
+        Test.drop_stale_indexes = True
+        await Test.connect()
+
+        self.assertEqual(await Test._run(Test.r.index_list()), ['field'])
+
+        await Test.drop()
+        await Test.close()
+
+    def test_index_definitions(self):
+
+        class Test(RethinkDBModel):
+            key = Field(primary=True, indexed=True)
+            field = Field(indexed=True)
+            first = Field()
+            last = Field()
+
+            compound_indexes = { 'name': ('last', 'first') }
+
+        self.assertEqual(Test._index_definitions(), { 'field': ['field'], 'name': ['last', 'first'] })
+        self.assertEqual(Test._index_for(['key']), (None, ['key']))
+        self.assertEqual(Test._index_for(['first', 'last']), ('name', ['last', 'first']))
+
+        with self.assertRaises(AttributeError):
+            Test._index_for(['first'])
+
+    def test_index_definitions_undefined(self):
+
+        class Test(RethinkDBModel):
+            compound_indexes = { 'name': ('last', 'first') }
+
+        with self.assertRaises(AttributeError):
+            Test._index_definitions()
+
+    async def test_prefetch(self):
+
+        class Author(RethinkDBModel):
+            name = Field()
+
+        class Comment(RethinkDBModel):
+            text = Field()
+
+        class Post(RethinkDBModel):
+            author = Field(type=Author, related=True)
+            comments = Field(type=list, related=Comment)
+
+        await Author.create_many([ Author(id='a', name='alpha'), Author(id='b', name='beta') ])
+        await Comment.create_many([ Comment(id='c', text='first'), Comment(id='d', text='second') ])
+        await Post.create_many([
+            Post(id='1', author='a', comments=['c', 'd']),
+            Post(id='2', author='b', comments=['d']),
+            Post(id='3', author='a', comments=[ ])
+        ])
+
+        posts = await Post.read_many(['1', '2', '3'], prefetch=['author', 'comments'])
+
+        self.assertEqual(posts[0].author.name, 'alpha')
+        self.assertIs(posts[0].author, posts[2].author)
+        self.assertEqual(list(map(lambda comment: comment.text, posts[0].comments)), ['first', 'second'])
+        self.assertEqual(posts[1].serialize(), { 'id': '2', 'author': 'b', 'comments': ['d'] })
+
+        post = await Post.read('2', prefetch=['author'])
+        self.assertEqual(post.author.name, 'beta')
+
+        with self.assertRaises(AttributeError):
+            await Post.prefetch(posts, ['id'])
+
+        for model in (Author, Comment, Post):
+            await model.drop()
+        await Post.close()
+
+    async def test_query(self):
+
+        class Test(RethinkDBModel):
+            field = Field()
+            count = Field(type=int, indexed=True)
+
+        await Test.create_many([ Test(id=str(i), field='even' if i % 2 else 'odd', count=i) for i in range(10) ])
+
+        tests = [ ]
+        async for test in Test.query().filter(field='even').order_by('count').batch(2):
+            tests.append(test.count)
+
+        self.assertEqual(tests, [1, 3, 5, 7, 9])
+
+        tests = await Test.query().order_by('count', descending=True).limit(3).pluck('count').all()
+        self.assertEqual(list(map(lambda test: test.count, tests)), [9, 8, 7])
+        self.assertEqual(tests[0].serialize(), { 'id': '9', 'count': 9 })
+
+        test = await Test.query().filter(count=4).first()
+        self.assertEqual(test.id, '4')
+
+        await Test.drop()
+        await Test.close()
+
+    async def test_query_pages(self):
+
+        class Test(RethinkDBModel):
+            count = Field(type=int, indexed=True)
+            compound_indexes = { 'count_id': ('count', 'id') }
+
+        await Test.create_many([ Test(id=str(i), count=i) for i in range(10) ])
+
+        pages = [ ]
+        async for page in Test.query().pages(4, field='count'):
+            pages.append(list(map(lambda test: test.count, page)))
+
+        self.assertEqual(pages, [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]])
+
+        tests = await Test.query().order_by('count').after(6).all()
+        self.assertEqual(list(map(lambda test: test.count, tests)), [7, 8, 9])
+
+        await Test.drop()
+        await Test.close()
+
+    async def test_find_by(self):
+
+        class Test(RethinkDBModel):
+            field = Field(indexed=True)
+            first = Field()
+            last = Field()
+
+            compound_indexes = { 'name': ('last', 'first') }
+
+        await Test.create_many([
+            Test(id='a', field='x', first='f', last='l'),
+            Test(id='b', field='x', first='g', last='l'),
+            Test(id='c', field='y', first='f', last='l')
+        ])
+
+        tests = await Test.find_by(field='x')
+        self.assertEqual(sorted(map(lambda test: test.id, tests)), ['a', 'b'])
+
+        tests = await Test.find_by(first='f', last='l')
+        self.assertEqual(sorted(map(lambda test: test.id, tests)), ['a', 'c'])
+
+        tests = await Test.find_by(id='c')
+        self.assertEqual(tests[0].field, 'y')
+
+        with self.assertRaises(AttributeError):
+            await Test.find_by(first='f')
+
+        tests = await Test.find_by(scan=True, first='g')
+        self.assertEqual(tests[0].id, 'b')
+
+        await Test.drop()
+        await Test.close()
+
+    async def test_create(self):
+        pass
+
+    async def test_read(self):
         pass
+
+    async def test_read_many(self):
+
+        class Test(RethinkDBModel):
+            field = Field()
+
+        await Test.connect()
+        await Test._run(Test.r.insert([
+            { 'id': 'a', 'field': 'alpha' },
+            { 'id': 'b', 'field': 'beta' }
+        ]))
+
+        tests = await Test.read_many(['b', 'missing', 'a'])
+
+        self.assertEqual(tests[0].field, 'beta')
+        self.assertIsNone(tests[1])
+        self.assertEqual(tests[2].field, 'alpha')
+        self.assertEqual(await Test.read_many([ ]), [ ])
+
+        await Test.drop()
+        await Test.close()
+
+    async def test_subscribe(self):
+
+        class Test(RethinkDBModel):
+            field = Field()
+
+        await Test.connect()
+
+        async with Test.subscribe() as a, Test.subscribe() as b:
+            self.assertIs(a.feed, b.feed)
+
+            await asyncio.sleep(0.1)
+            await Test(id='a', field='alpha').create()
+
+            old, new = await a.__anext__()
+            self.assertIsNone(old)
+            self.assertEqual(new.field, 'alpha')
+
+            old, new = await b.__anext__()
+            self.assertEqual(new.field, 'alpha')
+
+        self.assertNotIn(a.feed.key, a.feed.feeds)
+
+        await Test.drop()
+        await Test.close()
+
+    async def test_aggregate(self):
+
+        class Test(RethinkDBModel):
+            status = Field(indexed=True)
+            price = Field(type=int)
+
+        await Test.create_many([
+            Test(id='a', status='paid', price=10),
+            Test(id='b', status='paid', price=30),
+            Test(id='c', status='open', price=5),
+        ])
+
+        self.assertEqual(await Test.count(), 3)
+        self.assertEqual(await Test.count({ 'status': 'paid' }), 2)
+        self.assertEqual(await Test.sum('price', { 'status': 'paid' }), 40)
+        self.assertEqual(await Test.distinct('status'), ['open', 'paid'])
+        self.assertEqual(await Test.group_by('status'), { 'paid': 2, 'open': 1 })
+        self.assertEqual(await Test.group_by('status', 'max', 'price', { 'price': 5 }), { 'open': 5 })
+
+        await Test.drop()
+        await Test.close()
+
+    async def test_update(self):
+
+        class Test(RethinkDBModel):
+            alpha = Field()
+            beta = Field()
+
+        test = Test(id='a', alpha='a', beta='b')
+        await test.create()
+
+        self.assertIsNone(await test.update())
+
+        test.alpha = 'changed'
+        result = await test.update()
+        self.assertEqual(result['replaced'], 1)
+        self.assertEqual(test._changes(), { })
+
+        await Test._run(Test.r.get('a').update({ 'beta': 'server' }))
+        test.alpha = 'again'
+        await test.update()
+
+        stored = await Test.read('a')
+        self.assertEqual(stored.serialize(), { 'id': 'a', 'alpha': 'again', 'beta': 'server' })
+
+        await Test.drop()
+        await Test.close()
+
+    async def test_delete(self):
+        pass
+
+    async def test_create_many(self):
+
+        class Test(RethinkDBModel):
+            field = Field(required=True)
+
+        tests = [ Test(field=str(i)) for i in range(5) ] + [ Test() ]
+
+        summary = await Test.create_many(tests, batch_size=2)
+
+        self.assertEqual(summary.inserted, 5)
+        self.assertEqual(len(summary.errors), 1)
+        self.assertEqual(len(summary.generated_keys), 5)
+        self.assertTrue(all(map(lambda test: isinstance(test.id, str), tests[:5])))
+
+        await Test.drop()
+        await Test.close()
+
+    async def test_update_many(self):
+
+        class Test(RethinkDBModel):
+            field = Field()
+
+        tests = [ Test(id=str(i), field='a') for i in range(3) ]
+        await Test.create_many(tests)
+
+        for test in tests:
+            test.field = 'b'
+
+        tests[2]._clean()
+
+        summary = await Test.update_many(tests, batch_size=2, durability='soft')
+        self.assertEqual(summary.replaced, 2)
+        self.assertEqual(summary.unchanged, 1)
+
+        result = await Test.read('0')
+        self.assertEqual(result.field, 'b')
+
+        await Test.drop()
+        await Test.close()
+
+    async def test_delete_many(self):
+
+        class Test(RethinkDBModel):
+            pass
+
+        tests = [ Test(id=str(i)) for i in range(3) ]
+        await Test.create_many(tests)
+
+        summary = await Test.delete_many(tests, return_changes=True)
+        self.assertEqual(summary.deleted, 3)
+        self.assertEqual(len(summary.changes), 3)
+
+        await Test.drop()
+        await Test.close()
+
+
+class QueryTest(AsyncTestCase):
+
+    def setUp(self):
+
+        class Test(RethinkDBModel):
+            field = Field()
+            count = Field(type=int, indexed=True)
+
+        Test._db = r.db('test')
+        Test.r = Test._db.table(Test._table)
+
+        self.Test = Test
+
+    def test_compile_filter(self):
+        query = self.Test.query().filter(field='a').filter({ 'count': 1 })
+        expected = self.Test.r.filter({ 'field': 'a' }).filter({ 'count': 1 })
+        self.assertEqual(str(query.compile()), str(expected))
+
+    def test_compile_order_by_index(self):
+        query = self.Test.query().filter(field='a').order_by('count', descending=True).limit(5)
+        expected = self.Test.r.order_by(index=r.desc('count')).filter({ 'field': 'a' }).limit(5)
+        self.assertEqual(str(query.compile()), str(expected))
+
+    def test_compile_order_by_field(self):
+        query = self.Test.query().filter(count=1).order_by('field')
+        expected = self.Test.r.filter({ 'count': 1 }).order_by(r.asc('field'))
+        self.assertEqual(str(query.compile()), str(expected))
+
+    def test_compile_pluck(self):
+        query = self.Test.query().pluck('field')
+        self.assertEqual(str(query.compile()), str(self.Test.r.pluck('field', 'id')))
+
+    def test_compile_pluck_nested(self):
+        query = self.Test.query().pluck('field', 'nested.alpha', 'nested.beta')
+        expected = self.Test.r.pluck('field', 'id', { 'nested': { 'alpha': True, 'beta': True } })
+        self.assertEqual(str(query.compile()), str(expected))
+
+    def test_compile_only(self):
+        query = self.Test.query().only('count')
+        self.assertEqual(str(query.compile()), str(self.Test.r.pluck('id', 'count')))
+
+    def test_compile_after(self):
+        query = self.Test.query().order_by('count').after(10)
+        expected = self.Test.r.between(10, r.maxval, index='count', left_bound='open', right_bound='closed').order_by(index=r.asc('count'))
+        self.assertEqual(str(query.compile()), str(expected))
+
+    def test_compile_after_key(self):
+        self.Test.compound_indexes = { 'count_id': ('count', 'id') }
+        query = self.Test.query().order_by(['count', 'id']).after(10, field='count', key='a')
+        expected = self.Test.r.between([10, 'a'], r.maxval, index='count_id', left_bound='open', right_bound='closed').order_by(index=r.asc('count_id'))
+        self.assertEqual(str(query.compile()), str(expected))
+
+    def test_selection_index(self):
+        query = self.Test.query().filter(count=1)
+        self.assertEqual(str(query.selection()), str(self.Test.r.get_all(1, index='count')))
+
+        query = self.Test.query().filter(id='a').limit(2)
+        self.assertEqual(str(query.selection()), str(self.Test.r.get_all('a').limit(2)))
+
+    def test_selection_scan(self):
+        query = self.Test.query().filter(field='a').pluck('field')
+        self.assertEqual(str(query.selection()), str(self.Test.r.filter({ 'field': 'a' })))
+
+        query = self.Test.query().filter(count=1).order_by('field')
+        expected = self.Test.r.filter({ 'count': 1 }).order_by(r.asc('field'))
+        self.assertEqual(str(query.selection()), str(expected))
+
+    def test_chaining_is_immutable(self):
+        query = self.Test.query()
+        limited = query.limit(1)
+        self.assertIsNone(query._limit)
+        self.assertEqual(limited._limit, 1)
+
+
+class BatchSummaryTest(AsyncTestCase):
+
+    def test_add(self):
+        summary = BatchSummary('id')
+        summary.add({ 'inserted': 2, 'generated_keys': ['a', 'b'] })
+        summary.add({ 'inserted': 1, 'deleted': 1 })
+
+        self.assertEqual(summary.inserted, 3)
+        self.assertEqual(summary.deleted, 1)
+        self.assertEqual(summary.generated_keys, ['a', 'b'])
+        self.assertEqual(summary.errors, [ ])
+
+    def test_add_errors(self):
+        summary = BatchSummary('id')
+        summary.add({
+            'errors': 2,
+            'first_error': 'duplicate',
+            'changes': [
+                { 'error': 'duplicate', 'old_val': { 'id': 'a' }, 'new_val': { 'id': 'a' } },
+                { 'old_val': None, 'new_val': { 'id': 'b' } }
+            ]
+        })
+
+        self.assertEqual(summary.errors, [('a', 'duplicate'), (None, 'duplicate')])
+        self.assertEqual(len(summary.changes), 1)
+
+
+class CacheTest(AsyncTestCase):
+
+    def setUp(self):
+
+        class Test(RethinkDBModel):
+            field = Field()
+
+        self.Test = Test
+
+    def test_cache_disabled(self):
+        self.assertIsNone(self.Test.cache())
+
+    def test_cache_per_model(self):
+
+        class Cached(RethinkDBModel):
+            cache_options = { 'size': 2 }
+
+        class Child(Cached):
+            pass
+
+        self.assertIs(Cached.cache(), Cached.cache())
+        self.assertIsNot(Cached.cache(), Child.cache())
+        self.assertIs(Child.cache().model, Child)
+
+    def test_cache_lru(self):
+        cache = Cache(self.Test, size=2)
+        cache.put('a', { 'id': 'a' })
+        cache.put('b', { 'id': 'b' })
+        cache.get('a')
+        cache.put('c', { 'id': 'c' })
+
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_cache_bytes(self):
+        cache = Cache(self.Test, size=None, bytes=200)
+        for key in range(10):
+            cache.put(key, { 'id': key, 'field': 'x' * 50 })
+
+        self.assertLessEqual(cache.used, 200)
+        self.assertIn(9, cache)
+        self.assertNotIn(0, cache)
+
+    def test_cache_ttl(self):
+        cache = Cache(self.Test, ttl=-1)
+        cache.put('a', { 'id': 'a' })
+
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+    def test_cache_copies(self):
+        cache = Cache(self.Test)
+        cache.put('a', { 'id': 'a', 'field': [1] })
+        cache.get('a')['field'].append(2)
+
+        self.assertEqual(cache.get('a'), { 'id': 'a', 'field': [1] })
+
+    async def test_cache_single_flight(self):
+        cache = Cache(self.Test)
+        calls = [ ]
+
+        async def loader():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return { 'id': 'a' }
+
+        a, b = await asyncio.gather(cache.load('a', loader), cache.load('a', loader))
+        c = await cache.load('a', loader)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(a, b)
+        self.assertEqual(a, c)
+        self.assertEqual(cache.stats()['misses'], 1)
+        self.assertEqual(cache.stats()['coalesced'], 1)
+        self.assertEqual(cache.stats()['hits'], 1)
+
+    async def test_cache_missing(self):
+        cache = Cache(self.Test)
+
+        async def loader():
+            return None
+
+        self.assertIsNone(await cache.load('a', loader))
+        self.assertEqual(len(cache), 0)
+
+    async def test_cache_discard_during_load(self):
+        cache = Cache(self.Test)
+
+        async def loader():
+            cache.discard('a')
+            return { 'id': 'a' }
+
+        self.assertEqual(await cache.load('a', loader), { 'id': 'a' })
+        self.assertNotIn('a', cache)
+
+    def test_cache_invalidate_change(self):
+        cache = Cache(self.Test)
+        cache.put('a', { 'id': 'a' })
+        cache.put('b', { 'id': 'b' })
+        cache._invalidate({ 'old_val': { 'id': 'a' }, 'new_val': None })
+
+        self.assertNotIn('a', cache)
+        self.assertIn('b', cache)
+        self.assertEqual(cache.stats()['invalidations'], 1)
+
+
+class LoaderTest(AsyncTestCase):
+
+    def setUp(self):
+        batches = self.batches = [ ]
+
+        class Test(object):
+
+            @classmethod
+            async def _load_many(cls, ids):
+                batches.append(ids)
+                return { id: { 'id': id } for id in ids if id != 'missing' }
+
+        self.Test = Test
+
+    def test_loader_context(self):
+        self.assertIsNone(Loader.current())
+
+        with Loader() as loader:
+            self.assertIs(Loader.current(), loader)
+
+        self.assertIsNone(Loader.current())
+
+    async def test_loader_batches(self):
+        loader = Loader()
+
+        results = await asyncio.gather(
+            loader.load(self.Test, 'a'),
+            loader.load(self.Test, 'b'),
+            loader.load(self.Test, 'a'),
+            loader.load(self.Test, 'missing')
+        )
+
+        self.assertEqual(results, [{ 'id': 'a' }, { 'id': 'b' }, { 'id': 'a' }, None])
+        self.assertEqual(self.batches, [['a', 'b', 'missing']])
+        self.assertEqual(loader.batches, 1)
+
+    async def test_loader_memo(self):
+        loader = Loader()
+
+        await loader.load(self.Test, 'a')
+        await loader.load(self.Test, 'a')
+        self.assertEqual(len(self.batches), 1)
+
+        loader.discard(self.Test, 'a')
+        await loader.load(self.Test, 'a')
+        self.assertEqual(len(self.batches), 2)
+
+    async def test_loader_error(self):
+
+        class Failing(object):
+
+            @classmethod
+            async def _load_many(cls, ids):
+                raise ValueError('failed')
+
+        loader = Loader()
+
+        with self.assertRaises(ValueError):
+            await loader.load(Failing, 'a')
+
+        self.assertNotIn((Failing, 'a'), loader._memo)
+
+
+class SubscriptionTest(AsyncTestCase):
+
+    def setUp(self):
+
+        class Test(RethinkDBModel):
+            field = Field()
+
+        self.Test = Test
+
+    def change(self, id, old=None, new=None):
+        return {
+            'old_val': { 'id': id, 'field': old } if old else None,
+            'new_val': { 'id': id, 'field': new } if new else None
+        }
+
+    def test_subscription_policy(self):
+        with self.assertRaises(ValueError):
+            self.Test.subscribe(policy='unknown')
+
+    async def test_subscription_hydrate(self):
+        subscription = self.Test.subscribe()
+        subscription.feed = True
+        subscription.push(self.change('a', new='alpha'))
+        subscription.push(self.change('a', old='alpha', new='beta'))
+
+        old, new = await subscription.__anext__()
+        self.assertIsNone(old)
+        self.assertIsInstance(new, self.Test)
+        self.assertEqual(new.field, 'alpha')
+
+        old, new = await subscription.__anext__()
+        self.assertEqual((old.field, new.field), ('alpha', 'beta'))
+
+    def test_subscription_drop_oldest(self):
+        subscription = self.Test.subscribe(size=2)
+        for id in 'abc':
+            subscription.push(self.change(id, new=id))
+
+        self.assertEqual(subscription.dropped, 1)
+        self.assertEqual(list(map(lambda change: change['new_val']['id'], subscription._pending.values())), ['b', 'c'])
+
+    def test_subscription_drop_newest(self):
+        subscription = self.Test.subscribe(size=2, policy='drop_newest')
+        for id in 'abc':
+            subscription.push(self.change(id, new=id))
+
+        self.assertEqual(subscription.dropped, 1)
+        self.assertEqual(list(map(lambda change: change['new_val']['id'], subscription._pending.values())), ['a', 'b'])
+
+    def test_subscription_coalesce(self):
+        subscription = self.Test.subscribe(policy='coalesce')
+        subscription.push(self.change('a', new='alpha'))
+        subscription.push(self.change('b', new='beta'))
+        subscription.push(self.change('a', old='alpha', new='gamma'))
+        subscription.push(self.change('b', old='beta'))
+
+        self.assertEqual(list(subscription._pending.values()), [self.change('a', new='gamma')])
+        self.assertEqual(subscription.dropped, 0)
+
+    async def test_subscription_close(self):
+        subscription = self.Test.subscribe()
+        subscription.feed = Feed(self.Test, None)
+        subscription.feed.subscribers.add(subscription)
+
+        asyncio.get_event_loop().call_soon(subscription.close)
+
+        with self.assertRaises(StopAsyncIteration):
+            await subscription.__anext__()
+
+        self.assertFalse(subscription.feed.subscribers)
+
+    async def test_feed_shared(self):
+        self.assertIs(Feed.shared(self.Test, 'query'), Feed.shared(self.Test, 'query'))
+        self.assertIsNot(Feed.shared(self.Test, 'query'), Feed.shared(self.Test, 'other'))
+
+        Feed.shared(self.Test, 'query').stop()
+        Feed.shared(self.Test, 'other').stop()
+        self.assertFalse(Feed.feeds)
+
+    async def test_feed_fail(self):
+        feed = Feed(self.Test, None)
+        subscription = self.Test.subscribe()
+        subscription.feed = feed
+        feed.subscribers.add(subscription)
+
+        feed.fail(ValueError('failed'))
+
+        with self.assertRaises(ValueError):
+            await subscription.__anext__()
+
+
+class MemoryBackendTest(AsyncTestCase):
+
+    def setUp(self):
+        self.backend = MemoryBackend()
+
+    async def test_crud(self):
+
+        class Test(RethinkDBModel):
+            backend = self.backend
+            field = Field()
+
+        test = Test(field='alpha')
+        result = await test.create()
+        self.assertEqual(result['inserted'], 1)
+        self.assertEqual(result['generated_keys'], [test.id])
+
+        test.field = 'beta'
+        result = await test.update()
+        self.assertEqual(result['replaced'], 1)
+        self.assertIsNone(await test.update())
+
+        read = await Test.read(test.id)
+        self.assertEqual(read.field, 'beta')
+        self.assertIsNot(read, test)
+
+        read.field = 'gamma'
+        self.assertEqual((await Test.read(test.id)).field, 'beta')
+
+        result = await test.delete()
+        self.assertEqual(result['deleted'], 1)
+        self.assertIsNone(await Test.read(test.id))
+
+    async def test_duplicate(self):
+
+        class Test(RethinkDBModel):
+            backend = self.backend
+            field = Field()
+
+        await Test(id='a', field='alpha').create()
+        test = Test(id='a', field='beta')
+        result = await test.create()
+
+        self.assertEqual(result['errors'], 1)
+        self.assertIn('Duplicate primary key', result['first_error'])
+        self.assertEqual(test._changes(), { 'id': 'a', 'field': 'beta' })
+
+    async def test_update_nested(self):
+
+        class Beta(Model):
+            alpha = Field()
+            gamma = Field()
+
+        class Test(RethinkDBModel):
+            backend = self.backend
+            beta = Field(type=Beta)
+
+        test = Test(id='a', beta={ 'alpha': 'a', 'gamma': 'g' })
+        await test.create()
+
+        test.beta.alpha = 'b'
+        await test.update()
+
+        read = await Test.read('a')
+        self.assertEqual(read.beta.serialize(), { 'alpha': 'b', 'gamma': 'g' })
+
+    async def test_find_by(self):
+
+        class Test(RethinkDBModel):
+            backend = self.backend
+            field = Field(indexed=True)
+            first = Field()
+            last = Field()
+
+            compound_indexes = { 'name': ('last', 'first') }
+
+        await Test.create_many([
+            Test(id='a', field='x', first='f', last='l'),
+            Test(id='b', field='x', first='g', last='l'),
+            Test(id='c', field='y', first='f', last='l')
+        ])
+
+        tests = await Test.find_by(field='x')
+        self.assertEqual(sorted(map(lambda test: test.id, tests)), ['a', 'b'])
+
+        tests = await Test.find_by(first='f', last='l')
+        self.assertEqual(sorted(map(lambda test: test.id, tests)), ['a', 'c'])
+
+        tests[0].field = 'z'
+        await tests[0].update()
+        self.assertEqual(len(await Test.find_by(field='z')), 1)
+
+        tests = await Test.find_by(scan=True, first='g')
+        self.assertEqual(tests[0].id, 'b')
+
+    async def test_read_many(self):
+
+        class Test(RethinkDBModel):
+            backend = self.backend
+            field = Field()
+
+        await Test.create_many([ Test(id='a', field='alpha'), Test(id='b', field='beta') ])
+
+        tests = await Test.read_many(['b', 'missing', 'a'])
+        self.assertEqual(tests[0].field, 'beta')
+        self.assertIsNone(tests[1])
+        self.assertEqual(tests[2].field, 'alpha')
+
+    async def test_query(self):
+
+        class Test(RethinkDBModel):
+            backend = self.backend
+            field = Field()
+            count = Field(type=int, indexed=True)
+            compound_indexes = { 'count_id': ('count', 'id') }
+
+        await Test.create_many([ Test(id=str(i), field='even' if i % 2 else 'odd', count=i) for i in range(10) ])
+
+        tests = [ ]
+        async for test in Test.query().filter(field='even').order_by('count').batch(2):
+            tests.append(test.count)
+
+        self.assertEqual(tests, [1, 3, 5, 7, 9])
+
+        tests = await Test.query().order_by('count', descending=True).limit(3).pluck('count').all()
+        self.assertEqual(list(map(lambda test: test.count, tests)), [9, 8, 7])
+        self.assertEqual(tests[0].serialize(), { 'id': '9', 'count': 9 })
+
+        pages = [ ]
+        async for page in Test.query().pages(4, field='count'):
+            pages.append(list(map(lambda test: test.count, page)))
+
+        self.assertEqual(pages, [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]])
+
+    async def test_query_pages_duplicates(self):
+
+        class Test(RethinkDBModel):
+            backend = self.backend
+            views = Field(type=int, indexed=True)
+            compound_indexes = { 'views_id': ('views', 'id') }
+
+        await Test.create_many([ Test(id=str(i), views=i // 3) for i in range(10) ])
+
+        for descending in (False, True):
+            pages = [ ]
+            async for page in Test.query().order_by('views', descending).pages(2):
+                pages.append(list(map(lambda test: test.id, page)))
+
+            ids = sorted(map(str, range(10)), key=lambda id: (int(id) // 3, id), reverse=descending)
+            self.assertEqual(sum(pages, [ ]), ids)
+            self.assertEqual(list(map(len, pages)), [2, 2, 2, 2, 2])
+
+    async def test_query_pages_unindexed(self):
+
+        class Test(RethinkDBModel):
+            backend = self.backend
+            views = Field(type=int, indexed=True)
+            title = Field()
+
+        await Test.create_many([ Test(id=str(i), views=i, title='title') for i in range(3) ])
+
+        for field in ('title', 'views'):
+            with self.assertRaises(AttributeError):
+                async for page in Test.query().pages(2, field=field):
+                    pass
+
+        pages = [ ]
+        async for page in Test.query().pages(2):
+            pages.append(list(map(lambda test: test.id, page)))
+
+        self.assertEqual(pages, [['0', '1'], ['2']])
+
+    async def test_batch(self):
+
+        class Test(RethinkDBModel):
+            backend = self.backend
+            field = Field()
+
+        tests = [ Test(id=str(i), field='a') for i in range(3) ]
+        summary = await Test.create_many(tests, batch_size=2)
+        self.assertEqual(summary.inserted, 3)
+
+        for test in tests:
+            test.field = 'b'
+        tests[2]._clean()
+
+        summary = await Test.update_many(tests, return_changes=True)
+        self.assertEqual(summary.replaced, 2)
+        self.assertEqual(summary.unchanged, 1)
+        self.assertEqual(len(summary.changes), 2)
+
+        summary = await Test.delete_many(tests + [ Test(id='missing') ])
+        self.assertEqual(summary.deleted, 3)
+        self.assertEqual(summary.skipped, 1)
+
+    async def test_subscribe(self):
+
+        class Test(RethinkDBModel):
+            backend = self.backend
+            field = Field()
+
+        await Test(id='a', field='alpha').create()
+
+        query = Test.query().filter(field='beta')
+
+        async with Test.subscribe(query, include_initial=True) as subscription:
+            await asyncio.sleep(0)
+
+            test = await Test.read('a')
+            test.field = 'beta'
+            await test.update()
+            await Test(id='b', field='alpha').create()
+            await test.delete()
+
+            old, new = await subscription.__anext__()
+            self.assertIsNone(old)
+            self.assertEqual(new.field, 'beta')
+
+            old, new = await subscription.__anext__()
+            self.assertEqual(old.field, 'beta')
+            self.assertIsNone(new)
+
+    async def test_cache_invalidate(self):
+
+        class Test(RethinkDBModel):
+            backend = self.backend
+            cache_options = { 'invalidate': True }
+            field = Field()
+
+        await Test(id='a', field='alpha').create()
+        await Test.read('a')
+        await asyncio.sleep(0)
+
+        await self.backend.update(Test, [{ 'id': 'a', 'field': 'beta' }])
+        await asyncio.sleep(0)
+
+        self.assertEqual((await Test.read('a')).field, 'beta')
+        await Test.close()
+
+    async def test_cache_invalidate_before_ready(self):
+
+        class SlowBackend(MemoryBackend):
+
+            async def changes(self, model, query, **options):
+                await asyncio.sleep(0.01)
+                async for change in MemoryBackend.changes(self, model, query, **options):
+                    yield change
+
+        slow = SlowBackend()
+
+        class Test(RethinkDBModel):
+            backend = slow
+            cache_options = { 'invalidate': True }
+            field = Field()
+
+        await Test(id='a', field='alpha').create()
+        await Test.read('a')
+        await asyncio.sleep(0)
+        await Test.read('a')
+        self.assertNotIn('a', Test.cache())
+
+        # written while the feed is still opening
+        await slow.update(Test, [{ 'id': 'a', 'field': 'beta' }])
+        await asyncio.sleep(0.02)
+
+        self.assertEqual((await Test.read('a')).field, 'beta')
+        self.assertIn('a', Test.cache())
+        await Test.close()
+
+    async def test_cache_feed_ended(self):
+        opened = [ ]
+
+        class EmptyBackend(MemoryBackend):
+
+            async def changes(self, model, query, **options):
+                opened.append(1)
+                yield { 'state': 'ready' }
+
+        empty = EmptyBackend()
+
+        class Test(RethinkDBModel):
+            backend = empty
+            cache_options = { 'invalidate': True, 'retry': 0.05 }
+
+        await Test(id='a').create()
+        await Test.read('a')
+        await asyncio.sleep(0.02)
+
+        self.assertEqual(len(opened), 1)
+        self.assertNotIn('a', Test.cache())
+        await Test.close()
+
+    async def test_drop(self):
+
+        class Test(RethinkDBModel):
+            backend = self.backend
+
+        await Test(id='a').create()
+        await Test.drop()
+
+        self.assertIsNone(await Test.read('a'))
+
+    async def test_only(self):
+
+        class Address(Model):
+            street = Field()
+            zip = Field(type=int)
+
+        class Test(RethinkDBModel):
+            backend = self.backend
+            name = Field(indexed=True)
+            body = Field()
+            address = Field(type=Address)
+            display = Field(computed='get_display', depends=('name', ))
+
+            def get_display(self):
+                return self.name.upper()
+
+        await Test(id='a', name='alpha', body='text', address={ 'street': 's', 'zip': 1 }).create()
+        await Test(id='b', name='beta', body='text', address={ 'street': 't', 'zip': 2 }).create()
+
+        read = await Test.read('a', only=['name', 'address.zip'])
+        self.assertEqual(read.serialize(fields=['id', 'name', 'address']), { 'id': 'a', 'name': 'alpha', 'address': { 'zip': 1 } })
+
+        read = await Test.read('a', only=['display'])
+        self.assertEqual(read.serialize(fields=['display']), { 'display': 'ALPHA' })
+        self.assertNotIn('body', read._state())
+
+        found = await Test.read_many(['b', 'a'], only=['body'])
+        self.assertEqual(list(map(lambda model: model._state(), found)), [{ 'id': 'b', 'body': 'text' }, { 'id': 'a', 'body': 'text' }])
+
+        found = await Test.find_by(name='beta', only=['body'])
+        self.assertEqual(found[0]._state(), { 'id': 'b', 'body': 'text' })
+
+        found = await Test.query().order_by('name').only('address.street').all()
+        self.assertEqual(list(map(lambda model: model.serialize(exclude=['display']), found)), [
+            { 'id': 'a', 'address': { 'street': 's' } },
+            { 'id': 'b', 'address': { 'street': 't' } },
+        ])
+
+        with self.assertRaises(AttributeError):
+            await Test.read('a', only=['missing'])
+
+        with self.assertRaises(AttributeError):
+            await Test.read('a', only=['body.text'])
+
+    async def test_aggregate(self):
+
+        class Test(RethinkDBModel):
+            backend = self.backend
+            status = Field(indexed=True)
+            price = Field(type=int)
+            tags = Field(type=list)
+
+        await Test.create_many([
+            Test(id='a', status='paid', price=10, tags=['x']),
+            Test(id='b', status='paid', price=30, tags=['x', 'y']),
+            Test(id='c', status='open', price=5, tags=['x']),
+            Test(id='d', status='open'),
+        ])
+
+        self.assertEqual(await Test.count(), 4)
+        self.assertEqual(await Test.count({ 'status': 'paid' }), 2)
+        self.assertEqual(await Test.sum('price'), 45)
+        self.assertEqual(await Test.sum('price', { 'status': 'open' }), 5)
+        self.assertEqual(await Test.distinct('status'), ['open', 'paid'])
+        self.assertEqual(await Test.distinct('tags'), [['x'], ['x', 'y']])
+        self.assertEqual(await Test.group_by('status'), { 'paid': 2, 'open': 2 })
+        self.assertEqual(await Test.group_by('status', 'sum', 'price'), { 'paid': 40, 'open': 5 })
+        self.assertEqual(await Test.group_by('status', 'avg', 'price'), { 'paid': 20, 'open': 5 })
+        self.assertEqual(await Test.group_by('status', 'max', 'price', { 'id': 'c' }), { 'open': 5 })
+        self.assertEqual(await Test.query().filter(status='paid').order_by('price').limit(1).sum('price'), 10)
+
+        with self.assertRaises(AttributeError):
+            await Test.sum('missing')
+
+        with self.assertRaises(ValueError):
+            await Test.group_by('status', 'median', 'price')
+
+        with self.assertRaises(ValueError):
+            await Test.group_by('status', 'sum')
+
+    async def test_prepare_fork(self):
+
+        class Test(RethinkDBModel):
+            backend = self.backend
+            field = Field()
+
+        await Test(id='a', field='alpha').create()
+        await prepare([Test])
+        await warm_up([Test])
+
+        self.assertEqual((await Test.read('a')).field, 'alpha')
+
+    async def test_only_cache(self):
+
+        class Test(RethinkDBModel):
+            backend = self.backend
+            cache_options = { }
+            name = Field()
+            body = Field()
+
+        await Test(id='a', name='alpha', body='text').create()
+
+        read = await Test.read('a', only=['name'])
+        self.assertEqual(read._state(), { 'id': 'a', 'name': 'alpha' })
+        self.assertEqual(len(Test.cache()), 0)
+
+        await Test.read('a')
+        read = await Test.read('a', only=['name'])
+        self.assertEqual(read._state(), { 'id': 'a', 'name': 'alpha' })
+        self.assertEqual(Test.cache().hits, 1)
+
+
+class MetricsTest(AsyncTestCase):
+
+    def tearDown(self):
+        del metrics.hooks[:]
+
+    def test_histogram(self):
+        histogram = metrics.Histogram()
+        for value in range(1, 1001):
+            histogram.record(value / 1000000.0)
+
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot['count'], 1000)
+        self.assertEqual((snapshot['min'], snapshot['max']), (1, 1000))
+        self.assertAlmostEqual(snapshot['p50'], 500, delta=500 / 64.0)
+        self.assertAlmostEqual(snapshot['p99'], 990, delta=990 / 64.0)
+
+    def test_histogram_exact(self):
+        histogram = metrics.Histogram()
+        for value in (3, 5, 7):
+            histogram.record(value / 1000000.0)
+
+        self.assertEqual(histogram.percentile(50), 5)
+        self.assertEqual(histogram.percentile(100), 7)
+
+    async def test_events(self):
+        class Test(RethinkDBModel):
+            backend = MemoryBackend()
+            field = Field()
+
+        events = metrics.register(lambda event: self.events.append(event))
+        self.events = [ ]
+
+        test = Test(id='a', field='alpha')
+        await test.create()
+        await Test.read('a')
+        await Test.read('missing')
+        await Test.query().all()
+
+        self.assertEqual(list(map(lambda event: event.operation, self.events)), ['create', 'read', 'read', 'query'])
+        self.assertEqual(self.events[0].model, 'Test')
+        self.assertEqual(self.events[0].count, 1)
+        self.assertEqual(self.events[0].bytes, len('[{"id":"a","field":"alpha"}]'))
+        self.assertEqual(self.events[2].count, 0)
+
+        metrics.unregister(events)
+        await Test.read('a')
+        self.assertEqual(len(self.events), 4)
+
+    async def test_metrics(self):
+        aggregator = metrics.register(metrics.Metrics())
+
+        class Test(RethinkDBModel):
+            backend = MemoryBackend()
+            field = Field()
+
+        await Test.create_many([ Test(id=str(i)) for i in range(3) ])
+        for i in range(3):
+            await Test.read(str(i))
+
+        snapshot = aggregator.snapshot()
+        self.assertEqual(snapshot['Test.read']['count'], 3)
+        self.assertEqual(snapshot['Test.read']['documents'], 3)
+        self.assertEqual(snapshot['Test.create_many']['documents'], 3)
+        self.assertEqual(snapshot['Test.read']['errors'], 0)
+
+    async def test_errors(self):
+        aggregator = metrics.register(metrics.Metrics())
+
+        class Test(RethinkDBModel):
+            pass
+
+        async def failing():
+            raise ValueError('failed')
+
+        with self.assertRaises(ValueError):
+            await metrics.measure(Test, 'read', failing())
+
+        self.assertEqual(aggregator.snapshot()['Test.read']['errors'], 1)
+
+
+class CodecTest(AsyncTestCase):
+
+    def setUp(self):
+
+        class Address(Model):
+            street = Field()
+            zip = Field(type=int)
+
+        class Author(RethinkDBModel):
+            name = Field()
+
+        class Test(Model):
+            name = Field()
+            address = Field(type=Address)
+            author = Field(type=Author, related=True)
+            display = Field(computed='get_display')
+
+            def get_display(self):
+                return self.name.upper()
+
+        self.Test = Test
+        self.Author = Author
+        self.document = { 'id': 'a', 'name': 'n\u00e9', 'address': { 'street': 's', 'zip': 1 }, 'author': 'b' }
+
+    def modes(self):
+        return [
+            type('Test', (self.Test, ), { 'compiled': compiled, 'slotted': slotted, 'lazy': lazy })
+            for compiled in (False, True) for slotted in (False, True) for lazy in (False, True)
+        ]
+
+    def test_dumps(self):
+        for name in codec.Codec.codecs:
+            for Test in self.modes():
+                with self.subTest(codec=name, model=Test):
+                    test = Test.from_many([self.document])[0]
+                    test.author = self.Author(id='c', name='c')
+                    encoded = test.dumps(name)
+
+                    self.assertIsInstance(encoded, bytes)
+                    self.assertEqual(codec.Codec.get(name).loads(encoded), test.serialize())
+                    self.assertEqual(Test.loads(encoded, name).serialize(), test.serialize())
+
+    def test_dumps_stdlib_compatible(self):
+
+        class Test(Model):
+            data = Field(type=dict)
+
+        test = Test(id='a', data={ 1: 'x', 'big': 2 ** 70 })
+        expected = json.loads(codec.Codec.get('stdlib').dumps(test))
+
+        for name in ('json', 'stdlib', 'orjson'):
+            if name in codec.Codec.codecs:
+                with self.subTest(codec=name):
+                    self.assertEqual(json.loads(test.dumps(name)), expected)
+
+        self.assertEqual(codec.canonical({ 2: 2 ** 70, 1: 'x' }), '{"1":"x","2":1180591620717411303424}')
+
+    def test_encode_many(self):
+        for name in codec.Codec.codecs:
+            with self.subTest(codec=name):
+                tests = self.Test.from_many([self.document] * 3)
+                encoded = self.Test.encode_many(tests, name)
+
+                self.assertEqual(codec.Codec.get(name).loads(encoded), list(map(lambda test: test.serialize(), tests)))
+                self.assertEqual(list(map(lambda test: test.name, self.Test.decode_many(encoded, name))), ['n\u00e9'] * 3)
+
+    def test_iterencode(self):
+        tests = self.Test.from_many([self.document] * 5)
+        chunks = list(self.Test.iterencode(tests, size=2, codec='stdlib'))
+
+        self.assertEqual(len(chunks), 5)
+        self.assertEqual(json.loads(b''.join(chunks)), list(map(lambda test: test.serialize(), tests)))
+        self.assertEqual(b''.join(self.Test.iterencode([ ], codec='json')), b'[]')
+
+    @skipUnless(codec.msgpack, 'msgpack is not installed')
+    def test_iterencode_msgpack(self):
+        tests = self.Test.from_many([self.document] * 5)
+        encoded = b''.join(self.Test.iterencode(tests, size=2, codec='msgpack'))
+        self.assertEqual(codec.msgpack.unpackb(encoded, raw=False), list(map(lambda test: test.serialize(), tests)))
+
+    def test_unknown(self):
+        with self.assertRaises(ValueError):
+            self.Test.from_many([self.document])[0].dumps('unknown')
+
+        with self.assertRaises(TypeError):
+            codec.Codec.get('stdlib').dumps(object())
+
+
+class HandlerPost(RethinkDBModel):
+    title = Field(required=True)
+    views = Field(type=int, indexed=True)
+
+
+class ModelHandlerTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        return Application(routes(HandlerPost, chunk_size=2, offload_size=2))
+
+    def drop(self):
+        self.io_loop.run_sync(HandlerPost.drop)
+        self.io_loop.run_sync(HandlerPost.close)
+
+    def request(self, method, path, body=None):
+        if body is not None and not isinstance(body, str):
+            body = json.dumps(body)
+        return self.fetch(path, method=method, body=body, allow_nonstandard_methods=True)
+
+    def test_routes(self):
+        self.assertEqual(list(map(lambda route: route[0], routes(HandlerPost))), ['/handler_posts/?', '/handler_posts/([^/]+)/?'])
+        self.assertEqual(routes(HandlerPost, prefix='/posts', chunk_size=5)[0][2], { 'model': HandlerPost, 'chunk_size': 5 })
+
+    def test_create_invalid_json(self):
+        response = self.request('POST', '/handler_posts', '{')
+        self.assertEqual(response.code, 400)
+        self.assertIn('error', json.loads(response.body))
+
+    def test_create_undefined_field(self):
+        response = self.request('POST', '/handler_posts', { 'title': 'a', 'undefined': 'b' })
+        self.assertEqual(response.code, 400)
+
+    def test_create_invalid_fields(self):
+        response = self.request('POST', '/handler_posts', { 'views': 'many', 'undefined': 'b' })
+        self.assertEqual(response.code, 400)
+
+        errors = json.loads(response.body)['errors']
+        self.assertEqual(sorted(map(lambda error: (error['field'], error['code']), errors)), [
+            ('title', 'missing'),
+            ('undefined', 'undefined'),
+            ('views', 'type')
+        ])
+
+    def test_update_invalid_fields(self):
+        response = self.request('PATCH', '/handler_posts/a', { 'views': 'many' })
+        self.assertEqual(response.code, 400)
+        self.assertEqual(json.loads(response.body)['errors'][0]['field'], 'views')
+
+    def test_list_invalid_filter(self):
+        response = self.request('GET', '/handler_posts?views=many')
+        self.assertEqual(response.code, 400)
+
+    def test_update_primary(self):
+        response = self.request('PUT', '/handler_posts/a', { 'id': 'b' })
+        self.assertEqual(response.code, 400)
+
+    def test_list_undefined_filter(self):
+        response = self.request('GET', '/handler_posts?undefined=a')
+        self.assertEqual(response.code, 400)
+
+    def test_list_undefined_fields(self):
+        response = self.request('GET', '/handler_posts?fields=title,undefined')
+        self.assertEqual(response.code, 400)
+
+    def test_crud(self):
+        response = self.request('POST', '/handler_posts', { 'id': 'a', 'title': 'alpha', 'views': 1 })
+        self.assertEqual(response.code, 201)
+        self.assertEqual(json.loads(response.body), { 'id': 'a', 'title': 'alpha', 'views': 1 })
+
+        response = self.request('POST', '/handler_posts', { 'views': 1 })
+        self.assertEqual(response.code, 400)
+
+        response = self.request('GET', '/handler_posts/a')
+        self.assertEqual(json.loads(response.body)['title'], 'alpha')
+
+        response = self.request('PATCH', '/handler_posts/a', { 'views': 2 })
+        self.assertEqual(json.loads(response.body)['views'], 2)
+
+        response = self.request('DELETE', '/handler_posts/a')
+        self.assertEqual(response.code, 204)
+
+        response = self.request('GET', '/handler_posts/a')
+        self.assertEqual(response.code, 404)
+
+        response = self.request('DELETE', '/handler_posts/a')
+        self.assertEqual(response.code, 404)
+
+        self.drop()
+
+    def test_list(self):
+        for i in range(5):
+            self.request('POST', '/handler_posts', { 'id': str(i), 'title': 'post', 'views': i })
+
+        response = self.request('GET', '/handler_posts?order_by=-views&limit=4')
+        documents = json.loads(response.body)
+        self.assertEqual(list(map(lambda document: document['views'], documents)), [4, 3, 2, 1])
+
+        response = self.request('GET', '/handler_posts?views=3')
+        self.assertEqual(json.loads(response.body)[0]['id'], '3')
+
+        response = self.request('GET', '/handler_posts?title=missing')
+        self.assertEqual(json.loads(response.body), [ ])
+
+        response = self.request('GET', '/handler_posts?views=3&fields=views')
+        self.assertEqual(json.loads(response.body), [{ 'views': 3 }])
+
+        response = self.request('GET', '/handler_posts/3?fields=title')
+        self.assertEqual(json.loads(response.body), { 'title': 'post' })
+
+        self.drop()
+
+
+class HandlerDocument(RethinkDBModel):
+    backend = MemoryBackend()
+    body = Field()
+
+
+class CountingExecutor(ThreadPoolExecutor):
+
+    def __init__(self):
+        super(CountingExecutor, self).__init__(max_workers=1)
+        self.submitted = 0
+
+    def submit(self, *args, **kargs):
+        self.submitted += 1
+        return super(CountingExecutor, self).submit(*args, **kargs)
+
+
+class HandlerOffloadTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        self.executor = CountingExecutor()
+        return Application(routes(HandlerDocument, offload_size=1000, executor=self.executor))
+
+    def test_offload_large_document(self):
+        for id, body in (('small', 'x'), ('large', 'x' * 2000)):
+            self.io_loop.run_sync(HandlerDocument(id=id, body=body).create)
+
+        response = self.fetch('/handler_documents/small')
+        self.assertEqual(json.loads(response.body)['body'], 'x')
+        self.assertEqual(self.executor.submitted, 0)
+
+        response = self.fetch('/handler_documents/large')
+        self.assertEqual(len(json.loads(response.body)['body']), 2000)
+        self.assertEqual(self.executor.submitted, 1)
+
+
+class HandlerCounter(RethinkDBModel):
+    backend = MemoryBackend()
+    views = Field(type=int, indexed=True)
+    compound_indexes = { 'views_id': ('views', 'id') }
+
+
+class HandlerQueryTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        return Application(routes(HandlerCounter))
+
+    def setUp(self):
+        super(HandlerQueryTest, self).setUp()
+        self.io_loop.run_sync(HandlerCounter.drop)
+        self.io_loop.run_sync(lambda: HandlerCounter.create_many([ HandlerCounter(id=str(i), views=i // 3) for i in range(9) ]))
+
+    def list(self, query):
+        response = self.fetch('/handler_counters?' + query)
+        return response.code, json.loads(response.body)
+
+    def test_list_order_after(self):
+        code, body = self.list('order_by=views&after=1&after_key=3')
+        self.assertEqual(code, 200)
+        self.assertEqual(list(map(lambda item: item['id'], body)), ['4', '5', '6', '7', '8'])
+
+        code, body = self.list('order_by=-views&after=1&after_key=4&limit=2')
+        self.assertEqual(list(map(lambda item: item['id'], body)), ['3', '2'])
+
+        code, body = self.list('after=6')
+        self.assertEqual(list(map(lambda item: item['id'], body)), ['7', '8'])
+
+    def test_list_pages(self):
+        ids = [ ]
+        query = 'order_by=views&limit=2'
+
+        while True:
+            code, body = self.list(query)
+            if not body:
+                break
+            ids.extend(map(lambda item: item['id'], body))
+            query = 'order_by=views&limit=2&after={views}&after_key={id}'.format(**body[-1])
+
+        self.assertEqual(ids, list(map(str, range(9))))
+
+    def test_list_bad_order(self):
+        for query in ('order_by=bogus', 'order_by=views&after=x&after_key=1', 'order_by=views&after=1'):
+            code, body = self.list(query)
+            self.assertEqual(code, 400)
+            self.assertIn('error', body)
+
+    def test_create_duplicate(self):
+        response = self.fetch('/handler_counters', method='POST', body=json.dumps({ 'id': '0', 'views': 1 }))
+        self.assertEqual(response.code, 400)
+        self.assertIn('Duplicate primary key', json.loads(response.body)['error'])
+
+    def test_validation_errors(self):
+        response = self.fetch('/handler_counters', method='POST', body=json.dumps({ 'views': 'many' }))
+        self.assertEqual(response.code, 400)
+        self.assertEqual(json.loads(response.body)['errors'][0]['field'], 'views')
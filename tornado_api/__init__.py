@@ -1,4 +1,5 @@
 from . asynctest import AsyncTestCase
 
-from . model import Model, Field
+from . model import Model, Field, ValidationError
 from . rethinkdb import RethinkDBModel, database
+from . handler import ModelHandler, routes
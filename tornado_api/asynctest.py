@@ -2,10 +2,6 @@ import unittest
 import asyncio
 
 
-# close the default event loop
-asyncio.get_event_loop().close()
-
-
 class AsyncTestCase(unittest.TestCase):
 
     def setUpEventLoop(self):
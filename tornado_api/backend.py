@@ -0,0 +1,166 @@
+import rethinkdb as r
+
+from . import projection
+from . database import database
+from . schema import Schema
+
+
+def _group_key(value):
+    if isinstance(value, list):
+        return tuple(value)
+    return value
+
+
+class Backend(object):
+
+    async def connect(self, model):
+        raise NotImplementedError
+
+    async def close(self, model):
+        raise NotImplementedError
+
+    async def warm_up(self, model):
+        pass
+
+    async def drop(self, model):
+        raise NotImplementedError
+
+    async def get(self, model, key):
+        raise NotImplementedError
+
+    async def get_all(self, model, keys, index=None, fields=None):
+        raise NotImplementedError
+
+    async def insert(self, model, documents, **options):
+        raise NotImplementedError
+
+    async def update(self, model, documents, **options):
+        raise NotImplementedError
+
+    async def delete(self, model, keys, **options):
+        raise NotImplementedError
+
+    async def query(self, model, query):
+        raise NotImplementedError
+
+    def stream(self, model, query, size):
+        raise NotImplementedError
+
+    def changes(self, model, query, include_initial=False, include_states=False):
+        raise NotImplementedError
+
+    async def count(self, model, query):
+        raise NotImplementedError
+
+    async def sum(self, model, query, field):
+        raise NotImplementedError
+
+    async def distinct(self, model, query, field):
+        raise NotImplementedError
+
+    async def group(self, model, query, field, reducer, value=None):
+        raise NotImplementedError
+
+
+class RethinkDBBackend(Backend):
+
+    async def connect(self, model):
+        if model._ensure:
+            await Schema.once(('ensure', model), model._ensure_all)
+
+    async def close(self, model):
+        await database.pool(model.db_options, **model.pool_options).close()
+
+    async def warm_up(self, model):
+        await database.pool(model.db_options, **model.pool_options).fill()
+
+    async def drop(self, model):
+        await model.connect()
+        tables = await model._run(model._db.table_list())
+        if model._table in tables:
+            await model._run(model._db.table_drop(model._table))
+        Schema.discard_table(model.db_options, model.db_options.get('db', 'test'), model._table)
+        model._ensure = True
+
+    async def get(self, model, key):
+        return await model._run(model.r.get(key))
+
+    async def get_all(self, model, keys, index=None, fields=None):
+        if index:
+            query = model.r.get_all(*keys, index=index)
+        else:
+            query = model.r.get_all(*keys)
+        if fields:
+            query = query.pluck(*projection.selector(fields))
+        return await model._run(query.coerce_to('array'))
+
+    async def insert(self, model, documents, **options):
+        return await model._run(model.r.insert(documents, **options))
+
+    async def update(self, model, documents, **options):
+        primary = model._primary.name
+
+        if len(documents) == 1:
+            document = dict(documents[0])
+            key = document.pop(primary)
+            return await model._run(model.r.get(key).update(document, **options))
+
+        query = r.expr(documents).for_each(
+            lambda document: model.r.get(document[primary]).update(document, **options)
+        )
+        return await model._run(query)
+
+    async def delete(self, model, keys, **options):
+        return await model._run(model.r.get_all(*keys).delete(**options))
+
+    async def query(self, model, query):
+        return await model._run(query.compile().coerce_to('array'))
+
+    async def stream(self, model, query, size):
+        async with model.acquire() as connection:
+            cursor = await query.compile().run(connection, max_batch_rows=size)
+            try:
+                documents = [ ]
+                while (await cursor.fetch_next()):
+                    documents.append(await cursor.next())
+                    if len(documents) >= size:
+                        yield documents
+                        documents = [ ]
+                if documents:
+                    yield documents
+            finally:
+                cursor.close()
+
+    async def count(self, model, query):
+        return await model._run(query.selection().count())
+
+    async def sum(self, model, query, field):
+        return await model._run(query.selection().sum(field))
+
+    async def distinct(self, model, query, field):
+        if query._plain() and query._indexed(field):
+            return await model._run(model.r.distinct(index=query._index(field)).coerce_to('array'))
+        return await model._run(query.selection().get_field(field).distinct())
+
+    async def group(self, model, query, field, reducer, value=None):
+        if query._plain() and query._indexed(field):
+            grouped = model.r.group(index=query._index(field))
+        else:
+            grouped = query.selection().group(field)
+
+        if reducer == 'count':
+            grouped = grouped.count()
+        else:
+            grouped = getattr(grouped.get_field(value), reducer)()
+
+        result = await model._run(grouped.ungroup())
+        return { _group_key(item['group']): item['reduction'] for item in result }
+
+    async def changes(self, model, query, include_initial=False, include_states=False):
+        connection = await r.connect(**model.db_options)
+        try:
+            cursor = await query.compile().changes(include_initial=include_initial, include_states=include_states).run(connection)
+            while (await cursor.fetch_next()):
+                yield await cursor.next()
+        finally:
+            await connection.close(noreply_wait=False)
@@ -0,0 +1,190 @@
+import time
+import pickle
+import asyncio
+import collections
+
+
+class Cache(object):
+
+    def __init__(self, model, size=1024, bytes=None, ttl=None, invalidate=False, retry=1):
+        self.model = model
+        self.size = size
+        self.bytes = bytes
+        self.ttl = ttl
+        self.invalidate = invalidate
+        self.retry = retry
+
+        self.used = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+        self._entries = collections.OrderedDict()
+        self._pending = { }
+        self._version = 0
+        self._feed = None
+        self._live = False
+
+    def __repr__(self):
+        message = '<Cache {model} entries:{entries} bytes:{used} hits:{hits} misses:{misses} evictions:{evictions}>'
+        return message.format(
+            model=self.model.__name__,
+            entries=len(self._entries),
+            used=self.used,
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions
+        )
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'bytes': self.used,
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
+
+    def _remove(self, key):
+        encoded, expires = self._entries.pop(key)
+        self.used -= len(encoded)
+
+    def _full(self):
+        if self.size is not None and len(self._entries) > self.size:
+            return True
+        return self.bytes is not None and self.used > self.bytes
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        encoded, expires = entry
+        if expires is not None and expires <= time.monotonic():
+            self._remove(key)
+            self.evictions += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return pickle.loads(encoded)
+
+    def put(self, key, document):
+        if self.invalidate:
+            self.watch()
+        self._store(key, pickle.dumps(document, pickle.HIGHEST_PROTOCOL))
+
+    def _store(self, key, encoded):
+        # a write before the change feed is live would never be invalidated
+        if self.invalidate and not self._live:
+            return
+
+        if key in self._entries:
+            self._remove(key)
+
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        self._entries[key] = (encoded, expires)
+        self.used += len(encoded)
+
+        while self._entries and self._full():
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def discard(self, key):
+        self._version += 1
+        if key in self._entries:
+            self._remove(key)
+            self.invalidations += 1
+
+    def clear(self):
+        self._version += 1
+        self.invalidations += len(self._entries)
+        self._entries.clear()
+        self.used = 0
+
+    async def _load(self, key, loader):
+        version = self._version
+        try:
+            document = await loader()
+            if document is None:
+                return None
+            encoded = pickle.dumps(document, pickle.HIGHEST_PROTOCOL)
+            if version == self._version:
+                self._store(key, encoded)
+            return encoded
+        finally:
+            del self._pending[key]
+
+    async def load(self, key, loader):
+        document = self.get(key)
+        if document is not None:
+            return document
+
+        if self.invalidate:
+            self.watch()
+
+        future = self._pending.get(key)
+        if future:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            future = self._pending[key] = asyncio.ensure_future(self._load(key, loader))
+
+        encoded = await asyncio.shield(future)
+        if encoded is not None:
+            return pickle.loads(encoded)
+
+    def watch(self):
+        # a feed started before a fork belongs to the parent's loop
+        if not self._feed or self._feed.done() or self._feed.get_loop() is not asyncio.get_event_loop():
+            self._feed = asyncio.ensure_future(self._watch())
+        return self._feed
+
+    def _invalidate(self, change):
+        primary = self.model._primary.name
+        for document in (change.get('old_val'), change.get('new_val')):
+            if document and primary in document:
+                self.discard(document[primary])
+
+    async def _watch(self):
+        while True:
+            self._live = False
+            try:
+                async for change in self.model.backend.changes(self.model, self.model.query(), include_states=True):
+                    if 'state' not in change:
+                        self._invalidate(change)
+                    elif change['state'] == 'ready':
+                        # loads started before the feed was ready may have missed a change
+                        self.clear()
+                        self._live = True
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                pass
+
+            # a feed that failed or ended is retried after the same delay
+            self._live = False
+            self.clear()
+            await asyncio.sleep(self.retry)
+
+    async def close(self):
+        feed, self._feed = self._feed, None
+        if feed and not feed.done():
+            feed.cancel()
+            try:
+                await feed
+            except asyncio.CancelledError:
+                pass
+        self._live = False
+        self.clear()
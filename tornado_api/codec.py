@@ -0,0 +1,152 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+def _default(obj):
+    encodable = getattr(obj, '_encodable', None)
+    if encodable is None:
+        raise TypeError('Object of type {type} is not serializable'.format(type=type(obj).__name__))
+    return encodable()
+
+
+def canonical(obj):
+    if orjson:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS).decode('utf-8')
+        except TypeError:
+            pass
+    return json.dumps(obj, separators=(',', ':'), sort_keys=True)
+
+
+class Codec(object):
+
+    codecs = { }
+
+    name = None
+    content_type = None
+
+    def __repr__(self):
+        return '<Codec {name} content_type:{content_type}>'.format(name=self.name, content_type=self.content_type)
+
+    @classmethod
+    def register(cls, codec, name=None):
+        cls.codecs[name or codec.name] = codec
+        return codec
+
+    @classmethod
+    def get(cls, name):
+        if isinstance(name, Codec):
+            return name
+
+        codec = cls.codecs.get(name)
+        if codec is None:
+            message = 'Codec must be one of {codecs}: {codec}'.format(
+                codecs=sorted(cls.codecs),
+                codec=name
+            )
+            raise ValueError(message)
+
+        return codec
+
+    def dumps(self, obj):
+        raise NotImplementedError
+
+    def loads(self, data):
+        raise NotImplementedError
+
+    def encode_many(self, objs):
+        return self.dumps(list(objs))
+
+    def iterencode(self, objs, size=100):
+        raise NotImplementedError
+
+
+class JSONCodec(Codec):
+
+    name = 'stdlib'
+    content_type = 'application/json'
+
+    encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), default=_default)
+
+    def dumps(self, obj):
+        return self.encoder.encode(obj).encode('utf-8')
+
+    def loads(self, data):
+        return json.loads(data)
+
+    def iterencode(self, objs, size=100):
+        yield b'['
+
+        first = True
+        chunk = [ ]
+
+        for obj in objs:
+            chunk.append(obj)
+            if len(chunk) >= size:
+                yield (b'' if first else b',') + self.encode_many(chunk)[1:-1]
+                first = False
+                chunk = [ ]
+
+        if chunk:
+            yield (b'' if first else b',') + self.encode_many(chunk)[1:-1]
+
+        yield b']'
+
+
+class ORJSONCodec(JSONCodec):
+
+    name = 'orjson'
+
+    def dumps(self, obj):
+        # anything orjson refuses, such as integers wider than 64 bits, goes
+        # through the stdlib encoder so both accept the same documents
+        try:
+            return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            return JSONCodec.dumps(self, obj)
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+
+class MessagePackCodec(Codec):
+
+    name = 'msgpack'
+    content_type = 'application/msgpack'
+
+    def dumps(self, obj):
+        return msgpack.packb(obj, default=_default, use_bin_type=True)
+
+    def loads(self, data):
+        return msgpack.unpackb(data, raw=False)
+
+    def iterencode(self, objs, size=100):
+        # the array header carries the length, so the items are counted first
+        objs = list(objs)
+        packer = msgpack.Packer(default=_default, use_bin_type=True)
+
+        yield packer.pack_array_header(len(objs))
+
+        for start in range(0, len(objs), size):
+            yield b''.join(map(packer.pack, objs[start:start + size]))
+
+
+Codec.register(JSONCodec())
+
+if orjson:
+    Codec.register(ORJSONCodec())
+
+if msgpack:
+    Codec.register(MessagePackCodec())
+
+# json is the fastest JSON codec installed
+Codec.register(Codec.codecs.get('orjson') or Codec.codecs['stdlib'], 'json')
@@ -0,0 +1,313 @@
+import inspect
+
+
+def slot_name(name):
+    return '_slot_' + name
+
+
+class Source(object):
+
+    def __init__(self, cls):
+        self.cls = cls
+        self.lines = [ ]
+        self.namespace = { }
+
+    def bind(self, prefix, value):
+        name = '{prefix}_{index}'.format(prefix=prefix, index=len(self.namespace))
+        self.namespace[name] = value
+        return name
+
+    def line(self, indent, text):
+        self.lines.append('    ' * indent + text)
+
+    def build(self, name):
+        source = '\n'.join(self.lines)
+        filename = '<compiled {model}.{name}>'.format(model=self.cls.__name__, name=name)
+        exec(compile(source, filename, 'exec'), self.namespace)
+        function = self.namespace[name]
+        function.__qualname__ = '{model}.{name}'.format(model=self.cls.__qualname__, name=name)
+        function.__module__ = self.cls.__module__
+        function.generated = True
+        return function
+
+
+def replaceable(cls, name):
+    # a method is only generated over Model's own or one generated for a
+    # base, a method the user defined anywhere in the MRO is kept
+    from . model import Model
+
+    for klass in cls.__mro__:
+        if name in klass.__dict__:
+            function = klass.__dict__[name]
+            return function is Model.__dict__.get(name) or getattr(function, 'generated', False)
+    return False
+
+
+def _models(cls):
+    return set(map(lambda field: field.name, filter(lambda field: isinstance(field.type, type(cls)), cls._fields)))
+
+
+def _method(cls, field):
+    name = field.computed
+
+    if inspect.ismethod(name):
+        name = name.__name__
+
+    if isinstance(name, str):
+        method = getattr(cls, name, None)
+
+        if method is None:
+            message = 'Model {model} has missing methods: {fields}'.format(
+                model=cls.__name__,
+                fields=[name]
+            )
+            raise AttributeError(message)
+
+        if not inspect.isfunction(method):
+            message = 'Model {model} computed fields must be method names or functions: {fields}'.format(
+                model=cls.__name__,
+                fields=[name]
+            )
+            raise AttributeError(message)
+
+        return name
+
+    if not inspect.isfunction(field.computed):
+        message = 'Model {model} computed fields must be method names or functions: {fields}'.format(
+            model=cls.__name__,
+            fields=[field.computed]
+        )
+        raise AttributeError(message)
+
+
+def _store(source, field, value):
+    if source.cls.slotted:
+        setter = source.bind('setattr', object.__setattr__)
+        return '{setter}(self, {slot}, {value})'.format(setter=setter, slot=repr(slot_name(field.name)), value=value)
+    return 'state[{key}] = {value}'.format(key=repr(field.name), value=value)
+
+
+def _hydrate_body(source, indent):
+    cls = source.cls
+    models = _models(cls)
+
+    names = source.bind('names', cls._field_names)
+    source.line(indent, 'if not {names}.issuperset(kargs):'.format(names=names))
+    source.line(indent + 1, 'self._check_undefined(kargs)')
+
+    if not cls.slotted:
+        source.line(indent, 'state = self.__dict__')
+
+    # a nested field assigned on a lazy model replaces its deferred document
+    lazy = cls.lazy and bool(cls._nested)
+    if lazy:
+        source.line(indent, "raw = getattr(self, '_raw', None)")
+
+    for field in cls._fields:
+        key = repr(field.name)
+        source.line(indent, 'if {key} in kargs:'.format(key=key))
+        if field.name in models:
+            model = source.bind('model', field.type)
+            source.line(indent + 1, 'value = kargs[{key}]'.format(key=key))
+            source.line(indent + 1, _store(source, field, '{model}(**value) if type(value) is dict else value'.format(
+                model=model
+            )))
+            if lazy and field in cls._nested:
+                source.line(indent + 1, 'if raw:')
+                source.line(indent + 2, 'raw.pop({key}, None)'.format(key=key))
+        else:
+            convert = source.bind('convert', cls._converters[field.name])
+            source.line(indent + 1, _store(source, field, '{convert}(kargs[{key}])'.format(key=key, convert=convert)))
+
+
+def compile_hydrate(cls):
+    source = Source(cls)
+    source.line(0, 'def _hydrate(self, kargs):')
+    _hydrate_body(source, 1)
+    return source.build('_hydrate')
+
+
+def compile_init(cls):
+    from . model import _everything
+
+    source = Source(cls)
+    source.line(0, 'def __init__(self, dictionary=None, **kargs):')
+    source.line(1, 'if dictionary:')
+    source.line(2, 'dictionary.update(kargs)')
+    source.line(2, 'kargs = dictionary')
+    _hydrate_body(source, 1)
+    setter = source.bind('setattr', object.__setattr__)
+    everything = source.bind('everything', _everything)
+    source.line(1, "{setter}(self, '_changed', {everything})".format(setter=setter, everything=everything))
+    return source.build('__init__')
+
+
+def compile_serialize(cls):
+    from . model import foreign_key
+
+    models = _models(cls)
+
+    source = Source(cls)
+    source.line(0, 'def serialize(self, verify=False, fields=None, exclude=None):')
+    source.line(1, 'if fields is not None or exclude is not None:')
+    source.line(2, 'return self._projection(verify, fields, exclude)')
+
+    if cls.slotted:
+        missing = source.bind('missing', object())
+        source.line(1, 'obj = { }')
+        for field in cls._fields:
+            source.line(1, 'value = getattr(self, {slot}, {missing})'.format(slot=repr(slot_name(field.name)), missing=missing))
+            source.line(1, 'if value is not {missing}:'.format(missing=missing))
+            source.line(2, 'obj[{key}] = value'.format(key=repr(field.name)))
+        source.line(1, 'if verify:')
+        source.line(2, 'self._check_missing(obj)')
+    else:
+        source.line(1, 'state = self.__dict__')
+        source.line(1, 'if verify:')
+        source.line(2, 'self._check_missing(state)')
+        source.line(1, 'obj = state.copy()')
+
+    for field in cls._serialized:
+        key = repr(field.name)
+
+        if field.relation:
+            function = source.bind('foreign_key', foreign_key)
+            instance = source.bind('field', field)
+            source.line(1, 'if {key} in obj:'.format(key=key))
+            source.line(2, 'obj[{key}] = {function}({field}, obj[{key}])'.format(key=key, function=function, field=instance))
+            continue
+
+        if field.name in models:
+            source.line(1, 'if {key} in obj:'.format(key=key))
+            source.line(2, 'obj[{key}] = obj[{key}].serialize(verify)'.format(key=key))
+            continue
+
+        if field.computed_empty:
+            continue
+
+        method = _method(cls, field)
+
+        if field.cached:
+            source.line(1, 'obj[{key}] = self._compute({field})'.format(key=key, field=source.bind('field', field)))
+            continue
+
+        if method and method.isidentifier():
+            call = 'self.{method}()'.format(method=method)
+        elif method:
+            call = 'getattr(self, {method})()'.format(method=repr(method))
+        else:
+            call = '{function}()'.format(function=source.bind('computed', field.computed))
+
+        if not field.computed_type:
+            call = '{type}({call})'.format(type=source.bind('type', field.type), call=call)
+
+        source.line(1, 'obj[{key}] = {call}'.format(key=key, call=call))
+
+    source.line(1, 'return obj')
+    return source.build('serialize')
+
+
+def _error(path, code, message):
+    return { 'field': '.'.join(map(str, path)), 'code': code, 'message': message }
+
+
+def _coercible(field):
+    message = 'must be {type}'.format(type=field.type.__name__)
+
+    def check(value, path, errors):
+        try:
+            field.type(value)
+        except (TypeError, ValueError):
+            errors.append(_error(path, 'type', message))
+
+    return check
+
+
+# conversions to these types never fail, so their values need no check
+_unchecked = (str, bool, object)
+
+
+def compile_validate(cls):
+    models = _models(cls)
+
+    source = Source(cls)
+    error = source.bind('error', _error)
+
+    source.line(0, 'def _validate(document, path, errors, partial=False):')
+    source.line(1, 'if type(document) is not dict:')
+    source.line(2, "errors.append({error}(path, 'type', 'must be an object'))".format(error=error))
+    source.line(2, 'return errors')
+
+    names = source.bind('names', cls._field_names)
+    source.line(1, 'if not {names}.issuperset(document):'.format(names=names))
+    source.line(2, 'for key in document:')
+    source.line(3, 'if key not in {names}:'.format(names=names))
+    source.line(4, "errors.append({error}(path + (key, ), 'undefined', 'is not defined'))".format(error=error))
+
+    for field in cls._fields:
+        key = repr(field.name)
+        path = 'path + ({key}, )'.format(key=key)
+
+        lines = [ ]
+
+        if field.computed or field.relation:
+            pass
+        elif field.name in models:
+            validator = source.bind('validator', field.type._validator)
+            model = source.bind('model', field.type)
+            lines.append((2, 'value = document[{key}]'.format(key=key)))
+            lines.append((2, 'if type(value) is dict:'))
+            lines.append((3, '{validator}()(value, {path}, errors, partial)'.format(validator=validator, path=path)))
+            lines.append((2, 'elif not isinstance(value, {model}):'.format(model=model)))
+            lines.append((3, "errors.append({error}({path}, 'type', 'must be an object'))".format(error=error, path=path)))
+        elif field.type not in _unchecked:
+            kind = source.bind('type', field.type)
+            check = source.bind('check', _coercible(field))
+            lines.append((2, 'value = document[{key}]'.format(key=key)))
+            lines.append((2, 'if type(value) is not {kind}:'.format(kind=kind)))
+            lines.append((3, '{check}(value, {path}, errors)'.format(check=check, path=path)))
+
+        required = field.required and not field.computed
+
+        if not lines and not required:
+            continue
+
+        if lines:
+            source.line(1, 'if {key} in document:'.format(key=key))
+            for indent, text in lines:
+                source.line(indent, text)
+            if required:
+                source.line(1, 'elif not partial:')
+        else:
+            source.line(1, 'if not partial and {key} not in document:'.format(key=key))
+
+        if required:
+            source.line(2, "errors.append({error}({path}, 'missing', 'is required'))".format(error=error, path=path))
+
+    source.line(1, 'return errors')
+    return source.build('_validate')
+
+
+def compile_model(cls):
+    from . model import Model
+
+    for field in cls._computed:
+        _method(cls, field)
+
+    functions = {
+        '__init__': compile_init,
+        '_hydrate': compile_hydrate,
+        'serialize': compile_serialize,
+    }
+
+    # the generated __init__ and _hydrate store inline, so a user defined
+    # _store or _set keeps the generic versions that go through it
+    inline = replaceable(cls, '_store') and replaceable(cls, '_set')
+
+    for name, compiler in functions.items():
+        if not replaceable(cls, name):
+            continue
+        if inline or name == 'serialize':
+            setattr(cls, name, compiler(cls))
+        else:
+            setattr(cls, name, Model.__dict__[name])
@@ -1,29 +1,267 @@
-import json
+import os
+import asyncio
+import collections
 
 import rethinkdb as r
 
+from . codec import canonical
+
 
 r.set_loop_type('asyncio')
 
 
+class PoolTimeout(Exception):
+    pass
+
+
+def _running_loop():
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+def _abandon(connection):
+    # close this process's copy of an inherited socket without writing to it,
+    # the parent keeps using its own copy
+    instance = getattr(connection, '_instance', None)
+    writer = getattr(instance, '_streamwriter', None)
+    if writer is None:
+        return
+
+    sock = writer.get_extra_info('socket')
+    sock = getattr(sock, '_sock', sock)
+    if sock is not None:
+        sock.close()
+
+
+class Pool(object):
+
+    def __init__(self, kargs, min_size=1, max_size=10, timeout=10, idle=300):
+        self.kargs = kargs
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.idle = idle
+
+        self.loop = None
+        self.closed = False
+
+        self._idle = collections.deque()
+        self._used = set()
+        self._semaphore = asyncio.Semaphore(max_size)
+        self._filling = None
+
+    def __repr__(self):
+        message = '<Pool idle:{idle} used:{used} min:{min_size} max:{max_size}>'
+        return message.format(
+            idle=len(self._idle),
+            used=len(self._used),
+            min_size=self.min_size,
+            max_size=self.max_size
+        )
+
+    @property
+    def size(self):
+        return len(self._idle) + len(self._used)
+
+    def _bind(self):
+        # a pool belongs to the loop it is first used on
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+
+    async def _fill(self):
+        missing = self.min_size - self.size
+        if missing <= 0:
+            return
+
+        connections = await asyncio.gather(*map(lambda i: r.connect(**self.kargs), range(missing)))
+        now = self.loop.time()
+        self._idle.extend(map(lambda connection: (connection, now), connections))
+
+    async def fill(self):
+        self._bind()
+        if not self._filling:
+            self._filling = asyncio.ensure_future(self._fill())
+
+        filling = self._filling
+        try:
+            await asyncio.shield(filling)
+        finally:
+            if self._filling is filling and filling.done():
+                self._filling = None
+
+    async def _evict(self):
+        deadline = self.loop.time() - self.idle
+        while len(self._idle) > self.min_size and self._idle[0][1] < deadline:
+            connection, released = self._idle.popleft()
+            if connection.is_open():
+                await connection.close(noreply_wait=False)
+
+    async def acquire(self):
+        if self.closed:
+            raise PoolTimeout('Pool is closed')
+
+        self._bind()
+
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            message = 'Timed out after {timeout}s waiting for a connection: {pool}'.format(
+                timeout=self.timeout,
+                pool=self
+            )
+            raise PoolTimeout(message)
+
+        try:
+            if not self._idle and not self._used:
+                await self.fill()
+
+            connection = None
+            while self._idle:
+                candidate, released = self._idle.pop()
+                if candidate.is_open():
+                    connection = candidate
+                    break
+
+            if not connection:
+                connection = await r.connect(**self.kargs)
+        except BaseException:
+            self._semaphore.release()
+            raise
+
+        self._used.add(connection)
+        return connection
+
+    async def release(self, connection):
+        self._used.discard(connection)
+        self._semaphore.release()
+
+        if self.closed:
+            if connection.is_open():
+                await connection.close(noreply_wait=False)
+            return
+
+        if connection.is_open():
+            self._idle.append((connection, self.loop.time()))
+
+        await self._evict()
+
+    def connection(self):
+        return PoolConnection(self)
+
+    async def close(self):
+        self.closed = True
+        connections = list(map(lambda item: item[0], self._idle)) + list(self._used)
+        self._idle.clear()
+        for connection in connections:
+            if connection.is_open():
+                await connection.close()
+
+    def abandon(self):
+        self.closed = True
+        connections = list(map(lambda item: item[0], self._idle)) + list(self._used)
+        self._idle.clear()
+        self._used.clear()
+        for connection in connections:
+            _abandon(connection)
+
+
+class PoolConnection(object):
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.connection = None
+
+    async def __aenter__(self):
+        self.connection = await self.pool.acquire()
+        return self.connection
+
+    async def __aexit__(self, type, value, traceback):
+        await self.pool.release(self.connection)
+        self.connection = None
+
+
 class Connection(object):
 
     connections = { }
+    pending = { }
+    pools = { }
+
+    pid = os.getpid()
+    hooks = [ ]
 
     @classmethod
     def _hash(cls, kargs):
-        return json.dumps(kargs, separators=(',', ':'), sort_keys=True)
+        return canonical(kargs)
+
+    @classmethod
+    def after_fork(cls, hook):
+        cls.hooks.append(hook)
+        return hook
+
+    @classmethod
+    def check_fork(cls):
+        pid = os.getpid()
+        if pid == cls.pid:
+            return False
+
+        cls.pid = pid
+
+        connections = list(cls.connections.values())
+        pools = list(cls.pools.values())
+
+        cls.connections.clear()
+        cls.pending.clear()
+        cls.pools.clear()
+
+        for connection in connections:
+            _abandon(connection)
+
+        for pool in pools:
+            pool.abandon()
+
+        for hook in cls.hooks:
+            hook()
+
+        return True
+
+    @classmethod
+    async def _connect(cls, key, kargs):
+        try:
+            cls.connections[key] = await r.connect(**kargs)
+            return cls.connections[key]
+        finally:
+            del cls.pending[key]
 
     @classmethod
     async def connect(cls, **kargs):
+        cls.check_fork()
         key = cls._hash(kargs)
 
         connection = cls.connections.get(key)
         if connection and connection.is_open():
             return connection
 
-        cls.connections[key] = await r.connect(**kargs)
-        return cls.connections[key]
+        if key not in cls.pending:
+            cls.pending[key] = asyncio.ensure_future(cls._connect(key, kargs))
+
+        return await asyncio.shield(cls.pending[key])
+
+    @classmethod
+    def pool(cls, kargs, **options):
+        cls.check_fork()
+        key = cls._hash(kargs)
+
+        pool = cls.pools.get(key)
+        if pool and not pool.closed:
+            if pool.loop is None or pool.loop is _running_loop():
+                return pool
+            # the connections belong to another loop, they can't be closed from this one
+            pool.abandon()
+
+        cls.pools[key] = Pool(kargs, **options)
+        return cls.pools[key]
 
     @classmethod
     async def close(cls):
@@ -32,4 +270,10 @@ class Connection(object):
             if connection.is_open():
                 await connection.close()
 
+        for key in cls.pools:
+            await cls.pools[key].close()
+
 database = Connection
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=database.check_fork)
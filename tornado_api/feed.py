@@ -0,0 +1,213 @@
+import asyncio
+import collections
+
+import rethinkdb as r
+
+from . database import database
+
+
+class Feed(object):
+
+    feeds = { }
+
+    retryable = (r.ReqlDriverError, r.ReqlAvailabilityError, r.ReqlTimeoutError, OSError)
+
+    def __init__(self, model, query, include_initial=False, retry=1, key=None):
+        self.model = model
+        self.query = query
+        self.include_initial = include_initial
+        self.retry = retry
+        self.key = key
+
+        self.loop = asyncio.get_event_loop()
+        self.subscribers = set()
+        self.reconnects = 0
+
+        self._task = None
+
+    def __repr__(self):
+        message = '<Feed {model} subscribers:{subscribers} reconnects:{reconnects}>'
+        return message.format(
+            model=self.model.__name__,
+            subscribers=len(self.subscribers),
+            reconnects=self.reconnects
+        )
+
+    @classmethod
+    def shared(cls, model, query):
+        key = (model, str(query))
+
+        feed = cls.feeds.get(key)
+        if feed and feed.loop is asyncio.get_event_loop():
+            return feed
+
+        cls.feeds[key] = cls(model, query, key=key)
+        return cls.feeds[key]
+
+    def subscribe(self, subscription):
+        self.subscribers.add(subscription)
+        if not self._task:
+            self._task = asyncio.ensure_future(self._run())
+
+    def unsubscribe(self, subscription):
+        self.subscribers.discard(subscription)
+        if not self.subscribers:
+            self.stop()
+
+    def stop(self):
+        task, self._task = self._task, None
+        if task and not task.done():
+            task.cancel()
+        if self.key and Feed.feeds.get(self.key) is self:
+            del Feed.feeds[self.key]
+
+    def publish(self, change):
+        for subscription in list(self.subscribers):
+            subscription.push(change)
+
+    def fail(self, error):
+        subscribers, self.subscribers = self.subscribers, set()
+        for subscription in subscribers:
+            subscription.fail(error)
+        self.stop()
+
+    async def _run(self):
+        while True:
+            try:
+                async for change in self.model.backend.changes(self.model, self.query, self.include_initial):
+                    self.publish(change)
+            except asyncio.CancelledError:
+                raise
+            except self.retryable:
+                self.reconnects += 1
+                await asyncio.sleep(self.retry)
+            except Exception as error:
+                self.fail(error)
+                return
+
+
+class Subscription(object):
+
+    policies = ('drop_oldest', 'drop_newest', 'coalesce')
+
+    def __init__(self, model, query=None, include_initial=False, size=1000, policy='drop_oldest'):
+        if policy not in self.policies:
+            message = 'Subscription policy must be one of {policies}: {policy}'.format(
+                policies=list(self.policies),
+                policy=policy
+            )
+            raise ValueError(message)
+
+        self.model = model
+        self.query = query
+        self.include_initial = include_initial
+        self.size = size
+        self.policy = policy
+
+        self.feed = None
+        self.closed = False
+        self.error = None
+        self.dropped = 0
+
+        self._pending = collections.OrderedDict()
+        self._counter = 0
+        self._event = None
+
+    def __repr__(self):
+        message = '<Subscription {model} pending:{pending} dropped:{dropped} policy:{policy}>'
+        return message.format(
+            model=self.model.__name__,
+            pending=len(self._pending),
+            dropped=self.dropped,
+            policy=self.policy
+        )
+
+    @property
+    def event(self):
+        if not self._event:
+            self._event = asyncio.Event()
+        return self._event
+
+    async def start(self):
+        if self.feed or self.closed:
+            return self
+
+        await self.model.connect()
+        query = self.query or self.model.query()
+
+        if self.include_initial:
+            self.feed = Feed(self.model, query, include_initial=True)
+        else:
+            self.feed = Feed.shared(self.model, query)
+
+        self.feed.subscribe(self)
+        return self
+
+    def _key(self, change):
+        if self.policy == 'coalesce':
+            document = change.get('new_val') or change.get('old_val') or { }
+            return document.get(self.model._primary.name)
+        self._counter += 1
+        return self._counter
+
+    def push(self, change):
+        key = self._key(change)
+
+        if self.policy == 'coalesce' and key in self._pending:
+            old = self._pending[key].get('old_val')
+            new = change.get('new_val')
+            if old is None and new is None:
+                del self._pending[key]
+            else:
+                self._pending[key] = { 'old_val': old, 'new_val': new }
+            return
+
+        if len(self._pending) >= self.size:
+            self.dropped += 1
+            if self.policy == 'drop_newest':
+                return
+            self._pending.popitem(last=False)
+
+        self._pending[key] = change
+        self.event.set()
+
+    def fail(self, error):
+        self.error = error
+        self.event.set()
+
+    def _hydrate(self, change):
+        documents = (change.get('old_val'), change.get('new_val'))
+        models = iter(self.model.from_many(filter(None, documents)))
+        return tuple(map(lambda document: next(models) if document else None, documents))
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        await self.start()
+
+        while not self._pending:
+            if self.closed:
+                raise StopAsyncIteration
+            if self.error:
+                raise self.error
+            self.event.clear()
+            await self.event.wait()
+
+        key, change = self._pending.popitem(last=False)
+        return self._hydrate(change)
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, type, value, traceback):
+        self.close()
+
+    def close(self):
+        self.closed = True
+        self.event.set()
+        if self.feed:
+            self.feed.unsubscribe(self)
+
+
+database.after_fork(Feed.feeds.clear)
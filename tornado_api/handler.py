@@ -0,0 +1,286 @@
+import json
+
+from concurrent.futures import ThreadPoolExecutor
+
+from tornado.ioloop import IOLoop
+from tornado.web import RequestHandler, HTTPError
+
+from . codec import Codec
+from . loader import Loader
+from . model import Model, ValidationError
+
+
+executor = ThreadPoolExecutor(max_workers=4)
+
+
+# a cheap estimate of the encoded size in bytes, lists are sampled on their first item
+def _weight(obj):
+    if isinstance(obj, Model):
+        weight = _weight(obj._state())
+        raw = getattr(obj, '_raw', None) if obj.lazy else None
+        return weight + _weight(raw) if raw else weight
+    if isinstance(obj, (str, bytes)):
+        return len(obj) + 2
+    if isinstance(obj, dict):
+        return sum(len(str(key)) + 4 + _weight(value) for key, value in obj.items()) + 2
+    if isinstance(obj, (list, tuple)):
+        return len(obj) * (_weight(obj[0]) + 1) + 2 if obj else 2
+    return 8
+
+
+class ModelHandler(RequestHandler):
+
+    # offload_size is the estimated payload size in bytes above which a
+    # response is encoded on the executor instead of the IOLoop, whether it
+    # holds one large document or a chunk of list results
+    def initialize(self, model, chunk_size=100, offload_size=262144, executor=executor, codec='json'):
+        self.model = model
+        self.chunk_size = chunk_size
+        self.offload_size = offload_size
+        self.executor = executor
+        self.codec = Codec.get(codec)
+
+        if self.codec.content_type != 'application/json':
+            raise ValueError('ModelHandler codec must encode JSON: {codec}'.format(codec=self.codec.name))
+
+    def prepare(self):
+        self.loader = Loader().activate()
+
+    def on_finish(self):
+        # the request scoped loader must not outlive the request
+        loader, self.loader = getattr(self, 'loader', None), None
+        if loader:
+            loader.deactivate()
+
+    def set_default_headers(self):
+        self.set_header('Content-Type', 'application/json; charset=UTF-8')
+
+    def write_error(self, status_code, **kargs):
+        body = { 'error': self._reason }
+        if 'exc_info' in kargs:
+            error = kargs['exc_info'][1]
+            if isinstance(error, HTTPError) and error.log_message:
+                body['error'] = error.log_message
+            if isinstance(error.__cause__, ValidationError):
+                body['errors'] = error.__cause__.errors
+        self.finish(json.dumps(body))
+
+    async def encode(self, obj):
+        # models are encoded straight from their state by the codec
+        if _weight(obj) >= self.offload_size:
+            return await IOLoop.current().run_in_executor(self.executor, self.codec.dumps, obj)
+        return self.codec.dumps(obj)
+
+    def _body(self):
+        try:
+            body = json.loads(self.request.body.decode('utf-8'))
+        except ValueError:
+            raise HTTPError(400, 'Request body is not valid JSON')
+
+        if not isinstance(body, dict):
+            raise HTTPError(400, 'Request body must be a JSON object')
+
+        return body
+
+    def _validate(self, body, partial=False):
+        try:
+            self.model.validate(body, partial)
+        except ValidationError as error:
+            raise HTTPError(400, str(error)) from error
+
+    def _build(self, body):
+        self._validate(body)
+        try:
+            return self.model(body)
+        except (AttributeError, TypeError, ValueError) as error:
+            raise HTTPError(400, str(error)) from error
+
+    def _key(self, id):
+        try:
+            return self.model._converters[self.model._primary.name](id)
+        except (TypeError, ValueError):
+            raise HTTPError(404, 'Model {model} has no document: {id}'.format(model=self.model.__name__, id=id))
+
+    def _fields(self):
+        fields = self.get_argument('fields', None)
+        if fields is None:
+            return None
+
+        fields = list(filter(None, fields.split(',')))
+
+        try:
+            self.model._only(fields)
+        except AttributeError as error:
+            raise HTTPError(400, str(error)) from error
+
+        return fields
+
+    async def _read(self, id, only=None):
+        model = await self.model.read(self._key(id), only=only)
+        if not model:
+            raise HTTPError(404, 'Model {model} has no document: {id}'.format(model=self.model.__name__, id=id))
+        return model
+
+    def _query(self):
+        query = self.model.query()
+        arguments = { key: self.get_argument(key) for key in self.request.arguments }
+
+        limit = arguments.pop('limit', None)
+        after = arguments.pop('after', None)
+        after_key = arguments.pop('after_key', None)
+        order = arguments.pop('order_by', None)
+        fields = arguments.pop('fields', None)
+
+        primary = self.model._primary.name
+        field = order.lstrip('-') if order else primary
+
+        if field not in self.model._field_names:
+            raise HTTPError(400, 'Model {model} does not have field: {field}'.format(model=self.model.__name__, field=field))
+
+        # ties on the order field are ordered by the primary key so after_key can resume them
+        if order:
+            query = query.order_by(field if field == primary else [field, primary], descending=order.startswith('-'))
+
+        if after:
+            query = self._after(query, field, after, after_key)
+
+        if fields is not None:
+            query = query.only(*self._fields())
+
+        undefined = list(filter(lambda key: key not in self.model._field_names, arguments))
+        if undefined:
+            raise HTTPError(400, 'Model {model} has undefined fields: {fields}'.format(model=self.model.__name__, fields=undefined))
+
+        try:
+            arguments = { key: self.model._converters[key](value) for key, value in arguments.items() }
+        except (TypeError, ValueError) as error:
+            raise HTTPError(400, str(error)) from error
+
+        if arguments:
+            query = query.filter(arguments)
+
+        if limit:
+            try:
+                query = query.limit(int(limit))
+            except ValueError:
+                raise HTTPError(400, 'limit must be an integer')
+
+        return query
+
+    def _after(self, query, field, value, key):
+        # after is the order value of the last document, rows sharing it are
+        # resumed on after_key, the primary key of that document
+        primary = self.model._primary.name
+
+        try:
+            value = self.model._converters[field](value)
+            if field == primary:
+                return query.after(value, field=field)
+            if key is None:
+                raise HTTPError(400, 'after on field {field} needs after_key'.format(field=field))
+            key = self.model._converters[primary](key)
+            query._index([field, primary])
+        except (AttributeError, TypeError, ValueError) as error:
+            raise HTTPError(400, str(error)) from error
+
+        return query.after(value, field=field, key=key)
+
+    async def _write_chunk(self, models, first, fields=None):
+        if fields is not None:
+            models = list(map(lambda model: model.serialize(fields=fields), models))
+        encoded = await self.encode(models)
+        if not first:
+            self.write(b',')
+        self.write(encoded[1:-1])
+        await self.flush()
+
+    async def _list(self):
+        query = self._query().batch(self.chunk_size)
+        fields = self._fields()
+
+        self.write('[')
+
+        first = True
+        chunk = [ ]
+
+        async for model in query:
+            chunk.append(model)
+            if len(chunk) >= self.chunk_size:
+                await self._write_chunk(chunk, first, fields)
+                first = False
+                chunk = [ ]
+
+        if chunk:
+            await self._write_chunk(chunk, first, fields)
+
+        self.finish(']')
+
+    async def get(self, id=None):
+        if id is None:
+            return await self._list()
+
+        fields = self._fields()
+        model = await self._read(id, only=fields)
+        self.finish(await self.encode(model if fields is None else model.serialize(fields=fields)))
+
+    async def post(self, id=None):
+        if id is not None:
+            raise HTTPError(405)
+
+        model = self._build(self._body())
+
+        try:
+            result = await model.create()
+        except AttributeError as error:
+            raise HTTPError(400, str(error)) from error
+
+        if result.get('errors'):
+            raise HTTPError(400, result.get('first_error'))
+
+        self.set_status(201)
+        self.finish(await self.encode(model))
+
+    async def put(self, id=None):
+        if id is None:
+            raise HTTPError(405)
+
+        body = self._body()
+        primary = self.model._primary.name
+
+        if primary in body and body[primary] != self._key(id):
+            raise HTTPError(400, 'Model {model} primary field {field} cannot be changed'.format(model=self.model.__name__, field=primary))
+
+        self._validate(body, partial=True)
+        model = await self._read(id)
+
+        try:
+            model.set(body)
+        except (AttributeError, TypeError, ValueError) as error:
+            raise HTTPError(400, str(error)) from error
+
+        await model.update()
+        self.finish(await self.encode(model))
+
+    patch = put
+
+    async def delete(self, id=None):
+        if id is None:
+            raise HTTPError(405)
+
+        model = self.model.from_many([{ self.model._primary.name: self._key(id) }])[0]
+        result = await model.delete()
+
+        if not result.get('deleted'):
+            raise HTTPError(404, 'Model {model} has no document: {id}'.format(model=self.model.__name__, id=id))
+
+        self.set_status(204)
+        self.finish()
+
+
+def routes(model, prefix=None, handler=ModelHandler, **options):
+    prefix = prefix or '/' + model._table
+    options = dict(options, model=model)
+    return [
+        (prefix + r'/?', handler, options),
+        (prefix + r'/([^/]+)/?', handler, options),
+    ]
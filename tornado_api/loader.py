@@ -0,0 +1,84 @@
+import asyncio
+import contextvars
+
+
+current = contextvars.ContextVar('tornado_api.loader', default=None)
+
+
+class Loader(object):
+
+    def __init__(self):
+        self.batches = 0
+
+        self._memo = { }
+        self._queue = { }
+        self._scheduled = False
+        self._token = None
+
+    def __repr__(self):
+        message = '<Loader memo:{memo} queued:{queued} batches:{batches}>'
+        return message.format(
+            memo=len(self._memo),
+            queued=sum(map(len, self._queue.values())),
+            batches=self.batches
+        )
+
+    def __enter__(self):
+        return self.activate()
+
+    def __exit__(self, type, value, traceback):
+        self.deactivate()
+
+    @classmethod
+    def current(cls):
+        return current.get()
+
+    def activate(self):
+        self._token = current.set(self)
+        return self
+
+    def deactivate(self):
+        current.reset(self._token)
+        self._token = None
+
+    def load(self, model, key):
+        future = self._memo.get((model, key))
+
+        if future is None:
+            loop = asyncio.get_event_loop()
+            future = self._memo[(model, key)] = loop.create_future()
+            self._queue.setdefault(model, { })[key] = future
+
+            if not self._scheduled:
+                self._scheduled = True
+                loop.call_soon(self._dispatch)
+
+        return future
+
+    def _dispatch(self):
+        self._scheduled = False
+        queue, self._queue = self._queue, { }
+
+        for model, futures in queue.items():
+            self.batches += 1
+            asyncio.ensure_future(self._fetch(model, futures))
+
+    async def _fetch(self, model, futures):
+        try:
+            documents = await model._load_many(list(futures))
+        except Exception as error:
+            for key, future in futures.items():
+                self._memo.pop((model, key), None)
+                if not future.done():
+                    future.set_exception(error)
+            return
+
+        for key, future in futures.items():
+            if not future.done():
+                future.set_result(documents.get(key))
+
+    def discard(self, model, key):
+        self._memo.pop((model, key), None)
+
+    def clear(self):
+        self._memo.clear()
@@ -0,0 +1,395 @@
+import uuid
+import pickle
+import asyncio
+import collections
+
+import rethinkdb as r
+
+from . import projection
+from . backend import Backend
+
+
+def _copy(document):
+    return pickle.loads(pickle.dumps(document, pickle.HIGHEST_PROTOCOL))
+
+
+def _merge(document, changes):
+    merged = dict(document)
+    for key, value in changes.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def _match(document, filters):
+    for key, value in filters.items():
+        if key not in document:
+            return False
+        if isinstance(value, dict) and isinstance(document[key], dict):
+            if not _match(document[key], value):
+                return False
+        elif document[key] != value:
+            return False
+    return True
+
+
+def _within(value, lower, upper, left_bound, right_bound):
+    if lower is not r.minval:
+        if value < lower or (value == lower and left_bound == 'open'):
+            return False
+    if upper is not r.maxval:
+        if value > upper or (value == upper and right_bound == 'open'):
+            return False
+    return True
+
+
+def _result():
+    return {
+        'inserted': 0,
+        'replaced': 0,
+        'unchanged': 0,
+        'skipped': 0,
+        'deleted': 0,
+        'errors': 0,
+    }
+
+
+def _error(result, message):
+    result['errors'] += 1
+    result.setdefault('first_error', message)
+
+
+def _hashable(value):
+    if isinstance(value, list):
+        return tuple(map(_hashable, value))
+    if isinstance(value, dict):
+        return tuple(sorted((key, _hashable(item)) for key, item in value.items()))
+    return value
+
+
+def _sorted(values):
+    try:
+        return sorted(values, key=lambda value: (value is None, value))
+    except TypeError:
+        return list(values)
+
+
+def _reduce(reducer, values):
+    if reducer == 'sum':
+        return sum(values)
+    if not values:
+        return None
+    if reducer == 'avg':
+        return sum(values) / len(values)
+    if reducer == 'min':
+        return min(values)
+    return max(values)
+
+
+class Table(object):
+
+    def __init__(self, indexes):
+        self.definitions = indexes
+        self.documents = { }
+        self.indexes = { name: collections.defaultdict(set) for name in indexes }
+        self.listeners = set()
+
+    def _index_key(self, name, document):
+        fields = self.definitions[name]
+        if not all(map(lambda field: field in document, fields)):
+            return None
+
+        if len(fields) == 1:
+            value = document[fields[0]]
+        else:
+            value = tuple(map(document.get, fields))
+
+        try:
+            hash(value)
+        except TypeError:
+            return None
+        return value
+
+    def _index(self, key, document):
+        for name in self.indexes:
+            value = self._index_key(name, document)
+            if value is not None:
+                self.indexes[name][value].add(key)
+
+    def _unindex(self, key, document):
+        for name in self.indexes:
+            value = self._index_key(name, document)
+            if value is not None:
+                keys = self.indexes[name][value]
+                keys.discard(key)
+                if not keys:
+                    del self.indexes[name][value]
+
+    def lookup(self, index, value):
+        if isinstance(value, list):
+            value = tuple(value)
+        return self.indexes[index].get(value, ( ))
+
+    def put(self, key, document):
+        old = self.documents.get(key)
+        if old is not None:
+            self._unindex(key, old)
+        self.documents[key] = document
+        self._index(key, document)
+        self.publish(old, document)
+
+    def remove(self, key):
+        old = self.documents.pop(key)
+        self._unindex(key, old)
+        self.publish(old, None)
+
+    def publish(self, old, new):
+        for queue in self.listeners:
+            queue.put_nowait({ 'old_val': old, 'new_val': new })
+
+
+class MemoryBackend(Backend):
+
+    def __init__(self):
+        self.tables = { }
+
+    def __repr__(self):
+        return '<MemoryBackend tables:{tables}>'.format(tables=len(self.tables))
+
+    def _key(self, model):
+        return (model.db_options.get('db', 'test'), model._table)
+
+    def table(self, model):
+        key = self._key(model)
+        table = self.tables.get(key)
+        if table is None:
+            table = self.tables[key] = Table(model._index_definitions())
+        return table
+
+    async def connect(self, model):
+        self.table(model)
+
+    async def close(self, model):
+        pass
+
+    async def drop(self, model):
+        self.tables.pop(self._key(model), None)
+
+    async def get(self, model, key):
+        document = self.table(model).documents.get(key)
+        if document is not None:
+            return _copy(document)
+
+    async def get_all(self, model, keys, index=None, fields=None):
+        table = self.table(model)
+        documents = [ ]
+
+        for key in keys:
+            if index:
+                documents.extend(map(table.documents.get, table.lookup(index, key)))
+            elif key in table.documents:
+                documents.append(table.documents[key])
+
+        if fields:
+            documents = list(map(lambda document: projection.select(document, fields), documents))
+
+        return _copy(documents)
+
+    async def insert(self, model, documents, return_changes=False, **options):
+        table = self.table(model)
+        primary = model._primary.name
+        result = _result()
+        generated = [ ]
+        changes = [ ]
+
+        for document in _copy(list(documents)):
+            key = document.get(primary)
+            if key is None:
+                key = document[primary] = str(uuid.uuid4())
+                generated.append(key)
+
+            if key in table.documents:
+                message = 'Duplicate primary key `{primary}`: {key}'.format(primary=primary, key=key)
+                _error(result, message)
+                if return_changes:
+                    changes.append({ 'old_val': _copy(table.documents[key]), 'new_val': document, 'error': message })
+                continue
+
+            table.put(key, document)
+            result['inserted'] += 1
+
+            if return_changes:
+                changes.append({ 'old_val': None, 'new_val': _copy(document) })
+
+        if generated:
+            result['generated_keys'] = generated
+        if return_changes:
+            result['changes'] = changes
+
+        return result
+
+    async def update(self, model, documents, return_changes=False, **options):
+        table = self.table(model)
+        primary = model._primary.name
+        result = _result()
+        changes = [ ]
+
+        for document in _copy(list(documents)):
+            key = document[primary]
+            old = table.documents.get(key)
+
+            if old is None:
+                result['skipped'] += 1
+                continue
+
+            new = _merge(old, document)
+            if new == old:
+                result['unchanged'] += 1
+                continue
+
+            table.put(key, new)
+            result['replaced'] += 1
+
+            if return_changes:
+                changes.append({ 'old_val': _copy(old), 'new_val': _copy(new) })
+
+        if return_changes:
+            result['changes'] = changes
+
+        return result
+
+    async def delete(self, model, keys, return_changes=False, **options):
+        table = self.table(model)
+        result = _result()
+        changes = [ ]
+
+        for key in keys:
+            if key not in table.documents:
+                result['skipped'] += 1
+                continue
+
+            old = table.documents[key]
+            table.remove(key)
+            result['deleted'] += 1
+
+            if return_changes:
+                changes.append({ 'old_val': _copy(old), 'new_val': None })
+
+        if return_changes:
+            result['changes'] = changes
+
+        return result
+
+    def _matches(self, query, document):
+        if query._between:
+            lower, upper, field, left_bound, right_bound = query._between
+            fields = field if isinstance(field, list) else [field]
+            if not all(map(lambda field: field in document, fields)):
+                return False
+            value = list(map(document.get, fields)) if isinstance(field, list) else document[field]
+            if not _within(value, lower, upper, left_bound, right_bound):
+                return False
+        return all(map(lambda filters: _match(document, filters), query._filters))
+
+    def _pluck(self, query, document):
+        if not query._pluck:
+            return document
+        return projection.select(document, query._pluck)
+
+    def _evaluate(self, model, query):
+        documents = filter(lambda document: self._matches(query, document), self.table(model).documents.values())
+
+        if query._order:
+            fields = query._order if isinstance(query._order, list) else [query._order]
+            documents = sorted(
+                documents,
+                key=lambda document: [ (document.get(field) is None, document.get(field)) for field in fields ],
+                reverse=query._descending
+            )
+
+        documents = list(documents)
+
+        if query._limit is not None:
+            documents = documents[:query._limit]
+
+        return list(map(lambda document: self._pluck(query, document), documents))
+
+    async def query(self, model, query):
+        return _copy(self._evaluate(model, query))
+
+    async def stream(self, model, query, size):
+        documents = self._evaluate(model, query)
+        for start in range(0, len(documents), size):
+            yield _copy(documents[start:start + size])
+
+    def _change(self, query, change):
+        old, new = change['old_val'], change['new_val']
+
+        if old is not None and not self._matches(query, old):
+            old = None
+        if new is not None and not self._matches(query, new):
+            new = None
+
+        if old is None and new is None:
+            return None
+
+        return {
+            'old_val': _copy(self._pluck(query, old)) if old is not None else None,
+            'new_val': _copy(self._pluck(query, new)) if new is not None else None,
+        }
+
+    def _documents(self, model, query):
+        return self._evaluate(model, query._copy(_pluck=None))
+
+    async def count(self, model, query):
+        return len(self._documents(model, query))
+
+    async def sum(self, model, query, field):
+        return sum(document[field] for document in self._documents(model, query) if field in document)
+
+    async def distinct(self, model, query, field):
+        values = { }
+        for document in self._documents(model, query):
+            if field in document:
+                values.setdefault(_hashable(document[field]), document[field])
+        return _copy(_sorted(values.values()))
+
+    async def group(self, model, query, field, reducer, value=None):
+        groups = { }
+        for document in self._documents(model, query):
+            groups.setdefault(_hashable(document.get(field)), [ ]).append(document)
+
+        result = { }
+        for key, documents in groups.items():
+            if reducer == 'count':
+                result[key] = len(documents)
+                continue
+            reduction = _reduce(reducer, [ document[value] for document in documents if value in document ])
+            if reduction is not None:
+                result[key] = reduction
+
+        return _copy(result)
+
+    async def changes(self, model, query, include_initial=False, include_states=False):
+        table = self.table(model)
+        queue = asyncio.Queue()
+        table.listeners.add(queue)
+
+        try:
+            if include_initial:
+                if include_states:
+                    yield { 'state': 'initializing' }
+                for document in await self.query(model, query):
+                    yield { 'new_val': document }
+
+            if include_states:
+                yield { 'state': 'ready' }
+
+            while True:
+                change = self._change(query, await queue.get())
+                if change:
+                    yield change
+        finally:
+            table.listeners.discard(queue)
@@ -0,0 +1,199 @@
+import json
+import time
+
+
+hooks = [ ]
+
+
+def register(hook):
+    hooks.append(hook)
+    return hook
+
+
+def unregister(hook):
+    hooks.remove(hook)
+
+
+class Event(object):
+
+    __slots__ = ('model', 'operation', 'duration', 'count', 'bytes', 'error')
+
+    def __init__(self, model, operation, duration, count=0, bytes=0, error=None):
+        self.model = model
+        self.operation = operation
+        self.duration = duration
+        self.count = count
+        self.bytes = bytes
+        self.error = error
+
+    def __repr__(self):
+        message = '<Event {model}.{operation} duration:{duration:.6f} count:{count} bytes:{bytes}>'
+        return message.format(
+            model=self.model,
+            operation=self.operation,
+            duration=self.duration,
+            count=self.count,
+            bytes=self.bytes
+        )
+
+
+def _count(result):
+    if result is None:
+        return 0
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, dict) and 'errors' in result and 'inserted' in result:
+        return result['inserted'] + result['replaced'] + result['unchanged'] + result['deleted']
+    return 1 if isinstance(result, dict) else 0
+
+
+def _bytes(payload):
+    if not isinstance(payload, (list, dict)):
+        return 0
+    return len(json.dumps(payload, separators=(',', ':'), default=str))
+
+
+def emit(model, operation, duration, result=None, payload=None, error=None):
+    event = Event(
+        model.__name__,
+        operation,
+        duration,
+        _count(result),
+        _bytes(result if payload is None else payload),
+        error
+    )
+    for hook in hooks:
+        hook(event)
+
+
+async def measure(model, operation, awaitable, payload=None):
+    if not hooks:
+        return await awaitable
+
+    start = time.perf_counter()
+    try:
+        result = await awaitable
+    except Exception as error:
+        emit(model, operation, time.perf_counter() - start, payload=payload, error=error)
+        raise
+
+    emit(model, operation, time.perf_counter() - start, result, payload)
+    return result
+
+
+async def measure_stream(model, operation, iterator):
+    if not hooks:
+        async for item in iterator:
+            yield item
+        return
+
+    while True:
+        start = time.perf_counter()
+        try:
+            item = await iterator.__anext__()
+        except StopAsyncIteration:
+            return
+        except Exception as error:
+            emit(model, operation, time.perf_counter() - start, error=error)
+            raise
+        emit(model, operation, time.perf_counter() - start, item)
+        yield item
+
+
+class Histogram(object):
+
+    # values are recorded in microseconds into log-linear buckets: exact
+    # below 128us and within 1/64 (about 1.5%) relative error above it
+    precision = 7
+
+    def __init__(self):
+        self.buckets = { }
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def _index(self, value):
+        shift = value.bit_length() - self.precision
+        if shift <= 0:
+            return value
+        return (shift << (self.precision - 1)) + (value >> shift)
+
+    def _value(self, index):
+        half = 1 << (self.precision - 1)
+        if index < 2 * half:
+            return index
+        shift = (index >> (self.precision - 1)) - 1
+        return (index - (shift << (self.precision - 1))) << shift
+
+    def record(self, seconds):
+        value = int(seconds * 1000000)
+        index = self._index(value)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, percent):
+        if not self.count:
+            return None
+
+        rank = max(1, int(round(self.count * percent / 100.0)))
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(self._value(index), self.max)
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'min': self.min,
+            'max': self.max,
+            'mean': self.total / self.count if self.count else None,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'p999': self.percentile(99.9),
+        }
+
+
+class Metrics(object):
+
+    def __init__(self):
+        self.operations = { }
+
+    def __call__(self, event):
+        key = '{model}.{operation}'.format(model=event.model, operation=event.operation)
+
+        operation = self.operations.get(key)
+        if operation is None:
+            operation = self.operations[key] = {
+                'histogram': Histogram(),
+                'errors': 0,
+                'documents': 0,
+                'bytes': 0,
+            }
+
+        operation['histogram'].record(event.duration)
+        operation['documents'] += event.count
+        operation['bytes'] += event.bytes
+        if event.error is not None:
+            operation['errors'] += 1
+
+    def snapshot(self):
+        snapshot = { }
+        for key, operation in self.operations.items():
+            snapshot[key] = dict(
+                operation['histogram'].snapshot(),
+                errors=operation['errors'],
+                documents=operation['documents'],
+                bytes=operation['bytes']
+            )
+        return snapshot
+
+    def reset(self):
+        self.operations.clear()
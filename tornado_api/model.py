@@ -1,12 +1,25 @@
 import inspect
+import operator
 import inflection
 
+from types import MappingProxyType
+
+from . import projection
+from . codec import Codec
 from . database import database
+from . compiler import compile_model, compile_validate, replaceable, slot_name, _error
+
+
+class ValidationError(AttributeError):
+
+    def __init__(self, message, errors=None):
+        super(ValidationError, self).__init__(message)
+        self.errors = errors or [ ]
 
 
 class Field(object):
 
-    def __init__(self, type=str, primary=False, required=False, related=False, indexed=False, computed=False, computed_empty=False, computed_type=False):
+    def __init__(self, type=str, primary=False, required=False, related=False, indexed=False, computed=False, computed_empty=False, computed_type=False, cached=False, depends=( )):
         self.name = None
         self.type = type
         self.primary = primary
@@ -16,6 +29,8 @@ class Field(object):
         self.computed = computed
         self.computed_empty = computed_empty
         self.computed_type = computed_type
+        self.cached = cached
+        self.depends = tuple(depends)
 
         self.updated = False
 
@@ -25,6 +40,36 @@ class Field(object):
         if issubclass(self.type, Model):
             self.required = True
 
+    @property
+    def relation(self):
+        if self.related is True and issubclass(self.type, Model):
+            return self.type
+        if isinstance(self.related, type) and issubclass(self.related, Model):
+            return self.related
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+
+        if owner.slotted:
+            value = getattr(instance, slot_name(self.name), _missing)
+            if value is not _missing:
+                return value
+
+        if owner.lazy:
+            raw = getattr(instance, '_raw', None)
+            if raw and self.name in raw:
+                instance._store(self.name, raw[self.name])
+                if owner.slotted:
+                    value = getattr(instance, slot_name(self.name))
+                else:
+                    value = instance.__dict__[self.name]
+                # changes to the raw document are tracked on the parent
+                value._clean()
+                return value
+
+        return self
+
     def __repr__(self):
         message = '<Field name:{name} type:{type} primary:{primary} required:{required} related:{related} indexed:{indexed} computed:{computed}>'
         return message.format(
@@ -40,6 +85,38 @@ class Field(object):
 
 class ModelMeta(type):
 
+    def __new__(mcs, name, bases, attrs):
+        slotted = attrs.get('slotted', any(map(lambda base: getattr(base, 'slotted', False), bases)))
+
+        if slotted:
+            attrs = dict(attrs)
+            attrs['__slots__'] = tuple(attrs.get('__slots__', ( ))) + mcs._slots(bases, attrs)
+
+        return super(ModelMeta, mcs).__new__(mcs, name, bases, attrs)
+
+    @staticmethod
+    def _slots(bases, attrs):
+        fields = { }
+        existing = set()
+
+        for base in reversed(bases):
+            for klass in reversed(base.__mro__):
+                existing.update(klass.__dict__.get('__slots__', ( )))
+                for key, value in vars(klass).items():
+                    if isinstance(value, Field) and not key.startswith('_'):
+                        fields[key] = value
+
+        for key, value in attrs.items():
+            if isinstance(value, Field) and not key.startswith('_'):
+                fields[key] = value
+
+        names = list(fields)
+
+        if not any(map(lambda field: field.primary, fields.values())):
+            names.append('id')
+
+        return tuple(filter(lambda slot: slot not in existing, map(slot_name, names)))
+
     def __init__(cls, name, bases, attrs):
         super(ModelMeta, cls).__init__(name, bases, attrs)
 
@@ -56,16 +133,16 @@ class ModelMeta(type):
         cls._computed = [ ]
 
         members = inspect.getmembers(cls, lambda f: isinstance(f, Field))
+        members = filter(lambda member: not member[0].startswith('_'), members)
 
         for name, field in members:
 
             field.name = name
 
-            if issubclass(field.type, Model):
-                if field.related:
-                    cls._related.append(field)
-                else:
-                    cls._nested.append(field)
+            if field.relation:
+                cls._related.append(field)
+            elif issubclass(field.type, Model):
+                cls._nested.append(field)
 
             if field.required:
                 cls._required.append(field)
@@ -98,67 +175,305 @@ class ModelMeta(type):
 
         cls._primary = primary[0]
 
+        cls._fields_by_name = MappingProxyType({ field.name: field for field in cls._fields })
+        cls._field_names = frozenset(cls._fields_by_name)
+        cls._converters = MappingProxyType({ field.name: _converter(field) for field in cls._fields })
+        cls._serialized = tuple(filter(lambda field: issubclass(field.type, Model) or field.relation or field.computed, cls._fields))
+        cls._dependents = _dependents(cls)
+        cls._encoded = tuple(filter(lambda field: field.relation or (field.computed and not field.computed_empty and field not in cls._nested), cls._fields))
+
+        if cls.slotted:
+            for key, function in (('_store', _slotted_store), ('_state', _slotted_state)):
+                if replaceable(cls, key):
+                    setattr(cls, key, function)
+
+        if cls.compiled:
+            compile_model(cls)
+
+        if cls.lazy and cls._nested:
+            for key, wrapper in (('_store', _lazy_store), ('serialize', _lazy_serialize)):
+                function = getattr(cls, key)
+                if replaceable(cls, key) and not getattr(function, 'lazy', False):
+                    setattr(cls, key, wrapper(function))
+
+
+def _converter(field):
+    if type(field.type) == type:
+        return field.type
+
+    model = field.type
+
+    def convert(value):
+        if type(value) == dict:
+            return model(**value)
+        return value
+
+    return convert
+
+
+def _computer(cls, field):
+    computed = field.computed
+
+    if isinstance(computed, str):
+        if inspect.isfunction(inspect.getattr_static(cls, computed)):
+            return getattr(cls, computed)
+        if inspect.ismethod(getattr(cls, computed)) or isinstance(inspect.getattr_static(cls, computed), staticmethod):
+            return operator.methodcaller(computed)
+        return None
+
+    if inspect.isfunction(computed):
+        return lambda instance: computed()
+
+
+def _dependents(cls):
+    dependents = { }
+
+    for field in cls._computed:
+        undefined = [ name for name in field.depends if name not in cls._fields_by_name ]
+
+        if undefined:
+            message = 'Model {model} computed field {field} depends on undefined fields: {fields}'.format(
+                model=cls.__name__,
+                field=field.name,
+                fields=undefined
+            )
+            raise AttributeError(message)
+
+        if field.cached:
+            for name in field.depends:
+                dependents[name] = dependents.get(name, ( )) + (field.name, )
+
+    return MappingProxyType(dependents)
+
+
+_missing = object()
+
+
+class _Everything(object):
+
+    # the changes of a new instance, every stored field is dirty so marking
+    # more keys is a no-op and nothing is allocated per instance
+    __slots__ = ( )
+
+    def __contains__(self, key):
+        return True
+
+    def update(self, keys):
+        pass
+
+
+_everything = _Everything()
+_nothing = frozenset()
+
+
+def _key(value):
+    if isinstance(value, Model):
+        return value._state()[value._primary.name]
+    return value
+
+
+def foreign_key(field, value):
+    if issubclass(field.type, Model):
+        return _key(value)
+    return list(map(_key, value))
+
+
+def _defer(self, kargs):
+    # only documents read from the backend are deferred, client input is
+    # built and validated on set like any other model
+    raw = None
+
+    for field in self._nested:
+        if type(kargs.get(field.name)) is dict:
+            if raw is None:
+                kargs = dict(kargs)
+                raw = { }
+                object.__setattr__(self, '_raw', raw)
+            raw[field.name] = kargs.pop(field.name)
+
+    self._hydrate(kargs)
+
+
+def _lazy_store(store):
+
+    def _store(self, key, value):
+        # the raw document is only dropped once the value is stored, a failed
+        # build keeps it for serialize
+        store(self, key, value)
+        raw = getattr(self, '_raw', None)
+        if raw:
+            raw.pop(key, None)
+
+    _store.lazy = _store.generated = True
+    return _store
+
+
+def _lazy_serialize(serialize):
+
+    def serialize_lazy(self, verify=False, fields=None, exclude=None):
+        if fields is not None or exclude is not None:
+            return self._projection(verify, fields, exclude)
+
+        raw = getattr(self, '_raw', None)
+
+        if raw and verify:
+            for key in list(raw):
+                getattr(self, key)
+            raw = None
+
+        obj = serialize(self, verify)
+        if raw:
+            obj.update(raw)
+        return obj
+
+    serialize_lazy.lazy = serialize_lazy.generated = True
+    return serialize_lazy
+
+
+def _slotted_store(self, key, value):
+    convert = self._converters.get(key)
+    if not convert:
+        self._check_field(key)
+    object.__setattr__(self, slot_name(key), convert(value))
+
+
+def _slotted_state(self):
+    state = { }
+    for field in self._fields:
+        value = getattr(self, slot_name(field.name), _missing)
+        if value is not _missing:
+            state[field.name] = value
+    return state
+
+
+_slotted_store.generated = _slotted_state.generated = True
+
 
 class Model(object, metaclass=ModelMeta):
 
+    __slots__ = ('_changed', '_raw', '_memo')
+
+    compiled = False
+    slotted = False
+    lazy = False
+
+    codec = 'json'
+
     def __init__(self, dictionary=None, **kargs):
-        self._check_computed(self._computed)
-        self.set(dictionary, **kargs)
+        if self._computed:
+            self._check_computed()
+        if dictionary:
+            dictionary.update(kargs)
+            kargs = dictionary
+        self._hydrate(kargs)
+        object.__setattr__(self, '_changed', _everything)
 
     def __repr__(self):
         return repr(self.serialize())
 
+    @classmethod
+    def from_many(cls, documents):
+        models = [ ]
+        new = cls.__new__
+        hydrate = _defer if cls.lazy and cls._nested else cls._hydrate
+
+        if cls._computed:
+            cls._check_computed()
+
+        for document in documents:
+            model = new(cls)
+            hydrate(model, document)
+            if cls._nested:
+                model._clean()
+            models.append(model)
+
+        return models
+
+    @classmethod
+    def _validator(cls):
+        validate = cls.__dict__.get('_validate')
+        if validate is None:
+            validate = compile_validate(cls)
+            setattr(cls, '_validate', validate)
+        return validate
+
+    @classmethod
+    def validate(cls, document, partial=False):
+        errors = cls._validator()(document, ( ), [ ], partial)
+
+        if errors:
+            message = 'Model {model} has invalid fields: {fields}'.format(
+                model=cls.__name__,
+                fields=list(map(lambda error: error['field'], errors))
+            )
+            raise ValidationError(message, errors)
+
     def __setattr__(self, name, value):
         self._set(name, value)
 
-    def _check_computed(self, fields):
-        methods = list(filter(lambda field: isinstance(field.computed, str), fields))
+    @classmethod
+    def _check_computed(cls):
+        computers = cls.__dict__.get('_computers')
+        if computers is not None:
+            return computers
 
-        missing = list(filter(lambda field: not hasattr(self, field.computed), methods))
+        methods = list(filter(lambda field: isinstance(field.computed, str), cls._computed))
+
+        missing = list(filter(lambda field: not hasattr(cls, field.computed), methods))
 
         if len(missing) > 0:
             names = list(map(lambda field: field.computed, missing))
             message = 'Model {model} has missing methods: {fields}'.format(
-                model=self.__class__.__name__,
+                model=cls.__name__,
                 fields=names
             )
             raise AttributeError(message)
 
-        for field in methods:
-            field.computed = getattr(self, field.computed)
+        computers = { }
+
+        for field in cls._computed:
+            computers[field.name] = _computer(cls, field)
 
-        invalid = list(filter(lambda field: not (inspect.isfunction(field.computed) or inspect.ismethod(field.computed)), fields))
+        invalid = list(filter(lambda field: computers[field.name] is None, cls._computed))
 
         if len(invalid) > 0:
             names = list(map(lambda field: field.computed, invalid))
             message = 'Model {model} computed fields must be method names or functions: {fields}'.format(
-                model=self.__class__.__name__,
+                model=cls.__name__,
                 fields=names
             )
             raise AttributeError(message)
 
+        # resolved once per class and called with the instance, fields are never rebound
+        computers = MappingProxyType(computers)
+        setattr(cls, '_computers', computers)
+        return computers
+
     def _check_missing(self, kargs):
-        missing = list(map(lambda field: field.name, filter(lambda field: field.name not in self.__dict__, self._required)))
+        missing = [ field.name for field in self._required if field.name not in kargs ]
 
-        if len(missing) > 0:
+        if missing:
             message = 'Model {model} has missing fields: {fields}'.format(
                 model=self.__class__.__name__,
                 fields=missing
             )
-            raise AttributeError(message)
+            raise ValidationError(message, [ _error((name, ), 'missing', 'is required') for name in missing ])
 
     def _check_undefined(self, kargs):
-        undefined = list(filter(lambda karg: karg not in map(lambda field: field.name, self._fields), kargs))
+        if self._field_names.issuperset(kargs):
+            return
+
+        undefined = [ karg for karg in kargs if karg not in self._field_names ]
 
-        if len(undefined) > 0:
+        if undefined:
             message = 'Model {model} has undefined fields: {fields}'.format(
                 model=self.__class__.__name__,
                 fields=undefined
             )
-            raise AttributeError(message)
+            raise ValidationError(message, [ _error((name, ), 'undefined', 'is not defined') for name in undefined ])
 
     def _check_field(self, key):
-        field = list(filter(lambda field: field.name == key, self._fields))
+        field = self._fields_by_name.get(key)
 
         if not field:
             message = 'Model {model} does not have field: {field}'.format(
@@ -167,17 +482,88 @@ class Model(object, metaclass=ModelMeta):
             )
             raise AttributeError(message)
 
-        return field[0]
+        return field
+
+    def _store(self, key, value):
+        convert = self._converters.get(key)
+        if not convert:
+            self._check_field(key)
+        self.__dict__[key] = convert(value)
 
     def _set(self, key, value):
-        field = self._check_field(key)
-        if not type(field.type) == type:
-            if type(value) == dict:
-                self.__dict__[key] = field.type(**value)
-            else:
-                self.__dict__[key] = value
-        else:
-            self.__dict__[key] = field.type(value)
+        self._store(key, value)
+        self._mark(key)
+
+    def _state(self):
+        return self.__dict__
+
+    def _mark(self, *keys):
+        # a clean model shares one empty frozenset, the set is only
+        # allocated on the first change after that
+        try:
+            self._changed.update(keys)
+        except AttributeError:
+            object.__setattr__(self, '_changed', set(keys))
+
+        if self._dependents:
+            self._invalidate(*keys)
+
+    def _invalidate(self, *keys):
+        memo = getattr(self, '_memo', None)
+        if not memo:
+            return
+
+        for key in keys:
+            for name in self._dependents.get(key, ( )):
+                memo.pop(name, None)
+
+    def _clean(self):
+        object.__setattr__(self, '_changed', _nothing)
+
+        state = self._state()
+        for field in self._nested:
+            if field.name in state:
+                state[field.name]._clean()
+
+    def touch(self, *fields):
+        for field in fields:
+            self._check_field(field)
+        self._mark(*fields)
+
+    def _changes(self):
+        try:
+            changed = self._changed
+        except AttributeError:
+            changed = ( )
+
+        state = self._state()
+        partial = { }
+
+        raw = getattr(self, '_raw', None) if self.lazy else None
+
+        for field in self._fields:
+            if field.name not in state:
+                if raw and field.name in raw and field.name in changed:
+                    partial[field.name] = raw[field.name]
+                continue
+            value = state[field.name]
+            if field.name in changed:
+                if field.relation:
+                    value = foreign_key(field, value)
+                elif field in self._nested:
+                    value = value.serialize()
+                partial[field.name] = value
+            elif field in self._nested:
+                nested = value._changes()
+                if nested:
+                    partial[field.name] = nested
+
+        if partial:
+            for field in self._computed:
+                if not field.computed_empty and field not in self._nested:
+                    partial[field.name] = self._compute(field)
+
+        return partial
 
     def set(self, _dictionary=None, **kargs):
         if not _dictionary:
@@ -186,26 +572,166 @@ class Model(object, metaclass=ModelMeta):
         _dictionary.update(kargs)
         kargs = _dictionary
 
+        self._hydrate(kargs)
+        self._mark(*kargs)
+
+    def _hydrate(self, kargs):
         self._check_undefined(kargs)
 
         for karg in kargs:
-            self._set(karg, kargs[karg])
+            self._store(karg, kargs[karg])
+
+    def _compute(self, field):
+        if field.cached:
+            memo = getattr(self, '_memo', None)
+            if memo is None:
+                memo = { }
+                object.__setattr__(self, '_memo', memo)
+            elif field.name in memo:
+                return memo[field.name]
+            value = memo[field.name] = self._evaluate(field)
+            return value
+        return self._evaluate(field)
+
+    def _evaluate(self, field):
+        computers = self.__class__.__dict__.get('_computers') or self._check_computed()
+        value = computers[field.name](self)
+        if field.computed_type:
+            return value
+        return field.type(value)
+
+    def serialize(self, verify=False, fields=None, exclude=None):
+        if fields is not None or exclude is not None:
+            return self._projection(verify, fields, exclude)
+
+        state = self._state()
 
-    def serialize(self, verify=False):
         if verify:
-            self._check_missing(self.__dict__)
+            self._check_missing(state)
 
-        obj = self.__dict__.copy()
+        obj = state.copy()
 
-        for field in self._fields:
-            if issubclass(field.type, Model):
-                obj[field.name] = self.__dict__[field.name].serialize(verify)
+        for field in self._serialized:
+            if field.relation:
+                if field.name in obj:
+                    obj[field.name] = foreign_key(field, obj[field.name])
+            elif issubclass(field.type, Model):
+                if field.name in obj:
+                    obj[field.name] = obj[field.name].serialize(verify)
             elif field.computed:
                 if field.computed_empty:
                     continue
-                if field.computed_type:
-                    obj[field.name] = field.computed()
+                obj[field.name] = self._compute(field)
+
+        return obj
+
+    def _projection(self, verify, fields, exclude):
+        include = projection.tree(fields) if fields is not None else None
+        return self._project(verify, include, projection.tree(exclude or ( )))
+
+    def _project(self, verify, include, exclude):
+        names = self._field_names
+
+        if not (names.issuperset(include or ( )) and names.issuperset(exclude)):
+            undefined = [ name for name in list(include or ( )) + list(exclude) if name not in names ]
+            message = 'Model {model} does not have fields: {fields}'.format(
+                model=self.__class__.__name__,
+                fields=undefined
+            )
+            raise AttributeError(message)
+
+        raw = getattr(self, '_raw', None) if self.lazy else None
+
+        if raw and verify:
+            for key in list(raw):
+                getattr(self, key)
+
+        state = self._state()
+
+        if verify:
+            self._check_missing(state)
+
+        obj = { }
+
+        fields = self._fields if include is None else map(self._fields_by_name.__getitem__, include)
+
+        for field in fields:
+            name = field.name
+
+            inner = include[name] if include is not None else None
+            outer = exclude.get(name, { })
+
+            if outer is None:
+                continue
+
+            if (inner or outer) and field not in self._nested:
+                message = 'Model {model} cannot project into field: {field}'.format(
+                    model=self.__class__.__name__,
+                    field=name
+                )
+                raise AttributeError(message)
+
+            if field in self._related:
+                if name in state:
+                    obj[name] = foreign_key(field, state[name])
+            elif field in self._nested:
+                if name in state:
+                    value = state[name]
+                elif raw and name in raw:
+                    if not (inner or outer):
+                        obj[name] = raw[name]
+                        continue
+                    value = getattr(self, name)
+                else:
+                    continue
+                if inner or outer:
+                    obj[name] = value._project(verify, inner, outer)
                 else:
-                    obj[field.name] = field.type(field.computed())
+                    obj[name] = value.serialize(verify)
+            elif field.computed and not field.computed_empty:
+                obj[name] = self._compute(field)
+            elif name in state:
+                obj[name] = state[name]
 
         return obj
+
+    def _encodable(self):
+        # nested models stay in place, codecs reach them through their default hook
+        state = self._state()
+        raw = getattr(self, '_raw', None) if self.lazy else None
+
+        if not (self._encoded or raw):
+            return state
+
+        obj = state.copy()
+
+        if raw:
+            obj.update(raw)
+
+        for field in self._encoded:
+            if field.relation:
+                if field.name in obj:
+                    obj[field.name] = foreign_key(field, obj[field.name])
+            else:
+                obj[field.name] = self._compute(field)
+
+        return obj
+
+    def dumps(self, codec=None):
+        return Codec.get(codec or self.codec).dumps(self)
+
+    @classmethod
+    def loads(cls, data, codec=None):
+        return cls.from_many([Codec.get(codec or cls.codec).loads(data)])[0]
+
+    @classmethod
+    def encode_many(cls, models, codec=None):
+        return Codec.get(codec or cls.codec).encode_many(models)
+
+    @classmethod
+    def decode_many(cls, data, codec=None):
+        return cls.from_many(Codec.get(codec or cls.codec).loads(data))
+
+    @classmethod
+    def iterencode(cls, models, size=100, codec=None):
+        return Codec.get(codec or cls.codec).iterencode(models, size)
@@ -0,0 +1,33 @@
+import asyncio
+
+from tornado import process
+
+from . database import database
+
+
+# schema checks run once in the parent, which then closes every connection
+# so forked children inherit the schema state but no sockets
+async def prepare(models):
+    models = list(models)
+
+    await asyncio.gather(*map(lambda model: model.connect(), models))
+
+    for model in models:
+        await model.close()
+    await database.close()
+
+
+# each child opens its own pools before it starts serving requests
+async def warm_up(models):
+    await asyncio.gather(*map(lambda model: model.backend.warm_up(model), models))
+
+
+def fork_processes(models, num_processes=None, max_restarts=None):
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(prepare(models))
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+
+    return process.fork_processes(num_processes, max_restarts)
@@ -0,0 +1,56 @@
+import functools
+
+
+def tree(paths):
+    return _tree(tuple(paths))
+
+
+@functools.lru_cache(maxsize=256)
+def _tree(paths):
+    # dotted paths become nested dicts, None marks a field selected whole
+    root = { }
+
+    for path in paths:
+        node = root
+        *parents, last = path.split('.')
+
+        for name in parents:
+            child = node.get(name, { })
+            if child is None:
+                break
+            node[name] = child
+            node = child
+        else:
+            node[last] = None
+
+    return root
+
+
+def select(document, paths):
+    return _select(document, tree(paths))
+
+
+def _select(document, node):
+    selected = { }
+
+    for key, child in node.items():
+        if key not in document:
+            continue
+        value = document[key]
+        if child is None:
+            selected[key] = value
+        elif isinstance(value, dict):
+            selected[key] = _select(value, child)
+
+    return selected
+
+
+def selector(paths):
+    node = tree(paths)
+    names = [ key for key, child in node.items() if child is None ]
+    nested = { key: _selector(child) for key, child in node.items() if child is not None }
+    return names + [ nested ] if nested else names
+
+
+def _selector(node):
+    return { key: True if child is None else _selector(child) for key, child in node.items() }
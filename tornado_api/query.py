@@ -0,0 +1,264 @@
+import rethinkdb as r
+
+from . import projection
+from . metrics import measure, measure_stream
+
+
+class Query(object):
+
+    reducers = ('count', 'sum', 'avg', 'min', 'max')
+
+    def __init__(self, model):
+        self.model = model
+
+        self._filters = [ ]
+        self._order = None
+        self._descending = False
+        self._between = None
+        self._limit = None
+        self._pluck = None
+        self._prefetch = None
+        self._batch_size = None
+
+    def __repr__(self):
+        message = '<Query {model} filter:{filters} order_by:{order} descending:{descending} between:{between} limit:{limit} pluck:{pluck}>'
+        return message.format(
+            model=self.model.__name__,
+            filters=self._filters,
+            order=self._order,
+            descending=self._descending,
+            between=self._between,
+            limit=self._limit,
+            pluck=self._pluck
+        )
+
+    def _copy(self, **changes):
+        query = Query(self.model)
+        query.__dict__.update(self.__dict__)
+        query._filters = list(self._filters)
+        for key, value in changes.items():
+            setattr(query, key, value)
+        return query
+
+    def _index(self, field):
+        # a list of fields needs a compound index defined in the same order
+        fields = field if isinstance(field, list) else [field]
+        index, indexed = self.model._index_for(fields)
+        if indexed != fields:
+            message = 'Model {model} has no index on: {fields}'.format(
+                model=self.model.__name__,
+                fields=fields
+            )
+            raise AttributeError(message)
+        return index or self.model._primary.name
+
+    def filter(self, _dictionary=None, **kargs):
+        filters = dict(_dictionary or { }, **kargs)
+        return self._copy(_filters=self._filters + [filters])
+
+    def order_by(self, field, descending=False):
+        return self._copy(_order=field, _descending=descending)
+
+    def between(self, lower=r.minval, upper=r.maxval, field=None, left_bound='closed', right_bound='open'):
+        field = field or self._order or self.model._primary.name
+        return self._copy(_between=(lower, upper, field, left_bound, right_bound))
+
+    def after(self, value, field=None, key=None):
+        field = field or self._order or self.model._primary.name
+        # key breaks ties on the primary key through an index on [field, primary]
+        if key is not None:
+            field = [field, self.model._primary.name]
+            value = [value, key]
+        if self._descending:
+            return self.between(r.minval, value, field=field)
+        return self.between(value, r.maxval, field=field, left_bound='open', right_bound='closed')
+
+    def limit(self, count):
+        return self._copy(_limit=count)
+
+    def pluck(self, *fields):
+        fields = list(fields)
+        if self.model._primary.name not in fields:
+            fields.append(self.model._primary.name)
+        return self._copy(_pluck=fields)
+
+    def only(self, *fields):
+        paths = self.model._only(fields)
+        if paths is None:
+            return self._copy(_pluck=None)
+        return self._copy(_pluck=paths)
+
+    def prefetch(self, *fields):
+        return self._copy(_prefetch=list(fields))
+
+    def batch(self, size):
+        return self._copy(_batch_size=size)
+
+    def _indexed(self, field):
+        try:
+            self._index(field)
+        except AttributeError:
+            return False
+        return True
+
+    def compile(self):
+        query = self.model.r
+
+        if self._between:
+            lower, upper, field, left_bound, right_bound = self._between
+            query = query.between(lower, upper, index=self._index(field), left_bound=left_bound, right_bound=right_bound)
+
+        order = None
+        if self._order:
+            fields = self._order if isinstance(self._order, list) else [self._order]
+            order = list(map(r.desc if self._descending else r.asc, fields))
+
+        if self._order and self._indexed(self._order):
+            index = self._index(self._order)
+            query = query.order_by(index=r.desc(index) if self._descending else r.asc(index))
+            order = None
+
+        for filters in self._filters:
+            query = query.filter(filters)
+
+        if order is not None:
+            query = query.order_by(*order)
+
+        if self._limit is not None:
+            query = query.limit(self._limit)
+
+        if self._pluck:
+            query = query.pluck(*projection.selector(self._pluck))
+
+        return query
+
+    def _plain(self):
+        return not (self._filters or self._between or self._limit is not None)
+
+    def _lookup(self):
+        if len(self._filters) != 1 or self._between or self._order:
+            return None
+
+        filters = self._filters[0]
+        try:
+            index, fields = self.model._index_for(filters)
+        except AttributeError:
+            return None
+
+        key = filters[fields[0]] if len(fields) == 1 else list(map(filters.get, fields))
+        return key, index
+
+    def selection(self):
+        # an equality filter matching an index reads through get_all instead of a table scan
+        lookup = self._lookup()
+        if lookup is None:
+            return self._copy(_pluck=None).compile()
+
+        key, index = lookup
+        if index:
+            query = self.model.r.get_all(key, index=index)
+        else:
+            query = self.model.r.get_all(key)
+
+        if self._limit is not None:
+            query = query.limit(self._limit)
+
+        return query
+
+    def _check_field(self, field):
+        if field not in self.model._field_names:
+            message = 'Model {model} does not have field: {field}'.format(
+                model=self.model.__name__,
+                field=field
+            )
+            raise AttributeError(message)
+
+    async def count(self):
+        await self.model.connect()
+        return await measure(self.model, 'count', self.model.backend.count(self.model, self))
+
+    async def sum(self, field):
+        self._check_field(field)
+        await self.model.connect()
+        return await measure(self.model, 'sum', self.model.backend.sum(self.model, self, field))
+
+    async def distinct(self, field):
+        self._check_field(field)
+        await self.model.connect()
+        return await measure(self.model, 'distinct', self.model.backend.distinct(self.model, self, field))
+
+    async def group_by(self, field, reducer='count', value=None):
+        self._check_field(field)
+
+        if reducer not in self.reducers:
+            message = 'Query reducer must be one of {reducers}: {reducer}'.format(
+                reducers=list(self.reducers),
+                reducer=reducer
+            )
+            raise ValueError(message)
+
+        if reducer != 'count':
+            if value is None:
+                raise ValueError('Query reducer {reducer} needs a value field'.format(reducer=reducer))
+            self._check_field(value)
+
+        await self.model.connect()
+        return await measure(self.model, 'group_by', self.model.backend.group(self.model, self, field, reducer, value))
+
+    async def _hydrate(self, documents):
+        models = self.model.from_many(documents)
+        if self._prefetch:
+            await self.model.prefetch(models, self._prefetch)
+        return models
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        await self.model.connect()
+
+        size = self._batch_size or self.model.batch_size
+
+        async for documents in measure_stream(self.model, 'query', self.model.backend.stream(self.model, self, size)):
+            for model in await self._hydrate(documents):
+                yield model
+
+    async def all(self):
+        await self.model.connect()
+        documents = await measure(self.model, 'query', self.model.backend.query(self.model, self))
+        return await self._hydrate(documents)
+
+    async def first(self):
+        models = await self.limit(1).all()
+        if models:
+            return models[0]
+
+    async def pages(self, size, field=None):
+        field = field or self._order or self.model._primary.name
+        primary = self.model._primary.name
+
+        # rows sharing a value are ordered and resumed on the primary key, the
+        # index is checked up front so every backend fails before the first page
+        order = field if field == primary else [field, primary]
+        self._index(order)
+
+        query = self.order_by(order, self._descending).limit(size)
+
+        if query._pluck and field not in query._pluck:
+            query = query._copy(_pluck=query._pluck + [field])
+
+        while True:
+            page = await query.all()
+            if not page:
+                return
+
+            yield page
+
+            if len(page) < size:
+                return
+
+            last = page[-1]._state()
+            if field == primary:
+                query = query.after(last[field], field=field)
+            else:
+                query = query.after(last[field], field=field, key=last[primary])
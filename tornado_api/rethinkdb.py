@@ -1,81 +1,581 @@
+import asyncio
+import warnings
+
 import rethinkdb as r
 
 from . database import database
+from . import projection
 from . model import Model
+from . schema import Schema
+from . query import Query
+from . cache import Cache
+from . loader import Loader
+from . feed import Subscription
+from . backend import RethinkDBBackend
+from . metrics import measure
+
 
 class RethinkDBModel(Model):
 
+    __slots__ = ( )
+
     db_options = { }
     table_options = { }
-
-    connection = None
+    pool_options = { }
 
     r = None
     _db = None
 
     _ensure = True
 
+    batch_size = 200
+
+    compound_indexes = { }
+    drop_stale_indexes = False
+
+    cache_options = None
+    _cache = None
+
+    backend = RethinkDBBackend()
+
+    @classmethod
+    def acquire(cls):
+        return database.pool(cls.db_options, **cls.pool_options).connection()
+
     @classmethod
     async def connect(cls):
-        if not cls.connection or not cls.connection.is_open():
-            cls.connection = await database.connect(**cls.db_options)
+        await cls.backend.connect(cls)
 
-        if cls._ensure:
-            await cls._ensure_database()
-            await cls._ensure_table()
-            await cls._ensure_indexes()
-            cls._ensure = False
+    @classmethod
+    async def _ensure_all(cls):
+        await measure(cls, 'ensure', cls._ensure_schema())
+
+    @classmethod
+    async def _ensure_schema(cls):
+        async with cls.acquire() as connection:
+            await cls._ensure_database(connection)
+            await cls._ensure_table(connection)
+            await cls._ensure_indexes(connection)
+        cls._ensure = False
+
+    @classmethod
+    async def ensure_all(cls, models):
+        await asyncio.gather(*map(lambda model: model.connect(), models))
 
     @classmethod
     async def close(cls):
-        if cls.connection and cls.connection.is_open():
-            await cls.connection.close()
+        if cls.__dict__.get('_cache') is not None:
+            await cls._cache.close()
+        await cls.backend.close(cls)
+
+    @classmethod
+    def cache(cls):
+        if cls.cache_options is None:
+            return None
+        if cls.__dict__.get('_cache') is None:
+            cls._cache = Cache(cls, **cls.cache_options)
+        return cls._cache
+
+    @classmethod
+    def _discard(cls, *keys):
+        cache = cls.cache()
+        if cache is not None:
+            for key in keys:
+                cache.discard(key)
+
+        loader = Loader.current()
+        if loader is not None:
+            for key in keys:
+                loader.discard(cls, key)
 
     @classmethod
-    async def _ensure_database(cls):
-        databases = await r.db_list().run(cls.connection)
+    async def _run(cls, query):
+        pool = database.pool(cls.db_options, **cls.pool_options)
+        connection = await measure(cls, 'connect', pool.acquire())
+        try:
+            return await query.run(connection)
+        finally:
+            await pool.release(connection)
+
+    @classmethod
+    async def _ensure_database(cls, connection):
         db = cls.db_options.get('db', 'test')
-        if not db in databases:
-            await r.db_create(db).run(cls.connection)
+        await Schema.ensure_database(cls.db_options, db, connection)
         cls._db = r.db(db)
 
     @classmethod
-    async def _ensure_table(cls):
-        tables = await cls._db.table_list().run(cls.connection)
-        cls.table_options['primary_key'] = cls._primary.name
-        if not cls._table in tables:
-            await cls._db.table_create(cls._table, **cls.table_options).run(cls.connection)
+    async def _ensure_table(cls, connection):
+        db = cls.db_options.get('db', 'test')
+        options = dict(cls.table_options, primary_key=cls._primary.name)
+        await Schema.ensure_table(cls.db_options, db, cls._table, options, connection)
         cls.r = cls._db.table(cls._table)
 
     @classmethod
-    async def _ensure_indexes(cls):
-        pass
+    def _index_definitions(cls):
+        indexes = { field.name: [field.name] for field in cls._indexed if not field.primary }
+
+        for name, fields in cls.compound_indexes.items():
+            undefined = list(filter(lambda field: field not in cls._field_names, fields))
+            if undefined:
+                message = 'Model {model} compound index {index} has undefined fields: {fields}'.format(
+                    model=cls.__name__,
+                    index=name,
+                    fields=undefined
+                )
+                raise AttributeError(message)
+            indexes[name] = list(fields)
+
+        return indexes
 
     @classmethod
-    async def drop(cls):
+    def _index_for(cls, fields):
+        if list(fields) == [cls._primary.name]:
+            return None, list(fields)
+
+        for name, indexed in cls._index_definitions().items():
+            if sorted(indexed) == sorted(fields):
+                return name, indexed
+
+        message = 'Model {model} has no index on: {fields}'.format(
+            model=cls.__name__,
+            fields=sorted(fields)
+        )
+        raise AttributeError(message)
+
+    @classmethod
+    async def _ensure_indexes(cls, connection):
+        indexes = cls._index_definitions()
+        existing = set(await cls.r.index_list().run(connection))
+
+        missing = list(filter(lambda name: name not in existing, indexes))
+
+        for name in missing:
+            fields = indexes[name]
+            if fields == [name]:
+                await cls.r.index_create(name).run(connection)
+            else:
+                await cls.r.index_create(name, list(map(lambda field: r.row[field], fields))).run(connection)
+
+        if missing:
+            await cls.r.index_wait(*missing).run(connection)
+
+        stale = sorted(existing - set(indexes))
+
+        if stale and cls.drop_stale_indexes:
+            for name in stale:
+                await cls.r.index_drop(name).run(connection)
+        elif stale:
+            message = 'Model {model} table {table} has stale indexes: {indexes}'.format(
+                model=cls.__name__,
+                table=cls._table,
+                indexes=stale
+            )
+            warnings.warn(message)
+
+    @classmethod
+    async def find_by(cls, scan=False, prefetch=None, only=None, **kargs):
+        undefined = list(filter(lambda karg: karg not in cls._field_names, kargs))
+        if undefined or not kargs:
+            message = 'Model {model} cannot find by undefined fields: {fields}'.format(
+                model=cls.__name__,
+                fields=undefined
+            )
+            raise AttributeError(message)
+
+        paths = cls._only(only) if only is not None else None
+
         await cls.connect()
-        tables = await cls._db.table_list().run(cls.connection)
-        if cls._table in tables:
-            await cls._db.table_drop(cls._table).run(cls.connection)
-            cls._ensure = True
+
+        try:
+            index, fields = cls._index_for(kargs)
+        except AttributeError:
+            if not scan:
+                raise
+            query = cls.query().filter(kargs)
+            if paths:
+                query = query.pluck(*paths)
+            results = await measure(cls, 'find_by', cls.backend.query(cls, query))
+        else:
+            key = kargs[fields[0]] if len(fields) == 1 else list(map(kargs.get, fields))
+            results = await measure(cls, 'find_by', cls.backend.get_all(cls, [key], index=index, fields=paths))
+
+        models = cls.from_many(results)
+
+        if prefetch:
+            await cls.prefetch(models, prefetch)
+
+        return models
+
+    @classmethod
+    async def drop(cls):
+        await cls.backend.drop(cls)
+
+        cache = cls.cache()
+        if cache is not None:
+            cache.clear()
 
     @classmethod
-    async def read(cls, id):
+    async def read(cls, id, prefetch=None, only=None):
+        paths = cls._only(only) if only is not None else None
+
         await cls.connect()
-        result = await cls.r.get(id).run(cls.connection)
+
+        loader = Loader.current()
+        cache = cls.cache()
+        if paths:
+            # projected documents bypass the loader and are never cached
+            result = (await cls._load_many([id], paths)).get(id)
+        elif loader is not None:
+            result = await asyncio.shield(loader.load(cls, id))
+        elif cache is not None:
+            result = await cache.load(id, lambda: measure(cls, 'read', cls.backend.get(cls, id)))
+        else:
+            result = await measure(cls, 'read', cls.backend.get(cls, id))
+
         if result:
-            return cls(result)
+            model = cls.from_many([result])[0]
+            if prefetch:
+                await cls.prefetch([model], prefetch)
+            return model
+
+    @classmethod
+    async def read_many(cls, ids, prefetch=None, only=None):
+        ids = list(ids)
+        if not ids:
+            return [ ]
+
+        paths = cls._only(only) if only is not None else None
+
+        await cls.connect()
+
+        loader = Loader.current()
+        if loader is not None and not paths:
+            found = await asyncio.shield(asyncio.gather(*map(lambda id: loader.load(cls, id), ids)))
+        else:
+            documents = await cls._load_many(list(dict.fromkeys(ids)), paths)
+            found = list(map(documents.get, ids))
+
+        models = cls.from_many(filter(None, found))
+
+        if prefetch:
+            await cls.prefetch(models, prefetch)
+
+        models = iter(models)
+        return [ next(models) if document else None for document in found ]
+
+    @classmethod
+    async def _load_many(cls, ids, fields=None):
+        documents = { }
+
+        cache = cls.cache()
+        if cache is not None:
+            for id in ids:
+                document = cache.get(id)
+                if document is not None:
+                    documents[id] = projection.select(document, fields) if fields else document
+            ids = list(filter(lambda id: id not in documents, ids))
+            cache.misses += len(ids)
+
+        if ids:
+            await cls.connect()
+            results = await measure(cls, 'read_many', cls.backend.get_all(cls, ids, fields=fields))
+            for result in results:
+                documents[result[cls._primary.name]] = result
+                if cache is not None and not fields:
+                    cache.put(result[cls._primary.name], result)
+
+        return documents
+
+    @classmethod
+    def query(cls):
+        return Query(cls)
+
+    @classmethod
+    def _filtered(cls, filter):
+        query = cls.query()
+        if filter:
+            query = query.filter(filter)
+        return query
+
+    @classmethod
+    async def count(cls, filter=None):
+        return await cls._filtered(filter).count()
+
+    @classmethod
+    async def sum(cls, field, filter=None):
+        return await cls._filtered(filter).sum(field)
+
+    @classmethod
+    async def distinct(cls, field, filter=None):
+        return await cls._filtered(filter).distinct(field)
+
+    @classmethod
+    async def group_by(cls, field, reducer='count', value=None, filter=None):
+        return await cls._filtered(filter).group_by(field, reducer, value)
+
+    @classmethod
+    def _only(cls, fields):
+        paths = [ cls._primary.name ]
+
+        for path in fields:
+            field = cls._fields_by_name.get(path.split('.', 1)[0])
+
+            if not field:
+                message = 'Model {model} does not have field: {field}'.format(
+                    model=cls.__name__,
+                    field=path
+                )
+                raise AttributeError(message)
+
+            if '.' in path and field not in cls._nested:
+                message = 'Model {model} cannot project into field: {field}'.format(
+                    model=cls.__name__,
+                    field=field.name
+                )
+                raise AttributeError(message)
+
+            if field.computed and not field.computed_empty:
+                # a computed field needs its dependencies, or the whole document
+                if not field.depends:
+                    return None
+                paths.extend(field.depends)
+            else:
+                paths.append(path)
+
+        return list(dict.fromkeys(paths))
+
+    @classmethod
+    def subscribe(cls, query=None, include_initial=False, size=1000, policy='drop_oldest'):
+        return Subscription(cls, query, include_initial=include_initial, size=size, policy=policy)
+
+    @classmethod
+    async def prefetch(cls, models, fields):
+        models = list(filter(None, models))
+        await asyncio.gather(*map(lambda field: cls._prefetch(models, field), fields))
+        return models
+
+    @classmethod
+    async def _prefetch(cls, models, name):
+        field = cls._fields_by_name.get(name)
+
+        if not field or not field.relation:
+            message = 'Model {model} does not have related field: {field}'.format(
+                model=cls.__name__,
+                field=name
+            )
+            raise AttributeError(message)
+
+        many = not issubclass(field.type, Model)
+
+        values = { }
+        keys = [ ]
+
+        for model in models:
+            value = model._state().get(name)
+            if value is None:
+                continue
+            values[model] = value if many else [value]
+            keys.extend(filter(lambda key: not isinstance(key, Model), values[model]))
+
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return
+
+        related = dict(zip(keys, await field.relation.read_many(keys)))
+
+        def resolve(key):
+            if isinstance(key, Model):
+                return key
+            return related.get(key) or key
+
+        for model, value in values.items():
+            resolved = list(map(resolve, value))
+            model._store(name, resolved if many else resolved[0])
 
     async def create(self):
         await self.connect()
-        result = await self.r.insert(self.serialize(verify=True)).run(self.connection)
-        print(result)
+        documents = [self.serialize(verify=True)]
+        result = await measure(type(self), 'create', self.backend.insert(type(self), documents), documents)
+        # a failed insert leaves the model dirty, the errors are in the result
+        if result.get('errors'):
+            return result
+        keys = result.get('generated_keys')
+        if keys:
+            self._store(self._primary.name, keys[0])
+        self._discard(self._state()[self._primary.name])
+        self._clean()
+        return result
 
     async def update(self):
+        changes = self._changes()
+        if not changes:
+            return None
+
         await self.connect()
-        result = self.r.get(self.__dict__[self._primary.name]).update(self.serialize()).run(self.connection)
+        key = changes[self._primary.name] = self._state()[self._primary.name]
+        result = await measure(type(self), 'update', self.backend.update(type(self), [changes]), [changes])
+        self._discard(key)
+        self._clean()
+        return result
 
     async def delete(self):
         await self.connect()
-        result = await self.r.get(self.__dict__[self._primary.name]).delete().run(self.connection)
-        print(result)
+        key = self._state()[self._primary.name]
+        result = await measure(type(self), 'delete', self.backend.delete(type(self), [key]), [key])
+        self._discard(key)
+        return result
+
+    @classmethod
+    def _write_options(cls, durability, return_changes):
+        options = { }
+        if durability:
+            options['durability'] = durability
+        if return_changes:
+            options['return_changes'] = return_changes
+        return options
+
+    @classmethod
+    def _serialize_many(cls, models, summary, verify):
+        documents = [ ]
+        valid = [ ]
+
+        for model in models:
+            try:
+                documents.append(model.serialize(verify=verify))
+            except AttributeError as error:
+                summary.errors.append((model._state().get(cls._primary.name), str(error)))
+                continue
+            valid.append(model)
+
+        return documents, valid
+
+    @classmethod
+    async def create_many(cls, models, batch_size=None, durability=None, return_changes=False):
+        summary = BatchSummary(cls._primary.name)
+        options = cls._write_options(durability, return_changes)
+
+        await cls.connect()
+
+        for chunk in _chunks(models, batch_size or cls.batch_size):
+            documents, valid = cls._serialize_many(chunk, summary, True)
+            if not documents:
+                continue
+
+            result = await measure(cls, 'create_many', cls.backend.insert(cls, documents, **options), documents)
+            summary.add(result)
+
+            keys = iter(result.get('generated_keys', ( )))
+            for model in valid:
+                if cls._primary.name not in model._state():
+                    model._store(cls._primary.name, next(keys))
+                cls._discard(model._state()[cls._primary.name])
+                model._clean()
+
+        return summary
+
+    @classmethod
+    async def update_many(cls, models, batch_size=None, durability=None, return_changes=False):
+        summary = BatchSummary(cls._primary.name)
+        options = cls._write_options(durability, return_changes)
+        primary = cls._primary.name
+
+        await cls.connect()
+
+        for chunk in _chunks(models, batch_size or cls.batch_size):
+            documents = [ ]
+            changed = [ ]
+
+            for model in chunk:
+                changes = model._changes()
+                if not changes:
+                    summary.unchanged += 1
+                    continue
+                changes[primary] = model._state()[primary]
+                documents.append(changes)
+                changed.append(model)
+
+            if not documents:
+                continue
+
+            summary.add(await measure(cls, 'update_many', cls.backend.update(cls, documents, **options), documents))
+
+            for model in changed:
+                cls._discard(model._state()[primary])
+                model._clean()
+
+        return summary
+
+    @classmethod
+    async def delete_many(cls, models, batch_size=None, durability=None, return_changes=False):
+        summary = BatchSummary(cls._primary.name)
+        options = cls._write_options(durability, return_changes)
+        primary = cls._primary.name
+
+        await cls.connect()
+
+        for chunk in _chunks(models, batch_size or cls.batch_size):
+            keys = list(map(lambda model: model._state()[primary], chunk))
+            result = await measure(cls, 'delete_many', cls.backend.delete(cls, keys, **options), keys)
+            cls._discard(*keys)
+            summary.add(result)
+
+        return summary
+
+
+class BatchSummary(object):
+
+    counters = ('inserted', 'replaced', 'unchanged', 'skipped', 'deleted')
+
+    def __init__(self, primary):
+        self.primary = primary
+
+        self.inserted = 0
+        self.replaced = 0
+        self.unchanged = 0
+        self.skipped = 0
+        self.deleted = 0
+
+        self.generated_keys = [ ]
+        self.changes = [ ]
+        self.errors = [ ]
+
+    def __repr__(self):
+        message = '<BatchSummary inserted:{inserted} replaced:{replaced} unchanged:{unchanged} skipped:{skipped} deleted:{deleted} errors:{errors}>'
+        return message.format(
+            inserted=self.inserted,
+            replaced=self.replaced,
+            unchanged=self.unchanged,
+            skipped=self.skipped,
+            deleted=self.deleted,
+            errors=len(self.errors)
+        )
+
+    def add(self, result):
+        for counter in self.counters:
+            setattr(self, counter, getattr(self, counter) + result.get(counter, 0))
+
+        self.generated_keys.extend(result.get('generated_keys', ( )))
+
+        attributed = 0
+
+        for change in result.get('changes', ( )):
+            if 'error' in change:
+                document = change.get('new_val') or change.get('old_val') or { }
+                self.errors.append((document.get(self.primary), change['error']))
+                attributed += 1
+            else:
+                self.changes.append(change)
+
+        if result.get('errors', 0) > attributed:
+            self.errors.append((None, result.get('first_error')))
+
+
+def _chunks(items, size):
+    chunk = [ ]
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = [ ]
+    if chunk:
+        yield chunk
@@ -0,0 +1,80 @@
+import asyncio
+
+import rethinkdb as r
+
+from . database import database
+
+
+class Schema(object):
+
+    databases = { }
+    tables = { }
+    pending = { }
+
+    @classmethod
+    def _server(cls, db_options):
+        return database._hash({ key: value for key, value in db_options.items() if key != 'db' })
+
+    @classmethod
+    async def once(cls, key, factory):
+        future = cls.pending.get(key)
+
+        if not future:
+            future = cls.pending[key] = asyncio.ensure_future(factory())
+
+        try:
+            return await asyncio.shield(future)
+        finally:
+            if future.done() and cls.pending.get(key) is future:
+                del cls.pending[key]
+
+    @classmethod
+    async def database_list(cls, db_options, connection):
+        server = cls._server(db_options)
+
+        if server not in cls.databases:
+            databases = await cls.once(('db_list', server), lambda: r.db_list().run(connection))
+            cls.databases.setdefault(server, set(databases))
+
+        return cls.databases[server]
+
+    @classmethod
+    async def table_list(cls, db_options, db, connection):
+        key = (cls._server(db_options), db)
+
+        if key not in cls.tables:
+            tables = await cls.once(('table_list', ) + key, lambda: r.db(db).table_list().run(connection))
+            cls.tables.setdefault(key, set(tables))
+
+        return cls.tables[key]
+
+    @classmethod
+    async def ensure_database(cls, db_options, db, connection):
+        databases = await cls.database_list(db_options, connection)
+
+        if db not in databases:
+            key = ('db_create', cls._server(db_options), db)
+            await cls.once(key, lambda: r.db_create(db).run(connection))
+            databases.add(db)
+
+    @classmethod
+    async def ensure_table(cls, db_options, db, table, options, connection):
+        tables = await cls.table_list(db_options, db, connection)
+
+        if table not in tables:
+            key = ('table_create', cls._server(db_options), db, table)
+            await cls.once(key, lambda: r.db(db).table_create(table, **options).run(connection))
+            tables.add(table)
+
+    @classmethod
+    def discard_table(cls, db_options, db, table):
+        cls.tables.get((cls._server(db_options), db), set()).discard(table)
+
+    @classmethod
+    def clear(cls):
+        cls.databases.clear()
+        cls.tables.clear()
+
+
+# what the parent learnt about the schema stays valid, its pending checks do not
+database.after_fork(Schema.pending.clear)